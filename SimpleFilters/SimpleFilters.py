@@ -1,13 +1,14 @@
-from functools import reduce
 import os,sys
 import unittest
 from __main__ import vtk, qt, ctk, slicer
 from glob import glob
 import json
-from collections import OrderedDict
+import hashlib
+from collections import OrderedDict, namedtuple
 import re
 import threading
 import time
+import socket
 
 try:
   import queue
@@ -17,9 +18,59 @@ except ImportError:
 from time import sleep
 
 # To avoid the overhead of importing SimpleITK during application
-# startup, the import of SimpleITK is delayed until it is needed.
+# startup, the import of SimpleITK, and of the helper modules, is
+# delayed until it is needed.
 sitk = None
 sitkUtils = None
+VolumeBridge = None
+PixelTypes = None
+ResultCache = None
+imageSizeInBytes = None
+FilterBinding = None
+Regions = None
+Tiling = None
+Pipeline = None
+Pyramid = None
+MemoryBudget = None
+Fusion = None
+filterParameterValues = None
+cloneFilter = None
+Profiling = None
+SearchIndex = None
+ThreadTuner = None
+
+def importSimpleITK():
+  """Import SimpleITK and the helper modules of SimpleFiltersLib."""
+  global sitk
+  import SimpleITK as sitk
+  global sitkUtils
+  import sitkUtils
+  global VolumeBridge
+  from SimpleFiltersLib.VolumeBridge import VolumeBridge
+  global PixelTypes
+  from SimpleFiltersLib import PixelTypes
+  global ResultCache, imageSizeInBytes
+  from SimpleFiltersLib.ResultCache import ResultCache, imageSizeInBytes
+  global FilterBinding, filterParameterValues, cloneFilter
+  from SimpleFiltersLib.FilterBinding import FilterBinding, filterParameterValues, cloneFilter
+  global Regions
+  from SimpleFiltersLib import Regions
+  global Tiling
+  from SimpleFiltersLib import Tiling
+  global Pipeline
+  from SimpleFiltersLib.Pipeline import Pipeline
+  global Pyramid
+  from SimpleFiltersLib import Pyramid
+  global MemoryBudget
+  from SimpleFiltersLib import MemoryBudget
+  global Fusion
+  from SimpleFiltersLib import Fusion
+  global Profiling
+  from SimpleFiltersLib import Profiling
+  global SearchIndex
+  from SimpleFiltersLib.SearchIndex import SearchIndex
+  global ThreadTuner
+  from SimpleFiltersLib.ThreadTuning import ThreadTuner
 
 #
 # SimpleFilters
@@ -70,19 +121,184 @@ The developers would like to thank the support of the Slicer Community, the Insi
 
 
 
+#
+# SimpleFiltersCatalog
+#
+
+# Lightweight description of a filter, enough to list it in the selector
+FilterStub = namedtuple("FilterStub", ["name", "briefdescription", "itk_module", "number_of_inputs", "filename"])
+
+class SimpleFiltersCatalog:
+  """Compact index of the filter descriptions in the json directory.
+
+  Only the fields needed to populate the filter selector are kept in
+  the index. It is compiled the first time the module is opened with a
+  given SimpleITK version and cached on disk, so later sessions read a
+  single small file instead of parsing every json description.
+  """
+
+  # Increment when the layout of the compiled catalog changes
+  CATALOG_FORMAT = 1
+
+  # Number of full filter descriptions kept parsed in memory
+  MAX_CACHED_DESCRIPTIONS = 16
+
+  # Fields of the json descriptions which are not used by the GUI, they
+  # are dropped from the cached descriptions.
+  UNUSED_FILTER_FIELDS = ("tests", "detaileddescription", "doc", "custom_methods",
+                          "include_files", "public_declarations", "measurements")
+  UNUSED_MEMBER_FIELDS = ("doc", "briefdescriptionGet", "detaileddescriptionGet", "custom_itk_cast")
+
+  def __init__(self, jsonDir=None, cacheDir=None):
+    self.jsonDir = jsonDir if jsonDir is not None else SimpleFilters.JSON_DIR
+    if cacheDir is None:
+      cacheDir = os.path.join(slicer.app.cachePath, "SimpleFilters")
+    self.cacheDir = cacheDir
+    self.stubs = []
+    self._descriptions = OrderedDict()
+
+  def catalogFileName(self):
+    version = re.sub(r'[^0-9A-Za-z._-]', '_', sitk.Version().VersionString())
+    return os.path.join(self.cacheDir, f"FilterCatalog-{version}.json")
+
+  def load(self):
+    """Return the list of FilterStub, compiling the catalog if the
+    cached one is missing or out of date."""
+
+    jsonFiles = glob(os.path.join(self.jsonDir, "*.json"))
+    jsonFiles.sort(key=lambda x: os.path.basename(x))
+
+    key = OrderedDict([("format", self.CATALOG_FORMAT),
+                       ("sitk_version", sitk.Version().VersionString()),
+                       ("json_signature", self._jsonSignature(jsonFiles))])
+
+    catalogFile = self.catalogFileName()
+    try:
+      with open(catalogFile) as fp:
+        catalog = json.load(fp)
+      if catalog["key"] == key:
+        self.stubs = [FilterStub(**entry) for entry in catalog["filters"]]
+        return self.stubs
+    except (OSError, ValueError, KeyError, TypeError):
+      pass
+
+    self.stubs = self.compile(jsonFiles)
+
+    try:
+      os.makedirs(self.cacheDir, exist_ok=True)
+      tmpFile = catalogFile + ".tmp"
+      with open(tmpFile, "w") as fp:
+        json.dump({"key": key, "filters": [stub._asdict() for stub in self.stubs]}, fp, separators=(',', ':'))
+      os.replace(tmpFile, catalogFile)
+    except OSError as e:
+      sys.stderr.write(f"Unable to write filter catalog \"{catalogFile}\". Exception: {e}\n")
+
+    return self.stubs
+
+  def compile(self, jsonFiles):
+    """Parse the json descriptions and keep the filters available in
+    the installed SimpleITK."""
+
+    # query SimpleITK once, not once per description
+    sitkSymbols = set(dir(sitk))
+    enabledModules = set(sitk.Version().ITKModulesEnabled())
+
+    stubs = []
+    for fname in jsonFiles:
+      try:
+        with open(fname) as fp:
+          j = json.load(fp)
+        if j["name"] in sitkSymbols:
+          stubs.append(self._makeStub(j, os.path.basename(fname)))
+        elif j.get("itk_module") in enabledModules:
+          sys.stderr.write("Unknown SimpleITK class \"{}\".\n".format(j["name"]))
+      except Exception as e:
+        sys.stderr.write(f"Error while reading \"{fname}\". Exception: {e}\n")
+    return stubs
+
+  def filterDescription(self, stub):
+    """Return the parsed json description of a filter.
+
+    Descriptions are parsed on demand and the most recently used ones
+    are kept in a bounded cache. The returned description is shared and
+    must not be modified.
+    """
+    description = self._descriptions.pop(stub.name, None)
+    if description is None:
+      description = self.loadFilterDescription(stub)
+    self._descriptions[stub.name] = description
+    while len(self._descriptions) > self.MAX_CACHED_DESCRIPTIONS:
+      self._descriptions.popitem(last=False)
+    return description
+
+  def filterDescriptionByName(self, name):
+    """Return the description of the filter class name, or None if it
+    is not in the catalog"""
+    for stub in self.stubs:
+      if stub.name == name:
+        return self.filterDescription(stub)
+    return None
+
+  def loadFilterDescription(self, stub):
+    """Read the json description of a filter, without the fields which
+    are not used by the GUI."""
+    with open(os.path.join(self.jsonDir, stub.filename)) as fp:
+      j = json.load(fp, object_pairs_hook=OrderedDict)
+    for field in self.UNUSED_FILTER_FIELDS:
+      j.pop(field, None)
+    for member in j.get("members", []):
+      for field in self.UNUSED_MEMBER_FIELDS:
+        member.pop(field, None)
+    return j
+
+  @staticmethod
+  def _makeStub(j, filename):
+    if "inputs" in j:
+      numberOfInputs = len(j["inputs"])
+    else:
+      numberOfInputs = j["number_of_inputs"]
+    return FilterStub(name=j["name"],
+                      briefdescription=j.get("briefdescription", ""),
+                      itk_module=j.get("itk_module", ""),
+                      number_of_inputs=numberOfInputs,
+                      filename=filename)
+
+  @staticmethod
+  def _jsonSignature(jsonFiles):
+    """Fingerprint of the json directory, so that updated descriptions
+    invalidate the compiled catalog."""
+    h = hashlib.sha1()
+    for fname in jsonFiles:
+      st = os.stat(fname)
+      h.update(f"{os.path.basename(fname)}:{st.st_size}:{st.st_mtime_ns}\n".encode())
+    return h.hexdigest()
+
+
 #
 # qSimpleFiltersWidget
 #
 
 class SimpleFiltersWidget:
+
+  # number of filter parameter panels kept alive for quick switching
+  MAX_CACHED_PANELS = 8
+
+  # coarsest level of the draft pyramid, the inputs shrunk by 2**level
+  MAX_DRAFT_LEVEL = 3
+
+  # the search runs once the text is unchanged for this interval
+  SEARCH_DEBOUNCE_INTERVAL_MS = 150
+  # roles of the filter selector items holding the search results
+  SEARCH_MATCH_ROLE = qt.Qt.UserRole + 1
+  SEARCH_SCORE_ROLE = qt.Qt.UserRole + 2
+  # weights of the name, brief description and ITK module in the search
+  SEARCH_FIELD_WEIGHTS = (3.0, 1.0, 1.5)
+
   def __init__(self, parent = None):
 
     # To avoid the overhead of importing SimpleITK during application
     # startup, the import of SimpleITK is delayed until it is needed.
-    global sitk
-    import SimpleITK as sitk
-    global sitkUtils
-    import sitkUtils
+    importSimpleITK()
 
     if not parent:
       self.parent = slicer.qMRMLWidget()
@@ -95,28 +311,31 @@ class SimpleFiltersWidget:
       self.setup()
       self.parent.show()
 
-    jsonFiles = glob(SimpleFilters.JSON_DIR+"*.json")
-    jsonFiles.sort(key=lambda x: os.path.basename(x))
-
-    self.jsonFilters = []
-
-    for fname in jsonFiles:
-      try:
-        with open(fname) as fp:
-          j = json.load(fp,object_pairs_hook=OrderedDict)
-          if j["name"] in dir(sitk):
-            self.jsonFilters.append(j)
-          else:
-            if j["itk_module"] in sitk.Version().ITKModulesEnabled():
-              import sys
-              sys.stderr.write("Unknown SimpleITK class \"{}\".\n".format(j["name"]))
-      except Exception as e:
-        import sys
-        sys.stderr.write(f"Error while reading \"{fname}\". Exception: {e}\n")
-
+    # Only the compact catalog is read here, the full description of a
+    # filter is loaded when it is selected.
+    self.catalog = SimpleFiltersCatalog()
+    self.filterStubs = self.catalog.load()
 
     self.filterParameters = None
-    self.logic = None
+    self.scheduler = SimpleFiltersJobScheduler(listener=self,
+                                               resultCache=ResultCache(spillDirectory=os.path.join(slicer.app.temporaryPath, "SimpleFiltersCache"),
+                                                                       nodeScalars=VolumeBridge.nodeScalars),
+                                               tileDirectory=os.path.join(slicer.app.temporaryPath, "SimpleFiltersTiles"),
+                                               pyramidCache=Pyramid.PyramidCache())
+    # thread counts learned by the auto-tune mode, kept between sessions
+    self.threadTuner = ThreadTuner(os.path.join(os.path.dirname(slicer.app.slicerUserSettingsFilePath),
+                                                "SimpleFilters", "ThreadTuning.json"))
+    # working memory of the filters learned from the jobs, kept between
+    # sessions, and checked against the budget before each job when the
+    # memory check is on
+    self.scheduler.memoryModel = MemoryBudget.MemoryModel(os.path.join(os.path.dirname(slicer.app.slicerUserSettingsFilePath),
+                                                                       "SimpleFilters", "MemoryModel.json"))
+    self.defaultNumberOfThreads = sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()
+    # job reported by the status label and progress bar
+    self.currentJob = None
+    self.preview = SimpleFiltersPreview()
+    # steps built from the filter panels, see SimpleFiltersLib.Pipeline
+    self.pipeline = Pipeline()
 
 
   def setup(self):
@@ -136,15 +355,37 @@ class SimpleFiltersWidget:
     filtersFormLayout.addRow("Search:", self.searchBox)
     self.searchBox.connect("textChanged(QString)", self.onSearch)
 
+    self.searchTimer = qt.QTimer()
+    self.searchTimer.setSingleShot(True)
+    self.searchTimer.setInterval(self.SEARCH_DEBOUNCE_INTERVAL_MS)
+    self.searchTimer.connect('timeout()', self.updateSearch)
+
+    # add all the filters listed in the json files, and index their
+    # name, brief description and ITK module for the search
+    self.searchIndex = SearchIndex(self.SEARCH_FIELD_WEIGHTS)
+    self.filterModel = qt.QStandardItemModel()
+    for idx,stub in enumerate(self.filterStubs):
+      self.searchIndex.add([stub.name, stub.briefdescription, stub.itk_module])
+      item = qt.QStandardItem(stub.name)
+      item.setData(idx, qt.Qt.UserRole)
+      item.setData("1", self.SEARCH_MATCH_ROLE)
+      item.setData(0.0, self.SEARCH_SCORE_ROLE)
+      self.filterModel.appendRow(item)
+
+    # the selector shows the matching filters, best first, through a
+    # proxy model so the items are not rebuilt on each search
+    self.filterProxyModel = qt.QSortFilterProxyModel()
+    self.filterProxyModel.setSourceModel(self.filterModel)
+    self.filterProxyModel.setDynamicSortFilter(False)
+    self.filterProxyModel.setFilterRole(self.SEARCH_MATCH_ROLE)
+    self.filterProxyModel.setFilterFixedString("1")
+    self.filterProxyModel.setSortRole(self.SEARCH_SCORE_ROLE)
+
     # filter selector
     self.filterSelector = qt.QComboBox()
+    self.filterSelector.setModel(self.filterProxyModel)
     filtersFormLayout.addRow("Filter:", self.filterSelector)
 
-    # add all the filters listed in the json files
-    for idx,j in enumerate(self.jsonFilters):
-      name = j["name"]
-      self.filterSelector.addItem(name, idx)
-
     # connections
     self.filterSelector.connect('currentIndexChanged(int)', self.onFilterSelect)
 
@@ -156,10 +397,12 @@ class SimpleFiltersWidget:
     parametersCollapsibleButton.text = "Parameters"
     self.layout.addWidget(parametersCollapsibleButton)
 
-    # Layout within the dummy collapsible button
-    parametersFormLayout = qt.QFormLayout(parametersCollapsibleButton)
-
-    self.filterParameters = FilterParameters(parametersCollapsibleButton)
+    # Each filter gets its own panel in this layout, the panels of recently
+    # used filters are kept hidden so switching back does not rebuild them.
+    parametersLayout = qt.QVBoxLayout(parametersCollapsibleButton)
+    parametersLayout.setContentsMargins(0,0,0,0)
+    self.parametersCollapsibleButton = parametersCollapsibleButton
+    self.parameterPanels = OrderedDict()
 
     # Add vertical spacer
     self.layout.addStretch(1)
@@ -175,14 +418,31 @@ class SimpleFiltersWidget:
     hlayout.addWidget(self.currentStatusLabel)
     self.layout.addLayout(hlayout)
 
-    self.filterStartTime = None
-
     self.progress = qt.QProgressBar()
     self.progress.setRange(0,1000)
     self.progress.setValue(0)
     self.layout.addWidget(self.progress)
     self.progress.hide()
 
+    #
+    # Draft Row
+    #
+    self.draftComboBox = qt.QComboBox()
+    for level in range(self.MAX_DRAFT_LEVEL+1):
+      self.draftComboBox.addItem("Full resolution" if level == 0 else f"1/{2**level} resolution", level)
+    self.draftComboBox.toolTip = "Run the algorithm on the inputs shrunk by this factor along each axis, with the radii and seeds rescaled, to tune its parameters quickly. The result is resampled to the full resolution."
+
+    self.fullResolutionButton = qt.QPushButton("Apply Full Resolution")
+    self.fullResolutionButton.toolTip = "Run the algorithm at full resolution with the current parameters."
+    self.fullResolutionButton.enabled = False
+
+    hlayout = qt.QHBoxLayout()
+    hlayout.addWidget(qt.QLabel("Draft: "))
+    hlayout.addWidget(self.draftComboBox)
+    hlayout.addStretch(1)
+    hlayout.addWidget(self.fullResolutionButton)
+    self.layout.addLayout(hlayout)
+
     #
     # Cancel/Apply Row
     #
@@ -191,21 +451,119 @@ class SimpleFiltersWidget:
     self.restoreDefaultsButton.enabled = True
 
     self.cancelButton = qt.QPushButton("Cancel")
-    self.cancelButton.toolTip = "Abort the algorithm."
+    self.cancelButton.toolTip = "Abort the last submitted run of the algorithm."
     self.cancelButton.enabled = False
 
     self.applyButton = qt.QPushButton("Apply")
     self.applyButton.toolTip = "Run the algorithm."
     self.applyButton.enabled = True
 
+    self.previewCheckBox = qt.QCheckBox("Preview")
+    self.previewCheckBox.toolTip = SimpleFiltersPreview.TOOLTIP
+    self.previewCheckBox.checked = False
+
     hlayout = qt.QHBoxLayout()
 
     hlayout.addWidget(self.restoreDefaultsButton)
     hlayout.addStretch(1)
+    hlayout.addWidget(self.previewCheckBox)
     hlayout.addWidget(self.cancelButton)
     hlayout.addWidget(self.applyButton)
     self.layout.addLayout(hlayout)
 
+    #
+    # Pipeline Area
+    #
+    pipelineCollapsibleButton = ctk.ctkCollapsibleButton()
+    pipelineCollapsibleButton.text = "Pipeline"
+    pipelineCollapsibleButton.collapsed = True
+    self.layout.addWidget(pipelineCollapsibleButton)
+
+    pipelineFormLayout = qt.QFormLayout(pipelineCollapsibleButton)
+
+    self.pipelineList = qt.QListWidget()
+    self.pipelineList.toolTip = "Filters run one after the other on the output of the previous one, in a single job. Check a step to also write its output to a volume, the other intermediate images are not added to the scene."
+    pipelineFormLayout.addRow(self.pipelineList)
+
+    self.addPipelineStepButton = qt.QPushButton("Add Filter")
+    self.addPipelineStepButton.toolTip = "Append the selected filter, with its current parameters, to the pipeline. Its first input is the output of the previous step, its other inputs are the volumes selected for them."
+    self.removePipelineStepButton = qt.QPushButton("Remove")
+    self.removePipelineStepButton.toolTip = "Remove the selected step of the pipeline."
+    self.clearPipelineButton = qt.QPushButton("Clear")
+    self.clearPipelineButton.toolTip = "Remove all the steps of the pipeline."
+    hlayout = qt.QHBoxLayout()
+    hlayout.addWidget(self.addPipelineStepButton)
+    hlayout.addWidget(self.removePipelineStepButton)
+    hlayout.addWidget(self.clearPipelineButton)
+    pipelineFormLayout.addRow(hlayout)
+
+    self.pipelineInputSelector = slicer.qMRMLNodeComboBox()
+    self.pipelineInputSelector.nodeTypes = ["vtkMRMLScalarVolumeNode", "vtkMRMLLabelMapVolumeNode"]
+    self.pipelineInputSelector.selectNodeUponCreation = True
+    self.pipelineInputSelector.addEnabled = False
+    self.pipelineInputSelector.removeEnabled = False
+    self.pipelineInputSelector.noneEnabled = False
+    self.pipelineInputSelector.showHidden = False
+    self.pipelineInputSelector.showChildNodeTypes = False
+    self.pipelineInputSelector.setMRMLScene(slicer.mrmlScene)
+    self.pipelineInputSelector.setToolTip("Input of the first step of the pipeline.")
+    pipelineFormLayout.addRow("Input Volume: ", self.pipelineInputSelector)
+
+    self.pipelineOutputSelector = slicer.qMRMLNodeComboBox()
+    self.pipelineOutputSelector.nodeTypes = ["vtkMRMLScalarVolumeNode", "vtkMRMLLabelMapVolumeNode"]
+    self.pipelineOutputSelector.selectNodeUponCreation = True
+    self.pipelineOutputSelector.addEnabled = True
+    self.pipelineOutputSelector.removeEnabled = False
+    self.pipelineOutputSelector.renameEnabled = True
+    self.pipelineOutputSelector.noneEnabled = True
+    self.pipelineOutputSelector.showHidden = False
+    self.pipelineOutputSelector.showChildNodeTypes = False
+    self.pipelineOutputSelector.baseName = "Pipeline Output"
+    self.pipelineOutputSelector.noneDisplay = "(Create New Volume)"
+    self.pipelineOutputSelector.setMRMLScene(slicer.mrmlScene)
+    self.pipelineOutputSelector.setCurrentNode(None)
+    self.pipelineOutputSelector.setToolTip("Output of the last step of the pipeline.")
+    pipelineFormLayout.addRow("Output Volume: ", self.pipelineOutputSelector)
+
+    self.loadPipelineButton = qt.QPushButton("Load...")
+    self.loadPipelineButton.toolTip = "Replace the pipeline by one saved in a file."
+    self.savePipelineButton = qt.QPushButton("Save...")
+    self.savePipelineButton.toolTip = "Save the steps of the pipeline and their parameters to a file."
+    self.runPipelineButton = qt.QPushButton("Run Pipeline")
+    self.runPipelineButton.toolTip = "Run all the steps of the pipeline in one job."
+    hlayout = qt.QHBoxLayout()
+    hlayout.addWidget(self.loadPipelineButton)
+    hlayout.addWidget(self.savePipelineButton)
+    hlayout.addStretch(1)
+    hlayout.addWidget(self.runPipelineButton)
+    pipelineFormLayout.addRow(hlayout)
+
+    #
+    # Jobs Area
+    #
+    jobsCollapsibleButton = ctk.ctkCollapsibleButton()
+    jobsCollapsibleButton.text = "Jobs"
+    jobsCollapsibleButton.collapsed = True
+    self.layout.addWidget(jobsCollapsibleButton)
+
+    jobsLayout = qt.QVBoxLayout(jobsCollapsibleButton)
+
+    self.jobsTable = qt.QTableWidget()
+    self.jobsTable.setColumnCount(5)
+    self.jobsTable.setHorizontalHeaderLabels(["Filter", "Output", "Status", "Threads", ""])
+    self.jobsTable.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
+    self.jobsTable.setSelectionMode(qt.QAbstractItemView.NoSelection)
+    self.jobsTable.verticalHeader().visible = False
+    self.jobsTable.horizontalHeader().setSectionResizeMode(0, qt.QHeaderView.Stretch)
+    jobsLayout.addWidget(self.jobsTable)
+
+    self.clearJobsButton = qt.QPushButton("Clear Finished")
+    self.clearJobsButton.toolTip = "Remove the completed, aborted and failed jobs from the list."
+    hlayout = qt.QHBoxLayout()
+    hlayout.addStretch(1)
+    hlayout.addWidget(self.clearJobsButton)
+    jobsLayout.addLayout(hlayout)
+
     #
     # Advanced Area
     #
@@ -223,17 +581,118 @@ class SimpleFiltersWidget:
     self.showOutputCheckbox.connect('toggled(bool)', self.onShowOutputCheckboxToggled)
     advancedFormLayout.addRow("Auto-show output:", self.showOutputCheckbox)
 
+    self.concurrentJobsSpinBox = qt.QSpinBox()
+    self.concurrentJobsSpinBox.setRange(1, max(1, self.scheduler.coreBudget))
+    self.concurrentJobsSpinBox.value = self.scheduler.maxConcurrentJobs
+    self.concurrentJobsSpinBox.toolTip = "Maximum number of filters running at the same time. The {} cores are split evenly between them.".format(self.scheduler.coreBudget)
+    self.concurrentJobsSpinBox.connect('valueChanged(int)', self.onConcurrentJobsChanged)
+    advancedFormLayout.addRow("Concurrent jobs:", self.concurrentJobsSpinBox)
+
+    self.threadsSpinBox = qt.QSpinBox()
+    self.threadsSpinBox.setRange(0, max(1, self.scheduler.coreBudget))
+    self.threadsSpinBox.specialValueText = "Automatic"
+    self.threadsSpinBox.value = 0
+    self.threadsSpinBox.toolTip = "Number of threads of each filter. Automatic splits the {} cores evenly between the concurrent jobs.".format(self.scheduler.coreBudget)
+    self.threadsSpinBox.connect('valueChanged(int)', self.onThreadsChanged)
+    advancedFormLayout.addRow("Threads per job:", self.threadsSpinBox)
+
+    self.autoTuneThreadsCheckBox = qt.QCheckBox()
+    self.autoTuneThreadsCheckBox.checked = False
+    self.autoTuneThreadsCheckBox.toolTip = "Learn, for each filter and volume size, the number of threads up to the one above which runs the filter fastest, from the execution time of the jobs. The first jobs of a filter try several thread counts. The timings are kept between sessions."
+    self.autoTuneThreadsCheckBox.connect('toggled(bool)', self.onAutoTuneThreadsToggled)
+    advancedFormLayout.addRow("Auto-tune threads:", self.autoTuneThreadsCheckBox)
+
+    self.resultCacheMemorySpinBox = qt.QSpinBox()
+    self.resultCacheMemorySpinBox.setRange(0, 1024*1024)
+    self.resultCacheMemorySpinBox.suffix = " MB"
+    self.resultCacheMemorySpinBox.value = self.scheduler.resultCache.maxMemory // 2**20
+    self.resultCacheMemorySpinBox.toolTip = "Memory used to keep the results of previous runs. A run with the same filter, parameters and inputs as a cached one completes at once. Set to 0 to disable the cache."
+    self.resultCacheMemorySpinBox.connect('valueChanged(int)', self.onResultCacheSizeChanged)
+    advancedFormLayout.addRow("Result cache:", self.resultCacheMemorySpinBox)
+
+    self.resultCacheSpillSpinBox = qt.QSpinBox()
+    self.resultCacheSpillSpinBox.setRange(0, 1024*1024)
+    self.resultCacheSpillSpinBox.suffix = " MB"
+    self.resultCacheSpillSpinBox.value = self.scheduler.resultCache.maxSpill // 2**20
+    self.resultCacheSpillSpinBox.toolTip = "Disk space in the temporary directory for results evicted from the result cache memory."
+    self.resultCacheSpillSpinBox.connect('valueChanged(int)', self.onResultCacheSizeChanged)
+    advancedFormLayout.addRow("Result cache on disk:", self.resultCacheSpillSpinBox)
+
+    self.tiledCheckBox = qt.QCheckBox()
+    self.tiledCheckBox.checked = False
+    self.tiledCheckBox.toolTip = "Run the filter block by block on all the cores, with the output in a temporary file, for volumes which do not fit in memory. Only filters which are local in space, as pointwise, smoothing, gradient and morphology filters, can be run this way."
+    advancedFormLayout.addRow("Tiled execution:", self.tiledCheckBox)
+
+    self.memoryCheckCheckBox = qt.QCheckBox()
+    self.memoryCheckCheckBox.checked = False
+    self.memoryCheckCheckBox.toolTip = "Estimate the peak memory of each job before it starts, and refuse the jobs above the memory budget. The working memory of a filter is assumed to be the size of its inputs and output until it has been measured, the estimate may be off for the first jobs of a filter."
+    self.memoryCheckCheckBox.connect('toggled(bool)', self.onMemoryBudgetChanged)
+    advancedFormLayout.addRow("Check memory:", self.memoryCheckCheckBox)
+
+    self.memoryBudgetSpinBox = qt.QSpinBox()
+    self.memoryBudgetSpinBox.enabled = False
+    self.memoryBudgetSpinBox.setRange(0, 1024*1024)
+    self.memoryBudgetSpinBox.suffix = " MB"
+    self.memoryBudgetSpinBox.specialValueText = "Automatic"
+    self.memoryBudgetSpinBox.value = 0
+    self.memoryBudgetSpinBox.toolTip = "Memory a job may use. The peak memory of a job is estimated before it starts, a job above the budget is refused with suggestions to reduce its memory, as tiled execution. Automatic allows {:.0f}% of the memory available when the job starts.".format(MemoryBudget.DEFAULT_BUDGET_FRACTION*100)
+    self.memoryBudgetSpinBox.connect('valueChanged(int)', self.onMemoryBudgetChanged)
+    advancedFormLayout.addRow("Memory budget:", self.memoryBudgetSpinBox)
+
+    self.profileGroupBox = ctk.ctkCollapsibleGroupBox()
+    self.profileGroupBox.title = "Run profile"
+    self.profileGroupBox.collapsed = True
+    self.profileGroupBox.toolTip = "Time spent in each stage of the last finished job: pulling the inputs from the scene, casting, executing the filter, waiting for the main thread, pushing the output and updating the views."
+    advancedFormLayout.addRow(self.profileGroupBox)
+    profileLayout = qt.QVBoxLayout(self.profileGroupBox)
+
+    self.profileLabel = qt.QLabel()
+    profileLayout.addWidget(self.profileLabel)
+
+    self.profileTable = qt.QTableWidget()
+    self.profileTable.setColumnCount(4)
+    self.profileTable.setHorizontalHeaderLabels(["Stage", "Time (ms)", "Copied (MB)", "Peak memory (MB)"])
+    self.profileTable.setEditTriggers(qt.QAbstractItemView.NoEditTriggers)
+    self.profileTable.setSelectionMode(qt.QAbstractItemView.NoSelection)
+    self.profileTable.verticalHeader().visible = False
+    self.profileTable.horizontalHeader().setSectionResizeMode(0, qt.QHeaderView.Stretch)
+    profileLayout.addWidget(self.profileTable)
+
+    self.saveTraceButton = qt.QPushButton("Save Trace...")
+    self.saveTraceButton.toolTip = "Save the stages of the last jobs as a trace file, which can be opened in chrome://tracing or Perfetto."
+    hlayout = qt.QHBoxLayout()
+    hlayout.addStretch(1)
+    hlayout.addWidget(self.saveTraceButton)
+    profileLayout.addLayout(hlayout)
+
     # connections
     self.restoreDefaultsButton.connect('clicked(bool)', self.onRestoreDefaultsButton)
     self.applyButton.connect('clicked(bool)', self.onApplyButton)
     self.cancelButton.connect('clicked(bool)', self.onCancelButton)
+    self.clearJobsButton.connect('clicked(bool)', self.onClearJobsButton)
+    self.saveTraceButton.connect('clicked(bool)', self.onSaveTraceButton)
+    self.addPipelineStepButton.connect('clicked(bool)', self.onAddPipelineStepButton)
+    self.removePipelineStepButton.connect('clicked(bool)', self.onRemovePipelineStepButton)
+    self.clearPipelineButton.connect('clicked(bool)', self.onClearPipelineButton)
+    self.loadPipelineButton.connect('clicked(bool)', self.onLoadPipelineButton)
+    self.savePipelineButton.connect('clicked(bool)', self.onSavePipelineButton)
+    self.runPipelineButton.connect('clicked(bool)', self.onRunPipelineButton)
+    self.pipelineList.connect('itemChanged(QListWidgetItem*)', self.onPipelineItemChanged)
+    self.previewCheckBox.connect('toggled(bool)', self.onPreviewToggled)
+    self.draftComboBox.connect('currentIndexChanged(int)', self.onDraftLevelChanged)
+    self.fullResolutionButton.connect('clicked(bool)', self.onFullResolutionButton)
 
     # Initlial Selection
     self.filterSelector.currentIndexChanged(self.filterSelector.currentIndex)
 
 
   def cleanup(self):
-    pass
+    self.preview.setEnabled(False)
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(self.defaultNumberOfThreads)
+    self.scheduler.cancelAll()
+    self.scheduler.resultCache.clear()
+    self.scheduler.pyramidCache.clear()
+    self.clearParameterPanels()
 
 
   def printPythonCommand(self):
@@ -242,63 +701,98 @@ class SimpleFiltersWidget:
     currentFilter = self.filterParameters.filter
     varName = currentFilter.__class__.__name__
     printStr.append(f'myFilter = {varName}()')
-    for key in dir(currentFilter):
-      if key == 'GetName' or key.startswith('GetGlobal'):
-        pass
-      elif key[:3] == 'Get':
-        setAttr = key.replace("Get", "Set", 1)
-        if hasattr(currentFilter, setAttr):
-          value = eval(f"currentFilter.{key}()")
-          printStr.append(f'myFilter.{setAttr}({value})')
+    for name, value in filterParameterValues(currentFilter).items():
+      printStr.append(f'myFilter.Set{name}({value})')
 
     print("\n".join(printStr))
 
-  def onLogicRunStop(self):
-      self.applyButton.setEnabled(True)
-      self.restoreDefaultsButton.setEnabled(True)
-      self.cancelButton.setEnabled(False)
-      self.logic = None
-      self.progress.hide()
-
-
-  def onLogicRunStart(self):
-      self.applyButton.setEnabled(False)
-      self.restoreDefaultsButton.setEnabled(False)
-
-
   def onSearch(self, searchText):
-    # add all the filters listed in the json files
-    self.filterSelector.clear()
-    # split text on whitespace of and string search
-    searchTextList = searchText.split()
-    for idx,j in enumerate(self.jsonFilters):
-      lname = j["name"].lower()
-      # require all elements in list, to add to select. case insensitive
-      if  reduce(lambda x, y: x and (lname.find(y.lower())!=-1), [True]+searchTextList):
-        self.filterSelector.addItem(j["name"],idx)
+    self.searchTimer.start()
+
+  def updateSearch(self):
+    scores = dict(self.searchIndex.search(self.searchBox.text))
+    currentIndex = self.filterSelector.currentIndex
+    current = self.filterSelector.itemData(currentIndex) if currentIndex >= 0 else None
+
+    # the items are updated without signals, the proxy model is
+    # refreshed once afterwards
+    wasBlocked = self.filterModel.blockSignals(True)
+    for idx in range(self.filterModel.rowCount()):
+      item = self.filterModel.item(idx)
+      item.setData("1" if idx in scores else "0", self.SEARCH_MATCH_ROLE)
+      item.setData(scores.get(idx, 0.0), self.SEARCH_SCORE_ROLE)
+    self.filterModel.blockSignals(wasBlocked)
+
+    self.filterProxyModel.invalidate()
+    # the sort is stable, filters with equal scores keep the catalog order
+    self.filterProxyModel.sort(0, qt.Qt.DescendingOrder)
+
+    # the selected filter stays selected while it matches the search
+    currentIndex = self.filterSelector.findData(current) if current is not None else -1
+    if currentIndex < 0 and self.filterSelector.count:
+      currentIndex = 0
+    if currentIndex >= 0:
+      self.filterSelector.setCurrentIndex(currentIndex)
 
 
   def onFilterSelect(self, selectorIndex):
-    self.filterParameters.destroy()
+    if self.filterParameters:
+      self.filterParameters.hide()
+      self.filterParameters = None
     if selectorIndex < 0:
+      self.preview.setFilterParameters(None)
+      self.updatePreviewLabel()
       return
-    jsonIndex= self.filterSelector.itemData(selectorIndex)
-    json = self.jsonFilters[jsonIndex]
-    self.filterParameters.create(json)
-
-    if "briefdescription" in self.jsonFilters[jsonIndex]:
-      tip=self.jsonFilters[jsonIndex]["briefdescription"]
-      tip=tip.rstrip()
-      self.filterSelector.setToolTip(tip)
-    else:
-      self.filterSelector.setToolTip("")
+    stub = self.filterStubs[self.filterSelector.itemData(selectorIndex)]
+    self.filterParameters = self.parameterPanel(stub)
+    self.filterParameters.show()
+    self.preview.setFilterParameters(self.filterParameters)
+    self.updatePreviewLabel()
+
+    self.filterSelector.setToolTip(stub.briefdescription.rstrip())
+
+  def parameterPanel(self, stub):
+    """Return the parameter panel of a filter, building it if it is not cached.
+
+    The panels are kept in least recently used order, the oldest one is
+    destroyed when more than MAX_CACHED_PANELS are cached.
+    """
+    panel = self.parameterPanels.pop(stub.name, None)
+    if panel is None:
+      panel = FilterParameters(self.parametersCollapsibleButton)
+      panel.create(self.catalog.filterDescription(stub))
+      panel.parameterChangedCallback = self.preview.schedule
+    self.parameterPanels[stub.name] = panel
+    while len(self.parameterPanels) > self.MAX_CACHED_PANELS:
+      name, oldPanel = self.parameterPanels.popitem(last=False)
+      oldPanel.destroyPanel()
+    return panel
+
+  def clearParameterPanels(self):
+    for panel in self.parameterPanels.values():
+      panel.destroyPanel()
+    self.parameterPanels.clear()
+    self.filterParameters = None
 
 
   def onRestoreDefaultsButton(self):
+    if self.filterParameters:
+      # drop the cached panel so a fresh one is built with the defaults
+      name = self.filterParameters.json["name"]
+      self.parameterPanels.pop(name).destroyPanel()
+      self.filterParameters = None
     self.onFilterSelect(self.filterSelector.currentIndex)
 
 
-  def onApplyButton(self):
+  def onDraftLevelChanged(self, index):
+    self.fullResolutionButton.enabled = self.draftComboBox.itemData(index) > 0
+
+
+  def onFullResolutionButton(self):
+    self.onApplyButton(draftLevel=0)
+
+
+  def onApplyButton(self, checked=False, draftLevel=None):
 
     try:
 
@@ -306,9 +800,11 @@ class SimpleFiltersWidget:
 
       self.filterParameters.prerun()
 
-      self.logic = SimpleFiltersLogic()
-      self.logic.showOutput = self.showOutputCheckbox.checked
+      # restrict the run to the selected region of interest, if any
+      region = self.filterParameters.region()
 
+      if draftLevel is None:
+        draftLevel = self.draftComboBox.currentData
       if self.filterParameters.outputSelector.currentNode() is None:
         # create a new output volume
         if self.filterParameters.outputLabelMap:
@@ -319,10 +815,17 @@ class SimpleFiltersWidget:
       self.printPythonCommand()
 
       #print "running..."
-      self.logic.run(self.filterParameters.filter,
-                     self.filterParameters.output,
-                     self.filterParameters.outputLabelMap,
-                     *self.filterParameters.inputs)
+      self.currentJob = self.scheduler.submit(self.filterParameters.filter,
+                                              self.filterParameters.output,
+                                              self.filterParameters.outputLabelMap,
+                                              self.filterParameters.inputs,
+                                              showOutput=self.showOutputCheckbox.checked,
+                                              filterDescription=self.filterParameters.json,
+                                              region=region,
+                                              fullSizeOutput=self.filterParameters.fullSizeOutput(),
+                                              tiled=self.tiledCheckBox.checked,
+                                              draftLevel=draftLevel)
+      self.onJobChanged(self.currentJob)
 
     except Exception as e:
       self.currentStatusLabel.text = "Exception"
@@ -330,52 +833,256 @@ class SimpleFiltersWidget:
       import traceback
       traceback.print_exc()
 
-      # if there was an exception during start-up make sure to finish
-      self.onLogicRunStop()
-
       slicer.util.errorDisplay(
         f'Error before execution of {self.filterParameters.filter.GetName()}:\n\n{e}',
         detailedText=traceback.format_exc()
         )
 
 
+  def onAddPipelineStepButton(self):
+    filterParameters = self.filterParameters
+    filterParameters.prerun()
+    pipeline = self.pipeline
+    if not pipeline.inputNames:
+      inputNode = filterParameters.inputs[0] if filterParameters.inputs else None
+      pipeline.inputNames.append(inputNode.GetName() if inputNode else "")
+      if inputNode is not None and not pipeline.steps:
+        self.pipelineInputSelector.setCurrentNode(inputNode)
+
+    inputs = [("step", len(pipeline.steps)-1)] if pipeline.steps else [("input", 0)]
+    # the other inputs of the filter are volumes of the scene, by name
+    for node in filterParameters.inputs[1:]:
+      if node is None:
+        break
+      if node.GetName() not in pipeline.inputNames[1:]:
+        pipeline.inputNames.append(node.GetName())
+      inputs.append(("input", pipeline.inputNames.index(node.GetName(), 1)))
+
+    output = filterParameters.output.GetName() if filterParameters.output else None
+    pipeline.addStep(cloneFilter(filterParameters.filter), inputs, description=filterParameters.json,
+                     output=output, outputLabelMap=filterParameters.outputLabelMap)
+    self.updatePipelineList()
+
+
+  def onRemovePipelineStepButton(self):
+    row = self.pipelineList.currentRow
+    if 0 <= row < len(self.pipeline.steps):
+      self.pipeline.removeStep(row)
+      self.updatePipelineList()
+
+
+  def onClearPipelineButton(self):
+    self.pipeline = Pipeline()
+    self.updatePipelineList()
+
+
+  def onPipelineItemChanged(self, item):
+    row = self.pipelineList.row(item)
+    if 0 <= row < len(self.pipeline.steps):
+      self.pipeline.steps[row].display = item.checkState() == qt.Qt.Checked
+
+
+  def updatePipelineList(self):
+    wasBlocked = self.pipelineList.blockSignals(True)
+    self.pipelineList.clear()
+    for index, step in enumerate(self.pipeline.steps):
+      inputs = ", ".join(f"step {i+1}" if kind == "step" else (self.pipeline.inputNames[i] or "input")
+                         for kind, i in step.inputs)
+      item = qt.QListWidgetItem(f"{index+1}. {step.name} ({inputs})")
+      item.setFlags(item.flags() | qt.Qt.ItemIsUserCheckable)
+      item.setCheckState(qt.Qt.Checked if step.display else qt.Qt.Unchecked)
+      item.setToolTip("Check to write the output of this step to a volume.")
+      self.pipelineList.addItem(item)
+    self.pipelineList.blockSignals(wasBlocked)
+
+
+  def onLoadPipelineButton(self):
+    fname = qt.QFileDialog.getOpenFileName(None, "Load Pipeline", "", "Pipeline files (*.json)")
+    if not fname:
+      return
+    try:
+      self.pipeline = Pipeline.load(fname, self.catalog.filterDescriptionByName)
+    except Exception as e:
+      import traceback
+      slicer.util.errorDisplay(f'Unable to load the pipeline "{fname}":\n\n{e}', detailedText=traceback.format_exc())
+      return
+    self.updatePipelineList()
+
+
+  def onSavePipelineButton(self):
+    fname = qt.QFileDialog.getSaveFileName(None, "Save Pipeline", "SimpleFilters-pipeline.json", "Pipeline files (*.json)")
+    if fname:
+      self.pipeline.save(fname)
+
+
+  def pipelineOutputNode(self, step, index):
+    """Return the volume the output of a step marked for display is
+    written to, created if needed"""
+    name = f"{step.output or step.name} step {index+1}"
+    className = "vtkMRMLLabelMapVolumeNode" if step.outputLabelMap else "vtkMRMLScalarVolumeNode"
+    node = slicer.mrmlScene.GetFirstNodeByName(name)
+    if node is None or not node.IsA(className):
+      node = slicer.mrmlScene.AddNewNodeByClass(className, name)
+    return node
+
+
+  def onRunPipelineButton(self):
+    try:
+      pipeline = self.pipeline
+      if not pipeline.steps:
+        raise ValueError("The pipeline has no step")
+      inputNode = self.pipelineInputSelector.currentNode()
+      if inputNode is None:
+        raise ValueError("Input volume is not selected")
+      inputs = [inputNode]
+      for name in pipeline.inputNames[1:]:
+        node = slicer.mrmlScene.GetFirstNodeByName(name)
+        if node is None:
+          raise ValueError(f"The input volume \"{name}\" of the pipeline is not in the scene")
+        inputs.append(node)
+
+      last = len(pipeline.steps)-1
+      if self.pipelineOutputSelector.currentNode() is None:
+        self.pipelineOutputSelector.addNode("vtkMRMLLabelMapVolumeNode" if pipeline.steps[last].outputLabelMap
+                                            else "vtkMRMLScalarVolumeNode")
+      outputNodes = {index: self.pipelineOutputNode(step, index)
+                     for index, step in enumerate(pipeline.steps) if step.display and index != last}
+      outputNodes[last] = self.pipelineOutputSelector.currentNode()
+
+      self.currentStatusLabel.text = "Starting"
+      self.currentJob = self.scheduler.submitPipeline(pipeline, outputNodes, inputs,
+                                                      showOutput=self.showOutputCheckbox.checked)
+      self.onJobChanged(self.currentJob)
+
+    except Exception as e:
+      self.currentStatusLabel.text = "Exception"
+
+      import traceback
+      traceback.print_exc()
+
+      slicer.util.errorDisplay(
+        f'Error before execution of the pipeline:\n\n{e}',
+        detailedText=traceback.format_exc()
+        )
+
+
   def onCancelButton(self):
-    self.currentStatusLabel.text = "Aborting"
-    if self.logic:
-      self.logic.abort = True
+    if self.currentJob and not self.currentJob.isFinished():
+      self.currentStatusLabel.text = "Aborting"
+      self.scheduler.cancel(self.currentJob)
+
+
+  def onPreviewToggled(self, checked):
+    self.preview.setEnabled(checked)
+
+  def updatePreviewLabel(self):
+    """Tell on the preview check box when the previewed slice only
+    approximates the result on the whole volume"""
+    if self.preview.isExact():
+      self.previewCheckBox.text = "Preview"
+      self.previewCheckBox.toolTip = SimpleFiltersPreview.TOOLTIP
+    else:
+      self.previewCheckBox.text = "Preview (approximate)"
+      self.previewCheckBox.toolTip = SimpleFiltersPreview.TOOLTIP + " " + SimpleFiltersPreview.APPROXIMATE_TOOLTIP
 
 
   def onShowOutputCheckboxToggled(self, checked):
-    if self.logic:
-      self.logic.showOutput = checked
+    for job in self.scheduler.jobs:
+      if not job.isFinished():
+        job.setShowOutput(checked)
 
 
-  def onLogicEventStart(self):
-    self.filterStartTime = time.time()
-    self.currentStatusLabel.text = "Running"
-    self.cancelButton.setDisabled(False)
-    self.progress.setValue(0)
-    self.progress.show()
+  def onConcurrentJobsChanged(self, value):
+    self.scheduler.maxConcurrentJobs = value
+    self.scheduler.startPendingJobs()
 
 
-  def onLogicEventEnd(self):
-    elapsedTimeSec = time.time() - self.filterStartTime
-    self.currentStatusLabel.text = f"Completed ({elapsedTimeSec:3.1f}s)"
-    self.progress.setValue(1000)
+  def onThreadsChanged(self, value):
+    self.scheduler.numberOfThreads = value if value > 0 else None
+    # the preview and the filters run outside of the jobs use the default
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(value if value > 0 else self.defaultNumberOfThreads)
 
 
-  def onLogicEventAbort(self):
-    #print "Aborting..."
-    self.currentStatusLabel.text = "Aborted"
+  def onAutoTuneThreadsToggled(self, checked):
+    self.scheduler.threadTuner = self.threadTuner if checked else None
 
 
-  def onLogicEventProgress(self, progress):
-    self.currentStatusLabel.text = "Running ({:3.1f}%)".format(progress*100.0)
-    self.progress.setValue(progress*1000)
+  def onMemoryBudgetChanged(self, value):
+    checked = self.memoryCheckCheckBox.checked
+    self.memoryBudgetSpinBox.enabled = checked
+    self.scheduler.memoryBudget = self.memoryBudgetSpinBox.value * 2**20 if checked else None
 
 
-  def onLogicEventIteration(self, nIter):
-    print("Iteration " , nIter)
+  def onResultCacheSizeChanged(self, value):
+    self.scheduler.resultCache.setLimits(self.resultCacheMemorySpinBox.value * 2**20,
+                                         self.resultCacheSpillSpinBox.value * 2**20)
+
+
+  def onClearJobsButton(self):
+    self.scheduler.clearFinishedJobs()
+    self.jobsTable.setRowCount(0)
+    for job in self.scheduler.jobs:
+      self.updateJobRow(job)
+
+
+  def onJobChanged(self, job):
+    self.updateJobRow(job)
+
+    if job is not self.currentJob:
+      return
+
+    self.currentStatusLabel.text = job.statusText()
+    self.cancelButton.setEnabled(not job.isFinished())
+    if job.status == SimpleFiltersJob.RUNNING:
+      self.progress.setValue(int(job.progress*1000))
+      self.progress.show()
+    elif job.status == SimpleFiltersJob.COMPLETED:
+      self.progress.setValue(1000)
+    if job.isFinished() and job.logic is None:
+      self.progress.hide()
+      if job.profile is not None:
+        self.updateProfile(job.profile)
+
+
+  def updateProfile(self, profile):
+    self.profileLabel.text = f"{profile.name}: {profile.duration():.3f}s"
+    totals = profile.totals()
+    self.profileTable.setRowCount(len(totals))
+
+    def mb(nbytes):
+      return f"{nbytes/2**20:.1f}" if nbytes is not None else ""
+
+    for row, (name, (duration, nbytes, peakMemory)) in enumerate(totals.items()):
+      for column, text in enumerate((name, f"{duration*1000.0:.1f}", mb(nbytes), mb(peakMemory))):
+        self.profileTable.setItem(row, column, qt.QTableWidgetItem(text))
+
+
+  def onSaveTraceButton(self):
+    fname = qt.QFileDialog.getSaveFileName(None, "Save Trace", "SimpleFilters-trace.json", "Trace files (*.json)")
+    if fname:
+      self.scheduler.profiler.writeTrace(fname)
+
+
+  def updateJobRow(self, job):
+    if job not in self.scheduler.jobs:
+      return
+    row = self.scheduler.jobs.index(job)
+
+    if row >= self.jobsTable.rowCount:
+      self.jobsTable.setRowCount(row+1)
+      self.jobsTable.setItem(row, 0, qt.QTableWidgetItem(job.name))
+      self.jobsTable.setItem(row, 1, qt.QTableWidgetItem(job.outputName))
+      self.jobsTable.setItem(row, 2, qt.QTableWidgetItem())
+      self.jobsTable.setItem(row, 3, qt.QTableWidgetItem())
+      cancelButton = qt.QPushButton("Cancel")
+      cancelButton.toolTip = "Abort this job."
+      cancelButton.connect('clicked(bool)', lambda checked, j=job: self.scheduler.cancel(j))
+      self.jobsTable.setCellWidget(row, 4, cancelButton)
+
+    self.jobsTable.item(row, 2).setText(job.statusText())
+    self.jobsTable.item(row, 2).setToolTip(job.memoryText())
+    self.jobsTable.item(row, 3).setText(str(job.numberOfThreads) if job.numberOfThreads else "")
+    self.jobsTable.cellWidget(row, 4).enabled = not job.isFinished()
 
 
 
@@ -383,19 +1090,126 @@ class SimpleFiltersWidget:
 # SimpleFiltersLogic
 #
 
+class SimpleFiltersLogicListener:
+  """Receives the notifications of a SimpleFiltersLogic on the main
+  thread. This default implementation ignores them, so the logic can be
+  used without a widget."""
+
+  def onLogicRunStart(self):
+    pass
+
+  def onLogicRunStop(self):
+    pass
+
+  def onLogicEventStart(self):
+    pass
+
+  def onLogicEventEnd(self):
+    pass
+
+  def onLogicEventAbort(self):
+    pass
+
+  def onLogicEventProgress(self, progress):
+    pass
+
+  def onLogicEventIteration(self, nIter):
+    pass
+
+
 class SimpleFiltersLogic:
   """This class should implement all the actual
   computation done by your module.  The interface
   should be such that other python code can import
   this class and make use of the functionality without
   requiring an instance of the Widget
+
+  For batch processing of files or nodes without the event
+  loop see SimpleFiltersLib.Batch.
+
+  The stages of the last run, with their duration and the bytes they
+  copied, are recorded in the profile attribute, a
+  SimpleFiltersLib.Profiling.RunProfile.
   """
-  def __init__(self):
+
+  # Interval at which the main thread briefly releases the GIL, and
+  # samples the progress, while a filter is running. PythonQt may hold
+  # the GIL while waiting for events, this lets the worker thread run
+  # its Python callbacks.
+  GIL_YIELD_INTERVAL_MS = 50
+
+  def __init__(self, listener=None):
+    importSimpleITK()
+    # Receives the onLogicRun* and onLogicEvent* notifications on the
+    # main thread
+    self.listener = listener if listener is not None else SimpleFiltersLogicListener()
     self.main_queue = queue.Queue()
     self.main_queue_running = False
+    self.main_queue_notifier = None
+    # True while main_queue_process runs, the logic must then be kept
+    # alive as it owns the notifier which may be calling it
+    self.main_queue_processing = False
     self.thread = threading.Thread()
     self.abort = False
     self.showOutput = True
+    # errors are reported in a dialog, otherwise on stderr
+    self.showErrors = True
+    self.bridge = VolumeBridge()
+    # pixel types the inputs are cast to before execution, None if no
+    # input is cast, and whether the pixel types of the filter are known,
+    # otherwise a failed execution is retried on float inputs
+    self.castPixelIDs = None
+    self.pixelTypesKnown = False
+    # optional ResultCache shared between runs, and the key of this run
+    self.resultCache = None
+    self.cacheKey = None
+    # region (index, size) of interest of the first input, None for the
+    # whole volumes, the region the inputs are cropped to, with the
+    # margin of the filter, and whether the result is pasted back into
+    # a volume the size of the input
+    self.region = None
+    self.processedRegion = None
+    self.fullSizeOutput = False
+    # run the filter block by block, see SimpleFiltersLib.Tiling, with
+    # the result in a temporary file of tileDirectory when it is set
+    self.tiled = False
+    self.tileDirectory = None
+    # run on the inputs shrunk to this level of the pyramid, 0 for the
+    # full resolution, with the shrunk inputs in the optional
+    # PyramidCache, and the keys and label flags of the inputs
+    self.draftLevel = 0
+    self.pyramidCache = None
+    self.draftInputs = []
+    # stages of the last run
+    self.profile = None
+    # the peak memory of a run is estimated before it starts, see
+    # SimpleFiltersLib.MemoryBudget. memoryBudget is the bytes a run may
+    # use, 0 for a fraction of the available memory and None to not
+    # check it, with the working memory of the filters learned by the
+    # optional memoryModel. A run over budget is refused.
+    self.memoryBudget = None
+    self.memoryModel = None
+    self.memoryEstimate = None
+    # when the output node is the first input, the voxels of the node a
+    # pointwise filter writes its output over, see inPlaceOutputArray
+    self.outputIsInput = False
+    self.inPlaceArray = None
+    self.filterDescription = None
+
+    # Latest progress written by the worker thread, and the last value
+    # reported on the main thread
+    self.progress = 0.0
+    self.reportedProgress = None
+
+    # The worker thread writes to this socket pair to wake up the main
+    # thread when a callable is posted to main_queue.
+    self.wakeupReader, self.wakeupWriter = socket.socketpair()
+    self.wakeupReader.setblocking(False)
+    self.wakeupWriter.setblocking(False)
+
+    self.gilTimer = qt.QTimer()
+    self.gilTimer.setInterval(self.GIL_YIELD_INTERVAL_MS)
+    self.gilTimer.connect('timeout()', self.main_queue_tick)
 
 
   def __del__(self):
@@ -403,6 +1217,8 @@ class SimpleFiltersLogic:
       self.main_queue_stop()
     if self.thread.is_alive():
       self.thread.join()
+    self.wakeupReader.close()
+    self.wakeupWriter.close()
 
 
   def yieldPythonGIL(self, seconds=0):
@@ -416,35 +1232,35 @@ class SimpleFiltersLogic:
 
   def cmdStartEvent(self, sitkFilter):
     #print "cmStartEvent"
-    widget = slicer.modules.SimpleFiltersWidget
-    self.main_queue.put(lambda: widget.onLogicEventStart())
+    listener = self.listener
+    self.main_queue_put(lambda: listener.onLogicEventStart())
     self.yieldPythonGIL()
 
 
   def cmdProgressEvent(self, sitkFilter):
     #print "cmProgressEvent", sitkFilter.GetProgress()
-    widget = slicer.modules.SimpleFiltersWidget
-    self.main_queue.put(lambda p=sitkFilter.GetProgress(): widget.onLogicEventProgress(p))
+    # Only the latest value is kept, it is sampled by the main thread
+    # in main_queue_tick.
+    self.progress = sitkFilter.GetProgress()
     self.cmdCheckAbort(sitkFilter)
-    self.yieldPythonGIL()
 
   def cmdIterationEvent(self, sitkFilter, nIter):
     print("cmIterationEvent")
-    widget = slicer.modules.SimpleFiltersWidget
-    self.main_queue.put(lambda: widget.onLogicEventIteration(nIter))
+    listener = self.listener
+    self.main_queue_put(lambda: listener.onLogicEventIteration(nIter))
     self.cmdCheckAbort(sitkFilter)
     self.yieldPythonGIL()
 
   def cmdAbortEvent(self, sitkFilter):
     #print "cmAbortEvent"
-    widget = slicer.modules.SimpleFiltersWidget
-    self.main_queue.put(lambda: widget.onLogicEventAbort())
+    listener = self.listener
+    self.main_queue_put(lambda: listener.onLogicEventAbort())
     self.yieldPythonGIL()
 
   def cmdEndEvent(self):
     #print "cmEndEvent"
-    widget = slicer.modules.SimpleFiltersWidget
-    self.main_queue.put(lambda: widget.onLogicEventEnd())
+    listener = self.listener
+    self.main_queue_put(lambda: listener.onLogicEventEnd())
     self.yieldPythonGIL()
 
   def thread_doit(self,sitkFilter,*inputImages):
@@ -463,10 +1279,38 @@ class SimpleFiltersLogic:
         import traceback
         traceback.print_exc()
 
-      img = sitkFilter.Execute(*inputImages)
+      if self.tiled:
+        self.thread_tiled(sitkFilter, *inputImages)
+        return
+
+      if self.inPlaceArray is not None and self.thread_inplace(sitkFilter, *inputImages):
+        return
+
+      profile = self.profile
+      referenceImage = inputImages[0] if inputImages else None
+      if self.draftLevel > 0:
+        with profile.stage("shrink"):
+          inputImages = self.shrinkInputs(inputImages)
+
+      if self.processedRegion is not None:
+        with profile.stage("crop"):
+          inputImages = [Regions.cropImage(img, self.processedRegion) for img in inputImages]
+
+      if self.castPixelIDs:
+        # cast once to the pixel type chosen before execution
+        castPixelIDs = self.castPixelIDs
+        with profile.stage("cast", lambda: sum(imageSizeInBytes(img) for img, pixelID in zip(inputImages, castPixelIDs)
+                                               if pixelID is not None)):
+          inputImages = [img if pixelID is None else sitk.Cast(img, pixelID)
+                         for img, pixelID in zip(inputImages, castPixelIDs)]
+
+      # the memory is sampled to learn the working memory of the filter
+      with profile.stage("execute", sampleMemory=self.memoryModel is not None):
+        img = sitkFilter.Execute(*inputImages)
+      img = self.finishResult(img, referenceImage)
 
       if not self.abort:
-        self.main_queue.put(lambda img=img:self.updateOutput(img))
+        self.postOutput(img)
 
     except Exception as e:
 
@@ -475,17 +1319,21 @@ class SimpleFiltersLogic:
       else:
         msg = str(e)
 
-      # Check if this is a pixel type error and retry with float cast
-      if re.search(r'Pixel type:.*is not supported', msg):
+      # Check if this is a pixel type error and retry with float cast,
+      # when the supported pixel types were not known before execution
+      if not self.pixelTypesKnown and not self.tiled and re.search(r'Pixel type:.*is not supported', msg):
         try:
           print("This filter is not compatible with the pixel type of the input images. Attempting to retry filter after casting all input images to float.")
 
           # Cast all input images to float
-          floatImages = [sitk.Cast(img, sitk.sitkFloat32) for img in inputImages]
-          img = sitkFilter.Execute(*floatImages)
+          with self.profile.stage("cast", lambda: sum(imageSizeInBytes(img) for img in floatImages)):
+            floatImages = [sitk.Cast(img, sitk.sitkFloat32) for img in inputImages]
+          with self.profile.stage("execute", sampleMemory=self.memoryModel is not None):
+            img = sitkFilter.Execute(*floatImages)
+          img = self.finishResult(img, referenceImage)
 
           if not self.abort:
-            self.main_queue.put(lambda img=img:self.updateOutput(img))
+            self.postOutput(img)
           return
         except Exception as e2:
           import traceback
@@ -503,42 +1351,184 @@ class SimpleFiltersLogic:
       self.abort = True
 
       self.yieldPythonGIL()
-      self.main_queue.put(lambda : slicer.util.errorDisplay(
-        f"Error during execution of {sitkFilter.GetName()}:\n\n{msg}",
-        detailedText=traceback.format_exc())
-        )
+      if self.showErrors:
+        self.main_queue_put(lambda : slicer.util.errorDisplay(
+          f"Error during execution of {sitkFilter.GetName()}:\n\n{msg}",
+          detailedText=traceback.format_exc())
+          )
+      else:
+        import sys
+        sys.stderr.write(f"Error during execution of {sitkFilter.GetName()}: {msg}\n")
     finally:
       # this filter is persistent, remove commands
       sitkFilter.RemoveAllCommands()
-      self.main_queue.put(self.main_queue_stop)
+      self.main_queue_put(self.main_queue_stop)
+
+  def thread_tiled(self, sitkFilter, *inputImages):
+    """Run the filter block by block. The commands of sitkFilter are
+    not invoked, each block runs a copy of it, so the start, end and
+    progress are reported from here."""
+    listener = self.listener
+    # the blocks are processed by as many workers as the job has threads
+    numberOfThreads = getattr(sitkFilter, "GetNumberOfThreads", lambda: 0)()
+    self.main_queue_put(lambda: listener.onLogicEventStart())
+
+    def setProgress(progress):
+      self.progress = progress
+
+    with self.profile.stage("execute"):
+      result = Tiling.executeTiled(sitkFilter, inputImages, region=self.region,
+                                   fullSizeOutput=self.fullSizeOutput,
+                                   castPixelIDs=self.castPixelIDs,
+                                   numberOfWorkers=numberOfThreads,
+                                   numberOfThreads=numberOfThreads,
+                                   outputDirectory=self.tileDirectory,
+                                   progressCallback=setProgress,
+                                   abortCallback=lambda: self.abort)
+    if result is None or self.abort:
+      self.main_queue_put(lambda: listener.onLogicEventAbort())
+      return
+    self.postOutput(result.image, buffer=result.buffer)
+    self.main_queue_put(lambda: listener.onLogicEventEnd())
+
+  def thread_inplace(self, sitkFilter, *inputImages):
+    """Run a pointwise filter over the voxels of the output node, which
+    is its first input. Returns False if it cannot, the voxels are then
+    unchanged and nothing was reported. The commands of sitkFilter are
+    not invoked, the start and end are reported from here. The run is
+    not aborted midway, the volume would be left half processed. An
+    error is reported from here, with the warning that the voxels may
+    be partially modified."""
+    if not Fusion.canExecuteInPlace(sitkFilter, inputImages, self.inPlaceArray, self.filterDescription):
+      return False
+    listener = self.listener
+    numberOfThreads = getattr(sitkFilter, "GetNumberOfThreads", lambda: 0)()
+    self.main_queue_put(lambda: listener.onLogicEventStart())
+    try:
+      with self.profile.stage("execute"):
+        img = Fusion.executeInPlace(sitkFilter, inputImages, self.inPlaceArray, self.filterDescription, numberOfThreads)
+      if img is None:
+        raise RuntimeError("The filter cannot be run in place")
+    except Exception as e:
+      import traceback
+      traceback.print_exc()
+      self.abort = True
+      msg = (f"Error during execution of {sitkFilter.GetName()}: {e}\n\n"
+             "The output was written over the input volume, its voxels may be partially modified.")
+      # the views show the voxels written so far
+      self.main_queue_put(self.inPlaceModified)
+      if self.showErrors:
+        self.main_queue_put(lambda: slicer.util.errorDisplay(msg, detailedText=traceback.format_exc()))
+      else:
+        import sys
+        self.main_queue_put(lambda: sys.stderr.write(msg+"\n"))
+      return True
+    self.postOutput(img, inPlace=True)
+    self.main_queue_put(lambda: listener.onLogicEventEnd())
+    return True
+
+  def inPlaceModified(self):
+    """Tell the views the voxels of the output node were written over"""
+    node = slicer.mrmlScene.GetNodeByID(self.outputNodeID)
+    if node is not None:
+      slicer.util.arrayFromVolumeModified(node)
+
+  def shrinkInputs(self, inputImages):
+    """Return the inputs shrunk to the draft level"""
+    shrunk = []
+    for img, (key, isLabel) in zip(inputImages, self.draftInputs):
+      if self.pyramidCache is not None:
+        shrunk.append(self.pyramidCache.get(key, img, self.draftLevel, isLabel))
+      else:
+        shrunk.append(Pyramid.shrinkImage(img, Pyramid.shrinkFactors(img.GetSize(), self.draftLevel), isLabel))
+    return shrunk
+
+  def finishResult(self, img, referenceImage):
+    """Return the result of a draft resampled on the grid of the first
+    input, or the region of interest of the result of a run on the
+    processed region, pasted into a volume with the geometry of the first
+    input when fullSizeOutput is set"""
+    if self.draftLevel > 0:
+      with self.profile.stage("upsample"):
+        return Pyramid.upsampleImage(img, referenceImage, self.outputLabelMap)
+    if self.processedRegion is None:
+      return img
+    with self.profile.stage("trim"):
+      trimmed = Regions.trimImage(img, self.processedRegion, self.region)
+      if self.fullSizeOutput and trimmed is not img:
+        return Regions.pasteImage(trimmed, self.region, referenceImage)
+      return trimmed
+
+  def postOutput(self, img, cached=False, outputNodeID=None, inPlace=False, buffer=None):
+    """Post the result to be pushed to the output node on the main
+    thread, the time it waits in main_queue is recorded. buffer is the
+    array img is a view of, if any, see VolumeBridge.push."""
+    postTime = self.profile.now()
+    self.main_queue_put(lambda: self.updateOutput(img, cached, postTime, outputNodeID, inPlace, buffer))
+
+  def main_queue_put(self, f):
+    """Post a callable to be run on the main thread, and wake it up"""
+    self.main_queue.put(f)
+    try:
+      self.wakeupWriter.send(b'\0')
+    except (BlockingIOError, OSError):
+      # the socket buffer is full, the main thread is already due to wake up
+      pass
 
   def main_queue_start(self):
     """Begins monitoring of main_queue for callables"""
     self.main_queue_running = True
-    slicer.modules.SimpleFiltersWidget.onLogicRunStart()
+    self.listener.onLogicRunStart()
+    if self.main_queue_notifier is None:
+      self.main_queue_notifier = qt.QSocketNotifier(self.wakeupReader.fileno(), qt.QSocketNotifier.Read)
+      self.main_queue_notifier.connect('activated(int)', lambda fd: self.main_queue_process())
+    self.main_queue_notifier.setEnabled(True)
+    self.progress = 0.0
+    self.reportedProgress = None
+    self.gilTimer.start()
+    # process anything posted before monitoring started
     qt.QTimer.singleShot(0, self.main_queue_process)
 
   def main_queue_stop(self):
     """End monitoring of main_queue for callables"""
     self.main_queue_running = False
+    self.gilTimer.stop()
+    # the notifier may be the sender of this call, it is only disabled
+    if self.main_queue_notifier:
+      self.main_queue_notifier.setEnabled(False)
     if self.thread.is_alive():
       self.thread.join()
-    slicer.modules.SimpleFiltersWidget.onLogicRunStop()
+    # the input views are no longer used
+    self.bridge.release()
+    self.listener.onLogicRunStop()
+
+  def main_queue_tick(self):
+    """Release the GIL for the worker thread and report the latest progress"""
+    self.yieldPythonGIL()
+    self.sampleProgress()
+
+  def sampleProgress(self):
+    progress = self.progress
+    if progress != self.reportedProgress:
+      self.reportedProgress = progress
+      self.listener.onLogicEventProgress(progress)
 
   def main_queue_process(self):
-    """processes the main_queue of callables"""
+    """processes the main_queue of callables, when woken up by the worker thread"""
+    self.main_queue_processing = True
     try:
+      # consume the wake up notifications
+      try:
+        while self.wakeupReader.recv(4096):
+          pass
+      except (BlockingIOError, OSError):
+        pass
+
       while not self.main_queue.empty():
         f = self.main_queue.get_nowait()
         if callable(f):
           f()
 
-      if self.main_queue_running:
-        # Yield the GIL to allow other thread to do some python work.
-        # This is needed since pyQt doesn't yield the python GIL
-        self.yieldPythonGIL(.01)
-        qt.QTimer.singleShot(0, self.main_queue_process)
-
     except Exception as e:
       # We get here for example when an exception thrown in SimpleITK ImageFileWriter_Execute
       # (can be triggered by running ResampleImageFilter on MRBrainTumor1 sample data set with default parameters)
@@ -551,32 +1541,85 @@ class SimpleFiltersLogic:
         detailedText=traceback.format_exc())
 
       # if there was an error try to resume
-      if not self.main_queue.empty() or self.main_queue_running:
+      if not self.main_queue.empty():
         qt.QTimer.singleShot(0, self.main_queue_process)
+    finally:
+      self.main_queue_processing = False
+
+  def updateOutput(self,img,cached=False,postTime=None,outputNodeID=None,inPlace=False,buffer=None):
+
+    profile = self.profile
+    if postTime is not None:
+      profile.addStage("queue", postTime, profile.now())
+
+    # the intermediate outputs of a pipeline have their own node, they
+    # are neither cached nor shown
+    intermediate = outputNodeID is not None
+    node = slicer.mrmlScene.GetNodeByID(outputNodeID if intermediate else self.outputNodeID)
+
+    # Volume is temporarily set to empty during reading from file, pause rendering to avoid warnings.
+    # The cached image must not share its buffer with the node, it is
+    # copied, into the buffer of the node when it matches.
+    copiedBytes = self.bridge.copiedBytes
+    with profile.stage("push", lambda: self.bridge.copiedBytes - copiedBytes), slicer.util.RenderBlocker():
+      if inPlace:
+        # the voxels were written over the buffer of the node
+        wasModifying = node.StartModify()
+        slicer.util.arrayFromVolumeModified(node)
+        node.EndModify(wasModifying)
+        sharedArray = None
+      else:
+        isShared = self.resultCache.isShared if self.resultCache is not None else None
+        sharedArray = self.bridge.push(img, node, share=not cached, buffer=buffer, isShared=isShared)
 
-  def updateOutput(self,img):
-
-    node = slicer.mrmlScene.GetNodeByID(self.outputNodeID)
+    if intermediate:
+      return
 
-    # Volume is temporarily set to empty during reading from file, pause rendering to avoid warnings
-    with slicer.util.RenderBlocker():
-      sitkUtils.PushVolumeToSlicer(img, node)
+    if self.resultCache is not None and self.cacheKey is not None and not cached:
+      self.resultCache.put(self.cacheKey, img, sharedArray, node.GetID())
 
-    if self.showOutput:
-      applicationLogic = slicer.app.applicationLogic()
-      selectionNode = applicationLogic.GetSelectionNode()
+    # the volume is already shown when it is the input, its views are
+    # updated by the modification
+    if self.showOutput and not self.outputIsInput:
+      with profile.stage("display"):
+        applicationLogic = slicer.app.applicationLogic()
+        selectionNode = applicationLogic.GetSelectionNode()
 
-      if self.outputLabelMap:
-        selectionNode.SetReferenceActiveLabelVolumeID(node.GetID())
-      else:
-        selectionNode.SetReferenceActiveVolumeID(node.GetID())
+        if self.outputLabelMap:
+          selectionNode.SetReferenceActiveLabelVolumeID(node.GetID())
+        else:
+          selectionNode.SetReferenceActiveVolumeID(node.GetID())
 
-      applicationLogic.PropagateVolumeSelection(0)
-      applicationLogic.FitSliceToAll()
+        applicationLogic.PropagateVolumeSelection(0)
+        applicationLogic.FitSliceToAll()
 
-  def run(self, filter, outputMRMLNode, outputLabelMap, *inputs):
+  def run(self, filter, outputMRMLNode, outputLabelMap, *inputs, filterDescription=None,
+          region=None, margin=None, fullSizeOutput=False, draftLevel=0):
     """
     Run the actual algorithm
+
+    When the json description of the filter is given, the inputs are
+    cast to a supported pixel type before execution.
+
+    When a region (index, size) of the first input is given, all the
+    inputs are cropped to it grown by margin voxels, by default the
+    margin estimated by Regions.filterMargin. The result is trimmed back
+    to the region, and written as is to the output node, or pasted into
+    a volume the size of the first input, zero outside the region, when
+    fullSizeOutput is set. The index parameters of filter are moved into
+    the cropped inputs.
+
+    When draftLevel is above 0, the filter runs on the inputs shrunk by
+    up to 2**draftLevel along each axis, with its parameters in voxels
+    rescaled, and the result is resampled on the grid of the first
+    input. A draft cannot be restricted to a region or tiled.
+
+    When memoryBudget is set, a run whose estimated peak memory exceeds
+    it raises a MemoryBudget.MemoryBudgetError, see admitRun.
+
+    When the output node is the first input, a pointwise filter writes
+    its output over the voxels of the node, see inPlaceOutputArray, and
+    the views are not reset as for a new volume.
     """
 
     if self.thread.is_alive():
@@ -584,14 +1627,13 @@ class SimpleFiltersLogic:
       sys.stderr.write("FilterLogic is already executing!")
       return
 
-    inputImages = []
+    self.profile = Profiling.RunProfile(filter.GetName())
+    copiedBytes = self.bridge.copiedBytes
+    inputImages = self.pullInputs(inputs)
+    copiedBytes = self.bridge.copiedBytes - copiedBytes
 
-    for imgNode in inputs:
-      if imgNode is None:
-        break
-
-      img = sitkUtils.PullVolumeFromSlicer(imgNode)
-      inputImages.append(img)
+    self.castPixelIDs = PixelTypes.castPixelIDs(filterDescription, [img.GetPixelID() for img in inputImages])
+    self.pixelTypesKnown = PixelTypes.pixelTypesKnown(filterDescription)
 
     self.output = None
     # check
@@ -599,14 +1641,972 @@ class SimpleFiltersLogic:
       raise ValueError("Output volume is not selected")
     self.outputNodeID = outputMRMLNode.GetID()
     self.outputLabelMap = outputLabelMap
+    self.outputIsInput = bool(inputs) and inputs[0] is not None and inputs[0].GetID() == self.outputNodeID
+    self.filterDescription = filterDescription
 
     self.abort = False
 
+    self.region = region
+    self.processedRegion = None
+    self.fullSizeOutput = fullSizeOutput
+    self.draftLevel = draftLevel
+    if draftLevel > 0 and (region is not None or self.tiled):
+      raise ValueError("A draft runs on the whole volume, it cannot be combined with a region of interest or tiled execution.")
+    if region is not None:
+      if margin is None:
+        margin = Regions.filterMargin(filter, inputImages[0].GetSpacing())
+      self.processedRegion = Regions.padRegion(region[0], region[1], margin, inputImages[0].GetSize())
+      if self.processedRegion is None:
+        raise ValueError("The region of interest is outside of the input volume")
+
+    if self.tiled:
+      # refuse a filter which cannot be tiled before starting
+      Tiling.tilingMargin(filter, inputImages[0].GetSpacing())
+
+    # the results of tiled runs may not fit in memory, they are not cached
+    self.cacheKey = None
+    if self.resultCache is not None and not self.tiled:
+      runKey = None
+      if region is not None or draftLevel > 0:
+        runKey = [region, self.processedRegion, fullSizeOutput, draftLevel]
+      self.cacheKey = self.resultCacheKey(filter, inputs[:len(inputImages)], runKey)
+
+    if self.processedRegion is not None:
+      Regions.shiftIndexParameters(filter, Regions.indexParameterNames(filterDescription), self.processedRegion)
+
+    if draftLevel > 0:
+      Pyramid.scaleParameters(filter, filterDescription, Pyramid.shrinkFactors(inputImages[0].GetSize(), draftLevel))
+      self.draftInputs = [(self.volumeKey(node), node.IsA("vtkMRMLLabelMapVolumeNode"))
+                          for node in inputs[:len(inputImages)]]
+
+    if self.cacheKey is not None:
+      img = self.resultCache.get(self.cacheKey)
+      if img is not None:
+        # deliver the cached result through main_queue, as a run would
+        listener = self.listener
+        self.main_queue_start()
+        self.main_queue_put(lambda: listener.onLogicEventStart())
+        self.postOutput(img, cached=True)
+        self.main_queue_put(lambda: listener.onLogicEventEnd())
+        self.main_queue_put(self.main_queue_stop)
+        return
+
+    self.inPlaceArray = None
+    if self.outputIsInput:
+      self.inPlaceArray = self.inPlaceOutputArray(filter, filterDescription, outputMRMLNode, inputImages)
+      if self.inPlaceArray is not None:
+        # the result is the buffer of the node, it is not cached
+        self.cacheKey = None
+
+    self.admitRun(filter, filterDescription, inputImages, copiedBytes)
+
+    if self.inPlaceArray is not None and self.resultCache is not None:
+      # the cached results sharing the buffer of the node would be
+      # written over
+      self.resultCache.discardShared(outputMRMLNode.GetImageData().GetPointData().GetScalars())
+
     self.thread = threading.Thread( target=lambda f=filter,i=inputImages:self.thread_doit(f,*inputImages))
 
     self.main_queue_start()
     self.thread.start()
 
+  def inPlaceOutputArray(self, filter, filterDescription, node, inputImages):
+    """Return the voxels of node, the first input and the output of the
+    run, if the filter is pointwise and its output has their type, so it
+    can be written over them, otherwise None. See Fusion.executeInPlace."""
+    if self.region is not None or self.draftLevel > 0 or self.tiled:
+      return None
+    imageData = node.GetImageData()
+    if imageData is None or imageData.GetPointData().GetScalars() is None:
+      return None
+    arr = slicer.util.arrayFromVolume(node)
+    if not Fusion.canExecuteInPlace(filter, inputImages, arr, filterDescription):
+      return None
+    return arr
+
+  def estimateMemory(self, filter, filterDescription, inputImages, copiedBytes, castPixelIDs, tiled):
+    """Return the MemoryBudget.MemoryEstimate of the run set up by run(),
+    with the inputs cast to castPixelIDs, run block by block when tiled
+    is set"""
+    if self.inPlaceArray is not None and not tiled:
+      # the output is written over the first input, chunk by chunk
+      estimate = MemoryBudget.MemoryEstimate()
+      estimate.add("pull", copiedBytes)
+      return estimate
+    executePixelIDs = [img.GetPixelID() if pixelID is None else pixelID
+                       for img, pixelID in zip(inputImages, castPixelIDs or [None]*len(inputImages))]
+    outputPixelID = PixelTypes.outputPixelID(filterDescription, executePixelIDs, filter)
+    workingFactor = MemoryBudget.DEFAULT_WORKING_FACTOR
+    if self.memoryModel is not None:
+      workingFactor = self.memoryModel.workingFactor(filter.GetName())
+
+    def count(size):
+      n = 1
+      for s in size:
+        n *= s
+      return n
+
+    size = inputImages[0].GetSize()
+    numberOfPixels = count(size)
+    processedPixels = outputPixels = numberOfPixels
+    reduction = "crop"
+    if tiled:
+      # the blocks processed at the same time, with their halo
+      margin = Tiling.tilingMargin(filter, inputImages[0].GetSpacing())
+      region = self.region or ([0]*len(size), list(size))
+      blockSize = [min(b+2*m, s) for b, m, s in zip(Tiling.DEFAULT_BLOCK_SIZE, margin, size)]
+      numberOfBlocks = len(Tiling.blockRegions(region, Tiling.DEFAULT_BLOCK_SIZE))
+      processedPixels = min(numberOfPixels, count(blockSize)*min(os.cpu_count() or 1, numberOfBlocks))
+      reduction = "blocks"
+      outputPixels = numberOfPixels if self.fullSizeOutput or self.region is None else count(self.region[1])
+      if self.tileDirectory:
+        # the output is in a file
+        outputPixels = None
+    elif self.processedRegion is not None:
+      processedPixels = count(self.processedRegion[1])
+      outputPixels = numberOfPixels if self.fullSizeOutput else count(self.region[1])
+    elif self.draftLevel > 0:
+      processedPixels = count(s//f for s, f in zip(size, Pyramid.shrinkFactors(size, self.draftLevel)))
+      reduction = "shrink"
+
+    return MemoryBudget.estimatePeakMemory(
+      inputImages, castPixelIDs, outputPixelID, workingFactor, copiedBytes=copiedBytes,
+      processedPixels=processedPixels, reduction=reduction, outputPixels=outputPixels,
+      pushCopy=not self.bridge.canAdopt(outputPixelID, inputImages[0].GetDimension()),
+      floatRetry=not self.pixelTypesKnown and not tiled)
+
+  def floatPixelIDs(self, filterDescription, inputImages):
+    """Return the casts of the inputs running the filter on float instead
+    of 64 bit pixels, or None if the filter does not support it"""
+    if not self.pixelTypesKnown or filterDescription.get("template_code_filename") == "DualImageFilter":
+      return None
+    supported = PixelTypes.pixelIDs(filterDescription.get("pixel_types"))
+    if not supported or sitk.sitkFloat32 not in supported:
+      return None
+    inputNames = [i.get("name", "") for i in filterDescription.get("inputs", [])]
+    castPixelIDs = list(self.castPixelIDs or [None]*len(inputImages))
+    for idx, img in enumerate(inputImages):
+      if idx < len(inputNames) and "Mask" in inputNames[idx]:
+        continue
+      pixelID = img.GetPixelID() if castPixelIDs[idx] is None else castPixelIDs[idx]
+      if pixelID not in (sitk.sitkFloat64, sitk.sitkInt64, sitk.sitkUInt64):
+        return None
+      castPixelIDs[idx] = sitk.sitkFloat32
+    return castPixelIDs
+
+  def admitRun(self, filter, filterDescription, inputImages, copiedBytes):
+    """Estimate the peak memory of the run set up by run(). When it
+    exceeds the memory budget, a MemoryBudgetError explains why the run
+    is refused and how to reduce its memory, suggesting tiled execution
+    or float inputs when the estimate of the run then fits."""
+    self.memoryEstimate = estimate = self.estimateMemory(filter, filterDescription, inputImages, copiedBytes,
+                                                         self.castPixelIDs, self.tiled)
+    if self.memoryBudget is None:
+      return
+    # the pulled copies are already allocated, they are not available
+    budget = MemoryBudget.memoryBudget(self.memoryBudget, copiedBytes)
+    if budget is None or estimate.total <= budget:
+      return
+
+    formatBytes = MemoryBudget.formatBytes
+    suggestions = []
+    pulled = estimate.parts.get("pull", 0)
+    if self.region is None and budget > pulled:
+      fraction = (budget-pulled) / (estimate.total-pulled)
+      suggestions.append(f"restrict it to a region of interest of at most {fraction*100.0:.0f}% of the volume")
+    if self.draftLevel == 0 and not self.tiled:
+      suggestions.append("run a draft")
+    if not self.tiled and self.draftLevel == 0 and self.region is None:
+      try:
+        tiledEstimate = self.estimateMemory(filter, filterDescription, inputImages, copiedBytes,
+                                            self.castPixelIDs, tiled=True)
+      except Tiling.TilingError:
+        tiledEstimate = None
+      if tiledEstimate is not None and tiledEstimate.total <= budget:
+        suggestions.append(f"turn on tiled execution, which needs about {formatBytes(tiledEstimate.total)}")
+    floatPixelIDs = self.floatPixelIDs(filterDescription, inputImages)
+    if floatPixelIDs is not None:
+      floatEstimate = self.estimateMemory(filter, filterDescription, inputImages, copiedBytes,
+                                          floatPixelIDs, self.tiled)
+      if floatEstimate.total <= budget:
+        suggestions.append(f"cast its inputs to float first, which needs about {formatBytes(floatEstimate.total)}")
+    MemoryBudget.checkBudget(filter.GetName(), estimate, budget, suggestions)
+
+  def pullInputs(self, inputs):
+    """Return the images of the input nodes, up to the first missing one"""
+    inputImages = []
+    for imgNode in inputs:
+      if imgNode is None:
+        break
+
+      # the image shares the voxel buffer of the node when possible
+      copiedBytes = self.bridge.copiedBytes
+      with self.profile.stage("pull", lambda: self.bridge.copiedBytes - copiedBytes):
+        img = self.bridge.pull(imgNode)
+      inputImages.append(img)
+    return inputImages
+
+  def runPipeline(self, pipeline, outputNodes, *inputs):
+    """Run the steps of a SimpleFiltersLib.Pipeline.Pipeline one after
+    the other in a single worker thread. When memoryBudget is set, a
+    pipeline whose estimated peak memory exceeds it raises a
+    MemoryBudget.MemoryBudgetError.
+
+    outputNodes is a dictionary of the node to write the output of each
+    step marked for display, and of the last step, by step index. The
+    other intermediate images are never pushed to the scene, and are
+    released once the steps using them have run.
+    """
+    if self.thread.is_alive():
+      import sys
+      sys.stderr.write("FilterLogic is already executing!")
+      return
+
+    last = len(pipeline.steps)-1
+    if last < 0:
+      raise ValueError("The pipeline has no step")
+    if outputNodes.get(last) is None:
+      raise ValueError("Output volume is not selected")
+
+    self.profile = Profiling.RunProfile("Pipeline")
+    copiedBytes = self.bridge.copiedBytes
+    inputImages = self.pullInputs(inputs)
+    copiedBytes = self.bridge.copiedBytes - copiedBytes
+    if len(inputImages) < pipeline.numberOfInputs():
+      raise ValueError("An input volume of the pipeline is missing")
+
+    workingFactor = self.memoryModel.workingFactor if self.memoryModel is not None else None
+    self.memoryEstimate = MemoryBudget.estimatePipelinePeakMemory(pipeline, inputImages, workingFactor, copiedBytes)
+    if self.memoryBudget is not None:
+      suggestions = []
+      if any(step.display for step in pipeline.steps[:-1]):
+        suggestions.append("show fewer intermediate steps")
+      # the pulled copies are already allocated, they are not available
+      MemoryBudget.checkBudget("The pipeline", self.memoryEstimate,
+                               MemoryBudget.memoryBudget(self.memoryBudget, copiedBytes), suggestions)
+
+    self.output = None
+    self.outputNodeID = outputNodes[last].GetID()
+    self.outputLabelMap = pipeline.steps[last].outputLabelMap
+    self.pipelineOutputNodeIDs = {index: node.GetID() for index, node in outputNodes.items() if index != last}
+    self.outputIsInput = False
+    self.inPlaceArray = None
+    self.abort = False
+    self.castPixelIDs = None
+    self.region = None
+    self.processedRegion = None
+    self.draftLevel = 0
+    self.cacheKey = None
+
+    self.thread = threading.Thread(target=lambda: self.thread_pipeline(pipeline, *inputImages))
+    self.main_queue_start()
+    self.thread.start()
+
+  def thread_pipeline(self, pipeline, *inputImages):
+    """Run the steps of a pipeline. The start, end and progress are
+    reported from here, the progress of a step is the fraction of the
+    steps done."""
+    listener = self.listener
+    profile = self.profile
+    numberOfSteps = len(pipeline.steps)
+    stepStarts = []
+
+    def stageName(first, last):
+      if first == last:
+        return f"{first+1}. {pipeline.steps[first].name}"
+      return f"{first+1}-{last+1}. fused " + " > ".join(step.name for step in pipeline.steps[first:last+1])
+
+    def startStep(first, last):
+      now = profile.now()
+      if stepStarts:
+        profile.addStage(stageName(*stepStarts[-1][:2]), stepStarts[-1][2], now)
+      stepStarts.append((first, last, now))
+      self.progress = first/numberOfSteps
+
+    def showStep(index, img):
+      self.postOutput(img, outputNodeID=self.pipelineOutputNodeIDs[index])
+
+    try:
+      for index, step in enumerate(pipeline.steps):
+        step.filter.AddCommand(sitk.sitkProgressEvent,
+                               lambda f=step.filter, i=index: setattr(self, "progress", (i+f.GetProgress())/numberOfSteps))
+        step.filter.AddCommand(sitk.sitkProgressEvent, lambda f=step.filter: self.cmdCheckAbort(f))
+
+      self.main_queue_put(lambda: listener.onLogicEventStart())
+      img = pipeline.execute(inputImages, outputCallback=showStep, stepCallback=startStep,
+                             abortCallback=lambda: self.abort)
+      if img is None or self.abort:
+        self.main_queue_put(lambda: listener.onLogicEventAbort())
+        return
+      profile.addStage(stageName(*stepStarts[-1][:2]), stepStarts[-1][2], profile.now())
+      self.postOutput(img)
+      self.main_queue_put(lambda: listener.onLogicEventEnd())
+
+    except Exception as e:
+      import traceback
+      traceback.print_exc()
+      self.abort = True
+      msg = str(e)
+      step = f"step {stepStarts[-1][0]+1} of the pipeline" if stepStarts else "the pipeline"
+      if self.showErrors:
+        detailedText = traceback.format_exc()
+        self.main_queue_put(lambda: slicer.util.errorDisplay(f"Error during execution of {step}:\n\n{msg}",
+                                                             detailedText=detailedText))
+      else:
+        import sys
+        sys.stderr.write(f"Error during execution of {step}: {msg}\n")
+    finally:
+      for step in pipeline.steps:
+        step.filter.RemoveAllCommands()
+      self.main_queue_put(self.main_queue_stop)
+
+  @staticmethod
+  def volumeKey(node):
+    """Key of the voxels of a volume node: its ID and the modification
+    times of its image data and scalars"""
+    imageData = node.GetImageData()
+    scalars = imageData.GetPointData().GetScalars() if imageData else None
+    return (node.GetID(),
+            imageData.GetMTime() if imageData else 0,
+            scalars.GetMTime() if scalars else 0)
+
+  @staticmethod
+  def resultCacheKey(filter, inputs, runKey=None):
+    """Key of a run for the ResultCache: the filter name, its parameters
+    as printed by printPythonCommand, the modification times and
+    geometry of the input volumes, and a json serializable key of the
+    options of the run, as the processed region and draft level."""
+    parameters = filterParameterValues(filter)
+    # the number of threads does not change the result
+    for name in ("NumberOfThreads", "NumberOfWorkUnits", "Debug"):
+      parameters.pop(name, None)
+
+    inputKeys = []
+    for node in inputs:
+      ijkToRAS = vtk.vtkMatrix4x4()
+      node.GetIJKToRASMatrix(ijkToRAS)
+      inputKeys.append(list(SimpleFiltersLogic.volumeKey(node))
+                       + [[ijkToRAS.GetElement(r, c) for r in range(3) for c in range(4)]])
+    if runKey is not None:
+      inputKeys.append(runKey)
+    return ResultCache.makeKey(filter.GetName(), parameters, inputKeys)
+
+  def runNodes(self, filterName, parameters, outputMRMLNode, *inputs):
+    """Run a filter synchronously on volume nodes, without the event
+    loop. parameters is a dictionary of member names and values."""
+    from SimpleFiltersLib import Batch
+    return Batch.processNodes(filterName, parameters, inputs, outputMRMLNode)
+
+  def runBatch(self, filterName, parameters, cases, processes=None, callback=None):
+    """Process a cohort of (input files, output file) cases with a pool
+    of processes, see SimpleFiltersLib.Batch.runCohort."""
+    from SimpleFiltersLib import Batch
+    return Batch.runCohort(filterName, parameters, cases, processes=processes, callback=callback)
+
+#
+# SimpleFiltersJobScheduler
+#
+
+class SimpleFiltersJob(SimpleFiltersLogicListener):
+  """A filter run submitted to a SimpleFiltersJobScheduler.
+
+  The job owns a copy of the filter, so the parameters in the GUI can be
+  changed while it is queued or running. It receives the notifications
+  of its SimpleFiltersLogic and forwards its state changes to the
+  scheduler.
+  """
+
+  QUEUED = "Queued"
+  RUNNING = "Running"
+  COMPLETED = "Completed"
+  ABORTED = "Aborted"
+  FAILED = "Failed"
+
+  def __init__(self, scheduler, filter, outputNode, outputLabelMap, inputs, showOutput=True, filterDescription=None,
+               region=None, fullSizeOutput=True, tiled=False, draftLevel=0):
+    self.scheduler = scheduler
+    # a pipeline job has no filter of its own, see SimpleFiltersPipelineJob
+    self.filter = cloneFilter(filter) if filter is not None else None
+    self.filterDescription = filterDescription
+    # region of interest of the first input, see SimpleFiltersLogic.run
+    self.region = region
+    self.fullSizeOutput = fullSizeOutput
+    self.tiled = tiled
+    self.draftLevel = draftLevel
+    self.name = filter.GetName() if filter is not None else None
+    self.outputNodeID = outputNode.GetID()
+    self.outputName = outputNode.GetName()
+    self.outputLabelMap = outputLabelMap
+    # as in SimpleFiltersLogic.run, the inputs end at the first missing one
+    self.inputNodeIDs = []
+    for n in inputs:
+      if n is None:
+        break
+      self.inputNodeIDs.append(n.GetID())
+    # number of voxels the filter runs on, to tune the number of threads
+    self.numberOfPixels = self.processedPixels(inputs[0] if self.inputNodeIDs else None)
+    self.showOutput = showOutput
+    self.status = self.QUEUED
+    self.progress = 0.0
+    self.numberOfThreads = None
+    self.cancelled = False
+    self.startTime = None
+    self.elapsedTime = None
+    self.logic = None
+    # estimated peak memory of the run
+    self.memoryEstimate = None
+
+  def isFinished(self):
+    return self.status in (self.COMPLETED, self.ABORTED, self.FAILED)
+
+  def outputNodeIDs(self):
+    """Return the IDs of the nodes the job writes to"""
+    return [self.outputNodeID]
+
+  def processedPixels(self, inputNode):
+    """Return the number of voxels of the first input the filter runs
+    on, within the region of interest or at the draft resolution"""
+    imageData = inputNode.GetImageData() if inputNode is not None else None
+    if imageData is None:
+      return 0
+    size = list(imageData.GetDimensions())
+    if self.region is not None:
+      size = list(self.region[1])
+    if self.draftLevel > 0:
+      size = [s // f for s, f in zip(size, Pyramid.shrinkFactors(size, self.draftLevel))]
+    numberOfPixels = 1
+    for s in size:
+      numberOfPixels *= s
+    return numberOfPixels
+
+  def memoryText(self):
+    if self.memoryEstimate is None:
+      return ""
+    return (f"Estimated peak memory {MemoryBudget.formatBytes(self.memoryEstimate.total)}"
+            f" ({self.memoryEstimate.describe()})")
+
+  def statusText(self):
+    if self.status == self.RUNNING and self.startTime is not None:
+      return f"Running ({self.progress*100.0:3.1f}%)"
+    if self.status == self.COMPLETED and self.elapsedTime is not None:
+      return f"Completed ({self.elapsedTime:3.1f}s)"
+    return self.status
+
+  def setShowOutput(self, showOutput):
+    self.showOutput = showOutput
+    if self.logic:
+      self.logic.showOutput = showOutput
+
+  def start(self, numberOfThreads):
+    self.numberOfThreads = numberOfThreads
+    if hasattr(self.filter, "SetNumberOfThreads"):
+      self.filter.SetNumberOfThreads(numberOfThreads)
+
+    inputs = [slicer.mrmlScene.GetNodeByID(nodeID) for nodeID in self.inputNodeIDs]
+    outputNode = slicer.mrmlScene.GetNodeByID(self.outputNodeID)
+
+    self.status = self.RUNNING
+    self.logic = SimpleFiltersLogic(listener=self)
+    self.logic.showOutput = self.showOutput
+    self.logic.resultCache = self.scheduler.resultCache
+    self.logic.tiled = self.tiled
+    self.logic.tileDirectory = self.scheduler.tileDirectory
+    self.logic.pyramidCache = self.scheduler.pyramidCache
+    self.logic.memoryBudget = self.scheduler.memoryBudget
+    self.logic.memoryModel = self.scheduler.memoryModel
+    self.logic.run(self.filter, outputNode, self.outputLabelMap, *inputs,
+                   filterDescription=self.filterDescription,
+                   region=self.region, fullSizeOutput=self.fullSizeOutput,
+                   draftLevel=self.draftLevel)
+
+  def cancel(self):
+    self.cancelled = True
+    if self.logic:
+      self.logic.abort = True
+
+  # Notifications from SimpleFiltersLogic
+
+  def onLogicRunStart(self):
+    self.scheduler.onJobChanged(self)
+
+  def onLogicRunStop(self):
+    if self.status == self.RUNNING:
+      self.status = self.ABORTED if self.cancelled else self.FAILED
+    self.profile = self.logic.profile
+    self.memoryEstimate = self.logic.memoryEstimate
+    if self.profile is not None:
+      self.scheduler.profiler.add(self.profile)
+    self.scheduler.releaseLogic(self.logic)
+    self.logic = None
+    self.scheduler.onJobFinished(self)
+
+  def onLogicEventStart(self):
+    self.startTime = time.time()
+    self.scheduler.onJobChanged(self)
+
+  def onLogicEventEnd(self):
+    if self.startTime is not None:
+      self.elapsedTime = time.time() - self.startTime
+    self.progress = 1.0
+    self.status = self.COMPLETED
+    self.scheduler.onJobChanged(self)
+
+  def onLogicEventAbort(self):
+    self.status = self.ABORTED
+    self.scheduler.onJobChanged(self)
+
+  def onLogicEventProgress(self, progress):
+    self.progress = progress
+    self.scheduler.onJobChanged(self)
+
+  def onLogicEventIteration(self, nIter):
+    print("Iteration " , nIter)
+
+
+class SimpleFiltersPipelineJob(SimpleFiltersJob):
+  """A Pipeline submitted to a SimpleFiltersJobScheduler, all its steps
+  run in a single job. The job owns a copy of the pipeline."""
+
+  def __init__(self, scheduler, pipeline, outputNodes, inputs, showOutput=True):
+    last = len(pipeline.steps)-1
+    SimpleFiltersJob.__init__(self, scheduler, None, outputNodes[last],
+                              pipeline.steps[last].outputLabelMap, inputs, showOutput)
+    self.pipeline = pipeline.clone()
+    self.name = " > ".join(step.name for step in pipeline.steps)
+    self.pipelineOutputNodeIDs = {index: node.GetID() for index, node in outputNodes.items()}
+
+  def outputNodeIDs(self):
+    return list(self.pipelineOutputNodeIDs.values())
+
+  def start(self, numberOfThreads):
+    self.numberOfThreads = numberOfThreads
+    self.pipeline.setNumberOfThreads(numberOfThreads)
+
+    inputs = [slicer.mrmlScene.GetNodeByID(nodeID) for nodeID in self.inputNodeIDs]
+    outputNodes = {index: slicer.mrmlScene.GetNodeByID(nodeID) for index, nodeID in self.pipelineOutputNodeIDs.items()}
+
+    self.status = self.RUNNING
+    self.logic = SimpleFiltersLogic(listener=self)
+    self.logic.showOutput = self.showOutput
+    self.logic.memoryBudget = self.scheduler.memoryBudget
+    self.logic.memoryModel = self.scheduler.memoryModel
+    self.logic.runPipeline(self.pipeline, outputNodes, *inputs)
+
+
+class SimpleFiltersJobScheduler:
+  """Runs filter jobs concurrently within a budget of cores.
+
+  At most maxConcurrentJobs jobs run at the same time, and the cores of
+  the budget are split evenly between them with SetNumberOfThreads. A
+  job waits while it would write to a volume used by a running job, or
+  read the volume a running job writes to.
+
+  The number of threads of a job is numberOfThreads when it is set. With
+  a ThreadTuner, it is the one which ran the filter fastest on images of
+  the size of its input, up to that number, and the execution times of
+  the completed jobs are added to the tuner.
+
+  The peak memory of each job is checked against memoryBudget, see
+  SimpleFiltersLogic.admitRun, with the working memory of the filters
+  learned by the optional MemoryModel from the completed jobs.
+
+  The listener is called with the job each time the state of a job
+  changes, and the profiles of the finished jobs are kept in profiler.
+  """
+
+  def __init__(self, listener=None, coreBudget=None, maxConcurrentJobs=2, resultCache=None, tileDirectory=None,
+               pyramidCache=None):
+    importSimpleITK()
+    self.listener = listener
+    self.coreBudget = coreBudget if coreBudget else (os.cpu_count() or 1)
+    self.maxConcurrentJobs = maxConcurrentJobs
+    # results shared by the jobs, None to always execute the filters
+    self.resultCache = resultCache
+    # directory of the temporary files holding the results of tiled jobs,
+    # None to keep them in memory
+    self.tileDirectory = tileDirectory
+    # shrunk inputs shared by the draft jobs
+    self.pyramidCache = pyramidCache
+    self.profiler = Profiling.Profiler()
+    # threads of each job, None to split the core budget between the
+    # concurrent jobs, and the optional ThreadTuner
+    self.numberOfThreads = None
+    self.threadTuner = None
+    # bytes a job may use, 0 for a fraction of the available memory and
+    # None to not check it, and the optional MemoryModel
+    self.memoryBudget = None
+    self.memoryModel = None
+    self.jobs = []
+    # logics of the finished jobs, see releaseLogic
+    self.finishedLogics = []
+
+  def submitPipeline(self, pipeline, outputNodes, inputs, showOutput=True):
+    """Queue a run of a Pipeline, see SimpleFiltersLogic.runPipeline,
+    and return the SimpleFiltersPipelineJob"""
+    if outputNodes.get(len(pipeline.steps)-1) is None:
+      raise ValueError("Output volume is not selected")
+    job = SimpleFiltersPipelineJob(self, pipeline, outputNodes, inputs, showOutput)
+    self.jobs.append(job)
+    self.onJobChanged(job)
+    self.startPendingJobs()
+    return job
+
+  def submit(self, filter, outputNode, outputLabelMap, inputs, showOutput=True, filterDescription=None,
+             region=None, fullSizeOutput=True, tiled=False, draftLevel=0):
+    """Queue a run of filter and return the SimpleFiltersJob"""
+    if outputNode is None:
+      raise ValueError("Output volume is not selected")
+    job = SimpleFiltersJob(self, filter, outputNode, outputLabelMap, inputs, showOutput, filterDescription,
+                           region, fullSizeOutput, tiled, draftLevel)
+    self.jobs.append(job)
+    self.onJobChanged(job)
+    self.startPendingJobs()
+    return job
+
+  def cancel(self, job):
+    if job.status == SimpleFiltersJob.QUEUED:
+      job.cancelled = True
+      job.status = SimpleFiltersJob.ABORTED
+      self.onJobChanged(job)
+    elif job.status == SimpleFiltersJob.RUNNING:
+      job.cancel()
+
+  def cancelAll(self):
+    for job in self.jobs:
+      self.cancel(job)
+
+  def runningJobs(self):
+    return [job for job in self.jobs if job.status == SimpleFiltersJob.RUNNING]
+
+  def pendingJobs(self):
+    return [job for job in self.jobs if job.status == SimpleFiltersJob.QUEUED]
+
+  def clearFinishedJobs(self):
+    self.jobs = [job for job in self.jobs if not job.isFinished()]
+
+  def threadsPerJob(self, job=None):
+    maxThreads = self.numberOfThreads or max(1, self.coreBudget // max(1, self.maxConcurrentJobs))
+    # tiled jobs run their blocks with their own workers, and pipelines
+    # run several filters
+    if (self.threadTuner is not None and job is not None and job.filter is not None
+        and not job.tiled and job.numberOfPixels):
+      return self.threadTuner.choose(job.name, job.numberOfPixels, maxThreads)
+    return maxThreads
+
+  def releaseLogic(self, logic=None):
+    """Keep the SimpleFiltersLogic of a finished job, and release the
+    ones which are done processing their main_queue. A logic owns the
+    notifier which reports the end of its run, it is not deleted from
+    within that notification."""
+    self.finishedLogics = [l for l in self.finishedLogics if l.main_queue_processing]
+    if logic is not None:
+      self.finishedLogics.append(logic)
+
+  def startPendingJobs(self):
+    self.releaseLogic()
+    # a job waits for the running jobs and the older queued jobs it
+    # conflicts with, so the results are written in the order the jobs
+    # were submitted
+    waiting = []
+    for job in self.pendingJobs():
+      running = self.runningJobs()
+      if len(running) >= self.maxConcurrentJobs:
+        break
+      if any(self._conflicts(job, other) for other in running + waiting):
+        waiting.append(job)
+        continue
+      try:
+        job.start(self.threadsPerJob(job))
+      except Exception as e:
+        import traceback
+        traceback.print_exc()
+        job.status = SimpleFiltersJob.FAILED
+        job.logic = None
+        self.onJobChanged(job)
+        slicer.util.errorDisplay(
+          f'Error before execution of {job.name}:\n\n{e}',
+          detailedText=traceback.format_exc()
+          )
+
+  def onJobChanged(self, job):
+    if self.listener:
+      self.listener.onJobChanged(job)
+
+  def onJobFinished(self, job):
+    if (self.threadTuner is not None and job.status == SimpleFiltersJob.COMPLETED
+        and job.profile is not None and not job.tiled):
+      # a result from the cache has no execute stage
+      execute = job.profile.totals().get("execute")
+      if execute is not None:
+        self.threadTuner.record(job.name, job.numberOfPixels, job.numberOfThreads, execute[0])
+        self.threadTuner.save()
+    if (self.memoryModel is not None and job.status == SimpleFiltersJob.COMPLETED
+        and job.profile is not None and job.memoryEstimate is not None and not job.tiled):
+      if self.memoryModel.recordRun(job.name, job.memoryEstimate, job.profile):
+        self.memoryModel.save()
+    self.onJobChanged(job)
+    self.startPendingJobs()
+
+  @staticmethod
+  def _conflicts(job, other):
+    """True if job must wait for other to finish"""
+    outputs, otherOutputs = set(job.outputNodeIDs()), set(other.outputNodeIDs())
+    return bool(outputs & otherOutputs
+                or outputs & set(other.inputNodeIDs)
+                or otherOutputs & set(job.inputNodeIDs))
+
+#
+# SimpleFiltersPreview
+#
+
+class SimpleFiltersPreview(SimpleFiltersLogicListener):
+  """Runs the selected filter on a slab around the slice shown in a
+  slice view, and shows the result over the input in that view.
+
+  The preview runs again DEBOUNCE_INTERVAL_MS after the last change of
+  a parameter or of the slice, and a run which is out of date is
+  aborted. The slice is processed with the margin of the filter around
+  it, see Regions.filterMargin. The previewed slice matches the result
+  on the whole volume only for pointwise filters and the filters whose
+  margin is exact, see isExact, it is an approximation for the others.
+  """
+
+  DEBOUNCE_INTERVAL_MS = 300
+  TOOLTIP = "Run the algorithm on the slice shown in the slice view each time a parameter or the slice changes, and show the result over the input. Apply runs it on the whole volume."
+  APPROXIMATE_TOOLTIP = "The output of this algorithm depends on voxels far from the slice, the preview may differ from the result on the whole volume."
+  FOREGROUND_OPACITY = 0.5
+  NODE_NAME = "SimpleFilters Preview"
+
+  def __init__(self):
+    self.enabled = False
+    self.filterParameters = None
+    self.logic = None
+    # logics of the finished runs, see onLogicRunStop
+    self.finishedLogics = []
+    self.rerun = False
+    self.completed = False
+    self.labelMap = False
+    self.lastRunKey = None
+    self.previewNodeID = None
+    # slice view showing the preview, and its composite node settings
+    # before the preview was shown
+    self.sliceViewName = None
+    self.sliceNode = None
+    self.sliceNodeObserver = None
+    self.savedComposite = None
+
+    self.timer = qt.QTimer()
+    self.timer.setSingleShot(True)
+    self.timer.setInterval(self.DEBOUNCE_INTERVAL_MS)
+    self.timer.connect('timeout()', self.run)
+
+  def setEnabled(self, enabled):
+    if enabled == self.enabled:
+      return
+    self.enabled = enabled
+    if enabled:
+      self.schedule()
+    else:
+      self.timer.stop()
+      self.cancel()
+      self.setSliceView(None)
+      self.removePreviewNode()
+
+  def setFilterParameters(self, filterParameters):
+    self.filterParameters = filterParameters
+    self.schedule()
+
+  def isExact(self):
+    """Return True if the previewed slice of the selected filter matches
+    the result on the whole volume"""
+    sitkFilter = self.filterParameters.filter if self.filterParameters else None
+    if sitkFilter is None:
+      return True
+    return (sitkFilter.__class__.__name__ in Tiling.POINTWISE_FILTERS
+            or Regions.isMarginExact(sitkFilter))
+
+  def schedule(self):
+    """Run the preview once there are no changes for DEBOUNCE_INTERVAL_MS"""
+    if self.enabled:
+      self.timer.start()
+
+  def cancel(self):
+    self.rerun = False
+    if self.logic:
+      self.logic.abort = True
+
+  def inputNodes(self):
+    # as in SimpleFiltersLogic.run, the inputs end at the first missing one
+    nodes = []
+    for node in self.filterParameters.inputs if self.filterParameters else []:
+      if node is None:
+        break
+      nodes.append(node)
+    return nodes
+
+  def findSliceView(self, inputNode):
+    """Return the name of the first visible slice view showing the input
+    as background, or of the first slice view if none does"""
+    layoutManager = slicer.app.layoutManager()
+    if layoutManager is None:
+      return None
+    names = list(layoutManager.sliceViewNames())
+    for name in names:
+      sliceWidget = layoutManager.sliceWidget(name)
+      if (sliceWidget.isVisible()
+          and sliceWidget.mrmlSliceCompositeNode().GetBackgroundVolumeID() == inputNode.GetID()):
+        return name
+    return names[0] if names else None
+
+  def setSliceView(self, name):
+    """Follow the slice of the named view, restoring the previous one"""
+    if name == self.sliceViewName:
+      return
+    if self.sliceNodeObserver is not None:
+      self.sliceNode.RemoveObserver(self.sliceNodeObserver)
+    self.restoreComposite()
+    self.sliceViewName = name
+    self.sliceNode = None
+    self.sliceNodeObserver = None
+    if name is not None:
+      self.sliceNode = slicer.app.layoutManager().sliceWidget(name).mrmlSliceNode()
+      self.sliceNodeObserver = self.sliceNode.AddObserver(vtk.vtkCommand.ModifiedEvent, lambda caller, event: self.schedule())
+
+  def compositeNode(self):
+    if self.sliceViewName is None:
+      return None
+    return slicer.app.layoutManager().sliceWidget(self.sliceViewName).mrmlSliceCompositeNode()
+
+  def sliceRegion(self, inputNode):
+    """Return the region of the input at the slice of the view, or None
+    if the slice does not cross the volume"""
+    sliceToRAS = self.sliceNode.GetSliceToRAS()
+    center = [sliceToRAS.GetElement(r, 3) for r in range(3)]
+    normal = [sliceToRAS.GetElement(r, 2) for r in range(3)]
+
+    # the slab is along the volume axis nearest to the slice normal
+    rasToIJK = vtk.vtkMatrix4x4()
+    inputNode.GetRASToIJKMatrix(rasToIJK)
+    ijkNormal = [sum(rasToIJK.GetElement(r, c)*normal[c] for c in range(3)) for r in range(3)]
+    axis = max(range(3), key=lambda a: abs(ijkNormal[a]))
+
+    sliceIndex = VolumeBridge.rasToIndex(inputNode, center)[0][axis]
+    return Regions.sliceRegion(inputNode.GetImageData().GetDimensions(), axis, sliceIndex)
+
+  def run(self):
+    if not self.enabled or self.filterParameters is None or self.filterParameters.filter is None:
+      return
+
+    if self.logic is not None:
+      # the running preview is out of date, run again once it stops
+      self.rerun = True
+      self.logic.abort = True
+      return
+
+    inputs = self.inputNodes()
+    if not inputs or inputs[0].GetImageData() is None:
+      return
+    self.setSliceView(self.findSliceView(inputs[0]))
+    if self.sliceNode is None:
+      return
+
+    parameters = self.filterParameters
+    try:
+      parameters.prerun()
+      sitkFilter = cloneFilter(parameters.filter)
+      region = self.sliceRegion(inputs[0])
+    except Exception as e:
+      import sys
+      sys.stderr.write(f"Unable to preview {parameters.filter.GetName()}: {e}\n")
+      return
+    if region is None:
+      return
+
+    runKey = (SimpleFiltersLogic.resultCacheKey(sitkFilter, inputs, region), parameters.outputLabelMap)
+    if runKey == self.lastRunKey and self.previewNodeID is not None:
+      return
+    self.lastRunKey = runKey
+
+    self.labelMap = parameters.outputLabelMap
+    self.completed = False
+    self.logic = SimpleFiltersLogic(listener=self)
+    self.logic.showOutput = False
+    self.logic.showErrors = False
+    try:
+      self.logic.run(sitkFilter, self.previewNode(self.labelMap), self.labelMap, *inputs,
+                     filterDescription=parameters.json, region=region)
+    except Exception as e:
+      import sys
+      sys.stderr.write(f"Unable to preview {parameters.filter.GetName()}: {e}\n")
+      self.logic = None
+      self.lastRunKey = None
+
+  def previewNode(self, labelMap):
+    className = "vtkMRMLLabelMapVolumeNode" if labelMap else "vtkMRMLScalarVolumeNode"
+    node = slicer.mrmlScene.GetNodeByID(self.previewNodeID) if self.previewNodeID else None
+    if node is not None and not node.IsA(className):
+      self.removePreviewNode()
+      node = None
+    if node is None:
+      node = slicer.mrmlScene.AddNewNodeByClass(className, self.NODE_NAME)
+      node.SetHideFromEditors(True)
+      node.SetSaveWithScene(False)
+      self.previewNodeID = node.GetID()
+    return node
+
+  def showPreview(self):
+    compositeNode = self.compositeNode()
+    if compositeNode is None or self.previewNodeID is None:
+      return
+    if self.savedComposite is None:
+      self.savedComposite = (compositeNode.GetForegroundVolumeID(),
+                             compositeNode.GetForegroundOpacity(),
+                             compositeNode.GetLabelVolumeID())
+    if self.labelMap:
+      compositeNode.SetLabelVolumeID(self.previewNodeID)
+    else:
+      compositeNode.SetForegroundVolumeID(self.previewNodeID)
+      compositeNode.SetForegroundOpacity(self.FOREGROUND_OPACITY)
+
+  def restoreComposite(self):
+    compositeNode = self.compositeNode()
+    if compositeNode is None or self.savedComposite is None:
+      return
+    foregroundID, opacity, labelID = self.savedComposite
+    compositeNode.SetForegroundVolumeID(foregroundID)
+    compositeNode.SetForegroundOpacity(opacity)
+    compositeNode.SetLabelVolumeID(labelID)
+    self.savedComposite = None
+
+  def removePreviewNode(self):
+    self.restoreComposite()
+    node = slicer.mrmlScene.GetNodeByID(self.previewNodeID) if self.previewNodeID else None
+    if node is not None:
+      slicer.mrmlScene.RemoveNode(node)
+    self.previewNodeID = None
+    self.lastRunKey = None
+
+  # Notifications from SimpleFiltersLogic
+
+  def onLogicEventEnd(self):
+    self.completed = True
+
+  def onLogicRunStop(self):
+    # The logic owns the notifier which called this method, it is
+    # released by the next run once it is done processing.
+    logic = self.logic
+    self.finishedLogics = [l for l in self.finishedLogics if l.main_queue_processing] + [logic]
+    self.logic = None
+
+    if self.completed and not logic.abort and self.enabled:
+      self.showPreview()
+    else:
+      self.lastRunKey = None
+    if self.rerun:
+      self.rerun = False
+      self.run()
+
+
 #
 # Class to manage parameters
 #
@@ -620,17 +2620,27 @@ class FilterParameters:
 
   def __init__(self, parent=None):
     self.parent = parent
+    self.panel = None
     self.widgets = []
     self.widgetConnections = []
-    self.json = json
+    self.json = None
     self.filter = None
+    self.binding = None
     self.inputs = []
+    self.inputSelectors = []
     self.output = None
     self.prerun_callbacks = []
     self.outputLabelMap = False
+    # called when the value of a parameter widget or an input changes
+    self.parameterChangedCallback = None
+    # key -> (node, observer tags) of the markups nodes of the selectors,
+    # so moving a point or the region updates the parameters
+    self.nodeObservers = {}
 
     self.outputSelector = None
     self.outputVolumeTypeLabel = None
+    self.roiSelector = None
+    self.cropOutputCheckBox = None
 
   def __del__(self):
     self.widgetConnections = []
@@ -643,13 +2653,21 @@ class FilterParameters:
     if not self.parent:
       raise "no parent"
 
-    parametersFormLayout = self.parent.layout()
+    # all the widgets of the filter live in one panel, so it can be
+    # hidden and shown again when switching between filters
+    self.panel = qt.QWidget()
+    parametersFormLayout = qt.QFormLayout(self.panel)
+    parametersFormLayout.setContentsMargins(0,0,0,0)
+    self.parent.layout().addWidget(self.panel)
 
-    # You can't use exec in a function that has a subfunction, unless you specify a context.
-    exec('self.filter = sitk.{}()'.format(json["name"]), globals(), locals())
+    # the Get/Set methods of the parameters are resolved once
+    self.binding = FilterBinding(json)
+    self.filter = self.binding.filter
+    self.json = json
 
     self.prerun_callbacks = []
     self.inputs = []
+    self.inputSelectors = []
     self.outputLabelMap = False
 
     #
@@ -708,10 +2726,10 @@ class FilterParameters:
               "Box",
               "Ball",
               "Cross"]
-      values=["sitk.sitkAnnulus",
-              "sitk.sitkBox",
-              "sitk.sitkBall",
-              "sitk.sitkCross"]
+      values=[sitk.sitkAnnulus,
+              sitk.sitkBox,
+              sitk.sitkBall,
+              sitk.sitkCross]
       w = self.createEnumWidget("KernelType",labels,values)
       self.addWidgetWithToolTipAndLabel(w,{"briefdescriptionSet":"Structuring element","name":"Kernel Type"})
 
@@ -738,7 +2756,8 @@ class FilterParameters:
 
       fiducialSelector.connect("nodeActivated(vtkMRMLNode*)", lambda node,name=name:self.onFiducialListNode(name,node))
       self.widgetConnections.append((fiducialSelector, "nodeActivated(vtkMRMLNode*)"))
-      self.prerun_callbacks.append(lambda w=fiducialSelector,name=name:self.onFiducialListNode(name,w.currentNode()))
+      self.observeSelectedNode(name, fiducialSelector, lambda w=fiducialSelector,name=name:self.onFiducialListNode(name,w.currentNode()))
+      self.prerun_callbacks.append(lambda w=fiducialSelector,name=name:self.onFiducialListNode(name,w.currentNode(),notify=False))
 
       fiducialSelectorLabel = qt.QLabel(f"{name}: ")
       self.widgets.append(fiducialSelectorLabel)
@@ -775,7 +2794,8 @@ class FilterParameters:
 
           fiducialSelector.connect("nodeActivated(vtkMRMLNode*)", lambda node,w=fiducialSelector,name=member["name"],isPt=isPoint:self.onFiducialNode(name,w,isPt))
           self.widgetConnections.append((fiducialSelector, "nodeActivated(vtkMRMLNode*)"))
-          self.prerun_callbacks.append(lambda w=fiducialSelector,name=member["name"],isPt=isPoint:self.onFiducialNode(name,w,isPt))
+          self.observeSelectedNode(member["name"], fiducialSelector, lambda w=fiducialSelector,name=member["name"],isPt=isPoint:self.onFiducialNode(name,w,isPt))
+          self.prerun_callbacks.append(lambda w=fiducialSelector,name=member["name"],isPt=isPoint:self.onFiducialNode(name,w,isPt,notify=False))
 
           w1 = fiducialSelector
 
@@ -828,7 +2848,8 @@ class FilterParameters:
 
         fiducialSelector.connect("nodeActivated(vtkMRMLNode*)", lambda node,name=member["name"]:self.onFiducialListNode(name,node))
         self.widgetConnections.append((fiducialSelector, "nodeActivated(vtkMRMLNode*)"))
-        self.prerun_callbacks.append(lambda w=fiducialSelector,name=member["name"],:self.onFiducialListNode(name,w.currentNode()))
+        self.observeSelectedNode(member["name"], fiducialSelector, lambda w=fiducialSelector,name=member["name"]:self.onFiducialListNode(name,w.currentNode()))
+        self.prerun_callbacks.append(lambda w=fiducialSelector,name=member["name"],:self.onFiducialListNode(name,w.currentNode(),notify=False))
 
         w = fiducialSelector
 
@@ -849,16 +2870,16 @@ class FilterParameters:
                 "Welch Windowed Sinc",
                 "Lanczos Windowed Sinc",
                 "Blackman Windowed Sinc"]
-        values=["sitk.sitkNearestNeighbor",
-                "sitk.sitkLinear",
-                "sitk.sitkBSpline",
-                "sitk.sitkGaussian",
-                "sitk.sitkLabelGaussian",
-                "sitk.sitkHammingWindowedSinc",
-                "sitk.sitkCosineWindowedSinc",
-                "sitk.sitkWelchWindowedSinc",
-                "sitk.sitkLanczosWindowedSinc",
-                "sitk.sitkBlackmanWindowedSinc"]
+        values=[sitk.sitkNearestNeighbor,
+                sitk.sitkLinear,
+                sitk.sitkBSpline,
+                sitk.sitkGaussian,
+                sitk.sitkLabelGaussian,
+                sitk.sitkHammingWindowedSinc,
+                sitk.sitkCosineWindowedSinc,
+                sitk.sitkWelchWindowedSinc,
+                sitk.sitkLanczosWindowedSinc,
+                sitk.sitkBlackmanWindowedSinc]
 
         w = self.createEnumWidget(member["name"],labels,values)
         pass
@@ -871,14 +2892,14 @@ class FilterParameters:
                 "int32_t",
                 "float",
                 "double"]
-        values=["sitk.sitkInt8",
-                "sitk.sitkUInt8",
-                "sitk.sitkInt16",
-                "sitk.sitkUInt16",
-                "sitk.sitkInt32",
-                "sitk.sitkUInt32",
-                "sitk.sitkFloat32",
-                "sitk.sitkFloat64"]
+        values=[sitk.sitkInt8,
+                sitk.sitkUInt8,
+                sitk.sitkInt16,
+                sitk.sitkUInt16,
+                sitk.sitkInt32,
+                sitk.sitkUInt32,
+                sitk.sitkFloat32,
+                sitk.sitkFloat64]
         w = self.createEnumWidget(member["name"],labels,values)
       elif t in ["double", "float"]:
         w = self.createDoubleWidget(member["name"])
@@ -947,6 +2968,41 @@ class FilterParameters:
      # add to layout after connection
     parametersFormLayout.addRow(outputLabelMapLabel, self.outputVolumeTypeLabel)
 
+    #
+    # Region of interest
+    #
+    self.roiSelector = slicer.qMRMLNodeComboBox()
+    self.widgets.append(self.roiSelector)
+    self.roiSelector.nodeTypes = ["vtkMRMLMarkupsROINode"]
+    self.roiSelector.selectNodeUponCreation = True
+    self.roiSelector.addEnabled = True
+    self.roiSelector.removeEnabled = False
+    self.roiSelector.renameEnabled = True
+    self.roiSelector.noneEnabled = True
+    self.roiSelector.showHidden = False
+    self.roiSelector.showChildNodeTypes = False
+    self.roiSelector.noneDisplay = "(Whole Volume)"
+    self.roiSelector.setMRMLScene( slicer.mrmlScene )
+    self.roiSelector.setCurrentNode(None)
+    self.roiSelector.setToolTip( "Only process the voxels of the inputs in this region, and a margin around it for the neighbourhood of the filter." )
+    # the region is read when the filter runs, moving it only updates the preview
+    self.roiSelector.connect("currentNodeChanged(vtkMRMLNode*)", lambda node:self.parameterChanged())
+    self.widgetConnections.append((self.roiSelector, "currentNodeChanged(vtkMRMLNode*)"))
+    self.observeSelectedNode("RegionOfInterest", self.roiSelector, self.parameterChanged)
+
+    roiSelectorLabel = qt.QLabel("Region of interest: ")
+    self.widgets.append(roiSelectorLabel)
+    parametersFormLayout.addRow(roiSelectorLabel, self.roiSelector)
+
+    self.cropOutputCheckBox = qt.QCheckBox()
+    self.widgets.append(self.cropOutputCheckBox)
+    self.cropOutputCheckBox.checked = False
+    self.cropOutputCheckBox.setToolTip( "Write only the region of interest to the output volume, instead of a volume the size of the input which is zero outside the region." )
+
+    cropOutputLabel = qt.QLabel("Crop output to region: ")
+    self.widgets.append(cropOutputLabel)
+    parametersFormLayout.addRow(cropOutputLabel, self.cropOutputCheckBox)
+
 
   def createInputWidget(self,n, noneEnabled=False):
       inputSelector = slicer.qMRMLNodeComboBox()
@@ -964,6 +3020,7 @@ class FilterParameters:
       # connect and verify parameters
       inputSelector.connect("nodeActivated(vtkMRMLNode*)", lambda node,i=n:self.onInputSelect(node,i))
       self.widgetConnections.append((inputSelector, "nodeActivated(vtkMRMLNode*)"))
+      self.inputSelectors.append(inputSelector)
       return inputSelector
 
   def createEnumWidget(self,name,enumList,valueList=None):
@@ -974,18 +3031,16 @@ class FilterParameters:
     default = self._getParameterValue(name)
 
     if valueList is None:
-      valueList = ["self.filter."+e for e in enumList]
+      valueList = self.binding.enumValues(enumList)
 
     for e,v in zip(enumList,valueList):
-      w.addItem(e,v)
+      w.addItem(e)
 
       # check if current item is default, set if it is
-      ldict = locals().copy()
-      exec('itemValue='+v, globals(), ldict)
-      if ldict['itemValue'] == default:
+      if v == default:
         w.setCurrentIndex(w.count-1)
 
-    w.connect("currentIndexChanged(int)", lambda selectorIndex,n=name,selector=w:self.onEnumChanged(n,selectorIndex,selector))
+    w.connect("currentIndexChanged(int)", lambda selectorIndex,n=name,values=valueList:self.onEnumChanged(n,selectorIndex,values))
     self.widgetConnections.append((w, "currentIndexChanged(int)"))
     return w
 
@@ -1061,9 +3116,7 @@ class FilterParameters:
     return w
 
   def _getParameterValue(self, parameterName):
-    ldict = locals().copy()
-    exec(f'default = self.filter.Get{parameterName}()', globals(), ldict)
-    return ldict['default']
+    return self.binding.get(parameterName)
 
   def createDoubleWidget(self,name):
 
@@ -1095,7 +3148,7 @@ class FilterParameters:
     widget.setToolTip(tip)
     l.setToolTip(tip)
 
-    parametersFormLayout = self.parent.layout()
+    parametersFormLayout = self.panel.layout()
     parametersFormLayout.addRow(l,widget)
 
   def onToggledPointSelector(self, fidVisible, ptWidget, fiducialWidget):
@@ -1110,8 +3163,27 @@ class FilterParameters:
       # This will update the filter from the widget
       ptWidget.coordinates = ",".join(str(x) for x in ptWidget.coordinates.split(',') )
 
+  def region(self):
+    """Return the region (index, size) of the first input covered by
+    the selected ROI node, or None to process the whole volumes"""
+    roiNode = self.roiSelector.currentNode() if self.roiSelector else None
+    if roiNode is None or not self.inputs or self.inputs[0] is None:
+      return None
+    region = VolumeBridge.rasBoundsToRegion(self.inputs[0], roiNode)
+    if region is None:
+      raise ValueError(f"The region of interest \"{roiNode.GetName()}\" does not intersect the input volume.")
+    return region
+
+  def fullSizeOutput(self):
+    return not (self.cropOutputCheckBox and self.cropOutputCheckBox.checked)
+
+  def parameterChanged(self):
+    if self.parameterChangedCallback:
+      self.parameterChangedCallback()
+
   def onInputSelect(self, mrmlNode, n):
     self.inputs[n] = mrmlNode
+    self.parameterChanged()
 
   def onOutputSelect(self, mrmlNode):
     self.output = mrmlNode
@@ -1122,10 +3194,35 @@ class FilterParameters:
       self.outputLabelMap = False
       self.outputVolumeTypeLabel.text = ""
 
-  def onFiducialNode(self, name, mrmlWidget, isPoint):
+  def observeSelectedNode(self, key, selector, callback):
+    """Call callback when the node selected in selector is modified or
+    one of its points moves, and follow the selection"""
+    selector.connect("currentNodeChanged(vtkMRMLNode*)", lambda node:self.observeNode(key, node, callback))
+    self.widgetConnections.append((selector, "currentNodeChanged(vtkMRMLNode*)"))
+    self.observeNode(key, selector.currentNode(), callback)
+
+  def observeNode(self, key, node, callback):
+    """Observe node instead of the node previously observed under key"""
+    oldNode, tags = self.nodeObservers.pop(key, (None, []))
+    for tag in tags:
+      oldNode.RemoveObserver(tag)
+    if node is None:
+      return
+    events = [vtk.vtkCommand.ModifiedEvent]
+    if node.IsA("vtkMRMLMarkupsNode"):
+      events.append(slicer.vtkMRMLMarkupsNode.PointModifiedEvent)
+    self.nodeObservers[key] = (node, [node.AddObserver(event, lambda caller, event: callback()) for event in events])
+
+  def removeNodeObservers(self):
+    for key in list(self.nodeObservers):
+      self.observeNode(key, None, None)
+
+  def onFiducialNode(self, name, mrmlWidget, isPoint, notify=True):
     if not mrmlWidget.visible:
       return
     annotationFiducialNode = mrmlWidget.currentNode()
+    if annotationFiducialNode is None:
+      return
 
     # point in physical space
     coord_RAS = [0,0,0]
@@ -1138,18 +3235,22 @@ class FilterParameters:
     else:
       annotationFiducialNode.GetFiducialCoordinates(coord_RAS)
 
-    # Transform from RAS (Slicer internal coordinate system) to LPS (coordinate system in files)
-    coord_LPS = [-coord_RAS[0],-coord_RAS[1],coord_RAS[2]]
-
-    # FIXME: we should not need to copy the image
-    if not isPoint and len(self.inputs) and self.inputs[0]:
-      imgNode = self.inputs[0]
-      img = sitkUtils.PullVolumeFromSlicer(imgNode)
-      coord_IJK = img.TransformPhysicalPointToIndex(coord_LPS)
-    exec(f'self.filter.Set{name}(coord_IJK)')
+    if isPoint:
+      # Transform from RAS (Slicer internal coordinate system) to LPS (coordinate system in files)
+      coord = [-coord_RAS[0],-coord_RAS[1],coord_RAS[2]]
+    elif len(self.inputs) and self.inputs[0]:
+      # the index is computed from the geometry of the volume, without accessing the image
+      coord = VolumeBridge.rasToIndex(self.inputs[0], coord_RAS)[0]
+    else:
+      return
+    self.binding.set(name, coord)
+    if notify:
+      self.parameterChanged()
 
-  def onFiducialListNode(self, name, mrmlNode):
+  def onFiducialListNode(self, name, mrmlNode, notify=True):
     annotationHierarchyNode = mrmlNode
+    if annotationHierarchyNode is None:
+      return
 
     # list of points in physical space
     coords = []
@@ -1177,35 +3278,38 @@ class FilterParameters:
         annotation.GetFiducialCoordinates(coord)
         coords.append(coord)
 
-    if self.inputs[0]:
-      imgNode = self.inputs[0]
-      img = sitkUtils.PullVolumeFromSlicer(imgNode)
-
-      # HACK transform from RAS to LPS
-      coords = [ [-pt[0],-pt[1],pt[2]] for pt in coords]
-
-      idx_coords = [img.TransformPhysicalPointToIndex(pt) for pt in coords]
+    if self.inputs and self.inputs[0]:
+      # all the points are transformed at once with the RAS to IJK
+      # matrix of the volume, without accessing the image
+      idx_coords = VolumeBridge.rasToIndex(self.inputs[0], coords) if coords else []
 
-      exec(f'self.filter.Set{name}(idx_coords)')
+      self.binding.set(name, idx_coords)
+      if notify:
+        self.parameterChanged()
 
   def onScalarChanged(self, name, val):
-    exec(f'self.filter.Set{name}(val)')
+    self.binding.set(name, val)
+    self.parameterChanged()
 
-  def onEnumChanged(self, name, selectorIndex, selector):
-    data=selector.itemData(selectorIndex)
-    exec(f'self.filter.Set{name}({data})')
+  def onEnumChanged(self, name, selectorIndex, values):
+    if selectorIndex >= 0:
+      self.binding.set(name, values[selectorIndex])
+      self.parameterChanged()
 
   def onBoolVectorChanged(self, name, widget, val):
     coords = [bool(float(x)) for x in widget.coordinates.split(',')]
-    exec(f'self.filter.Set{name}(coords)')
+    self.binding.set(name, coords)
+    self.parameterChanged()
 
   def onIntVectorChanged(self, name, widget, val):
     coords = [int(float(x)) for x in widget.coordinates.split(',')]
-    exec(f'self.filter.Set{name}(coords)')
+    self.binding.set(name, coords)
+    self.parameterChanged()
 
   def onFloatVectorChanged(self, name, widget, val):
     coords = [float(x) for x in widget.coordinates.split(',')]
-    exec(f'self.filter.Set{name}(coords)')
+    self.binding.set(name, coords)
+    self.parameterChanged()
 
 
   def prerun(self):
@@ -1214,6 +3318,7 @@ class FilterParameters:
 
   def destroy(self):
 
+    self.removeNodeObservers()
     for widget, sig in self.widgetConnections:
       widget.disconnect(sig)
     self.widgetConnections = []
@@ -1223,3 +3328,26 @@ class FilterParameters:
       w.deleteLater()
       w.setParent(None)
     self.widgets = []
+    self.inputSelectors = []
+
+  def show(self):
+    # nodes may have been added or removed from the scene while the panel
+    # was hidden, so the selections are read back from the selectors
+    for n, inputSelector in enumerate(self.inputSelectors):
+      self.inputs[n] = inputSelector.currentNode()
+    if self.outputSelector:
+      self.onOutputSelect(self.outputSelector.currentNode())
+    if self.panel:
+      self.panel.show()
+
+  def hide(self):
+    if self.panel:
+      self.panel.hide()
+
+  def destroyPanel(self):
+    self.destroy()
+    if self.panel:
+      self.parent.layout().removeWidget(self.panel)
+      self.panel.deleteLater()
+      self.panel.setParent(None)
+      self.panel = None
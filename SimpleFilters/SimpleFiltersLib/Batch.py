@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+#
+# Batch.py
+#
+# Headless batch processing of volumes with the SimpleITK filters of
+# the SimpleFilters module. Only SimpleITK is required to process
+# files, so this script can be run with PythonSlicer or any Python
+# where SimpleITK is installed.
+#
+# Usage:
+#   Batch.py --filter MedianImageFilter --set Radius=[2,2,2] \
+#            --case in1.nrrd out1.nrrd --case in2.nrrd out2.nrrd
+#   Batch.py --filter AddImageFilter --cohort cohort.csv --processes 8
+#   Batch.py --filter DiscreteGaussianImageFilter --set Variance=4 --tiled \
+#            --processes 1 --case big.mha big-smooth.mha
+#
+# Each line of a cohort csv file lists the input files of a case
+# followed by its output file.
+#
+
+import argparse
+import csv
+import itertools
+import json
+import os
+import sys
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import SimpleITK as sitk
+
+if __package__ in (None, ""):
+  # run as a script, make the SimpleFiltersLib package importable
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from SimpleFiltersLib import PixelTypes
+from SimpleFiltersLib import Tiling
+
+# json descriptions of the filters of the SimpleFilters module
+JSON_DIR = os.path.join(os.path.dirname(os.path.realpath(__file__)), os.pardir, "Resources", "json")
+
+BatchCase = namedtuple("BatchCase", ["inputs", "output"])
+BatchResult = namedtuple("BatchResult", ["case", "elapsedTime", "error"])
+
+
+def filterClass(filterName):
+  """Return the SimpleITK filter class named filterName, the
+  "ImageFilter" suffix may be omitted."""
+  for name in (filterName, filterName+"ImageFilter"):
+    cls = getattr(sitk, name, None)
+    if isinstance(cls, type) and issubclass(cls, sitk.ProcessObject):
+      return cls
+  raise ValueError(f"Unknown SimpleITK filter \"{filterName}\"")
+
+
+def parameterValue(sitkFilter, value):
+  """Convert a json parameter value for the filter, enumerations may be
+  given by name such as "sitkBall" or "CED"."""
+  if isinstance(value, str):
+    if hasattr(sitkFilter, value):
+      return getattr(sitkFilter, value)
+    if hasattr(sitk, value):
+      return getattr(sitk, value)
+  return value
+
+
+def filterDescription(filterName):
+  """Return the json description of the filter, or None if it is not
+  available."""
+  fname = os.path.join(JSON_DIR, filterClass(filterName).__name__+".json")
+  try:
+    with open(fname) as fp:
+      return json.load(fp)
+  except (OSError, ValueError):
+    return None
+
+
+def createFilter(filterName, parameters=None, numberOfThreads=None):
+  """Return a filter with the parameters, a dictionary of member name to
+  value, set."""
+  sitkFilter = filterClass(filterName)()
+  for name, value in (parameters or {}).items():
+    setter = getattr(sitkFilter, "Set"+name, None)
+    if setter is None:
+      raise ValueError(f"{sitkFilter.GetName()} has no parameter \"{name}\"")
+    setter(parameterValue(sitkFilter, value))
+  if numberOfThreads and hasattr(sitkFilter, "SetNumberOfThreads"):
+    sitkFilter.SetNumberOfThreads(numberOfThreads)
+  return sitkFilter
+
+
+def processFiles(filterName, parameters, inputFiles, outputFile, numberOfThreads=None, useCompression=False,
+                 tiled=False):
+  """Read the inputs of one case, run the filter and write the output.
+  Returns the elapsed time in seconds.
+
+  When tiled is set, the inputs are read block by block and the output
+  is stitched in a temporary file next to outputFile, see
+  SimpleFiltersLib.Tiling, so the volumes do not need to fit in memory.
+  """
+  startTime = time.time()
+  sitkFilter = createFilter(filterName, parameters, numberOfThreads)
+  if tiled:
+    sources = [Tiling.FileSource(f) for f in inputFiles]
+    result = Tiling.executeTiled(sitkFilter, sources,
+                                 castPixelIDs=PixelTypes.castPixelIDs(filterDescription(filterName),
+                                                                      [s.pixelID for s in sources]),
+                                 numberOfWorkers=numberOfThreads,
+                                 numberOfThreads=numberOfThreads,
+                                 outputDirectory=os.path.dirname(os.path.abspath(outputFile)))
+    sitk.WriteImage(result.image, outputFile, useCompression)
+    return time.time() - startTime
+  inputImages = [sitk.ReadImage(f) for f in inputFiles]
+  inputImages = PixelTypes.castInputs(filterDescription(filterName), inputImages)
+  img = sitkFilter.Execute(*inputImages)
+  # release the inputs before writing
+  del inputImages
+  sitk.WriteImage(img, outputFile, useCompression)
+  return time.time() - startTime
+
+
+def processNodes(filterName, parameters, inputNodes, outputNode):
+  """Run the filter on volume nodes of the scene in the calling thread.
+  The voxel buffers are shared with the nodes when possible."""
+  from SimpleFiltersLib.VolumeBridge import VolumeBridge
+
+  sitkFilter = createFilter(filterName, parameters)
+  bridge = VolumeBridge()
+  try:
+    inputImages = PixelTypes.castInputs(filterDescription(filterName), [bridge.pull(node) for node in inputNodes])
+    img = sitkFilter.Execute(*inputImages)
+  finally:
+    bridge.release()
+  bridge.push(img, outputNode)
+  return outputNode
+
+
+def _processCase(filterName, parameters, case, numberOfThreads, useCompression, tiled):
+  try:
+    elapsedTime = processFiles(filterName, parameters, case.inputs, case.output,
+                               numberOfThreads, useCompression, tiled)
+    return BatchResult(case, elapsedTime, None)
+  except Exception as e:
+    return BatchResult(case, None, str(e))
+
+
+def runCohort(filterName, parameters, cases, processes=None, numberOfThreads=None,
+              useCompression=False, callback=None, tiled=False):
+  """Process a cohort of BatchCase with a pool of processes.
+
+  Each case is read from disk by the process running it, and its output
+  is written as soon as it is computed, so only the cases in progress
+  are in memory. When numberOfThreads is not given the cores are split
+  evenly between the processes. callback is called with each
+  BatchResult in order of completion. Returns the list of BatchResult.
+  """
+  cases = [c if isinstance(c, BatchCase) else BatchCase(*c) for c in cases]
+  # check the filter and parameters before starting the pool
+  sitkFilter = createFilter(filterName, parameters)
+  if tiled:
+    Tiling.tilingMargin(sitkFilter, [1.0, 1.0, 1.0])
+
+  processes = processes or os.cpu_count() or 1
+  if numberOfThreads is None:
+    numberOfThreads = max(1, (os.cpu_count() or 1) // processes)
+
+  results = []
+  with ProcessPoolExecutor(max_workers=processes) as executor:
+    futures = [executor.submit(_processCase, filterName, parameters, case, numberOfThreads, useCompression, tiled)
+               for case in cases]
+    for future in as_completed(futures):
+      result = future.result()
+      results.append(result)
+      if callback:
+        callback(result)
+  return results
+
+
+def readCohort(fname):
+  """Read a csv file with one case per line, the inputs followed by the
+  output."""
+  cases = []
+  with open(fname, newline='') as fp:
+    for row in csv.reader(fp):
+      row = [f.strip() for f in row if f.strip()]
+      if not row or row[0].startswith('#'):
+        continue
+      if len(row) < 2:
+        raise ValueError(f"Expected inputs and an output in \"{','.join(row)}\"")
+      cases.append(BatchCase(row[:-1], row[-1]))
+  return cases
+
+
+def readParameters(args):
+  parameters = {}
+  if args.parameters:
+    if os.path.isfile(args.parameters):
+      with open(args.parameters) as fp:
+        parameters.update(json.load(fp))
+    else:
+      parameters.update(json.loads(args.parameters))
+  for assignment in args.set or []:
+    name, sep, value = assignment.partition('=')
+    if not sep:
+      raise ValueError(f"Expected Name=Value not \"{assignment}\"")
+    try:
+      parameters[name] = json.loads(value)
+    except ValueError:
+      parameters[name] = value
+  return parameters
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Run a SimpleITK filter on a cohort of volumes.")
+  parser.add_argument("--filter", required=True, help="SimpleITK filter class, such as MedianImageFilter")
+  parser.add_argument("--parameters", help="json dictionary, or json file, of parameter names and values")
+  parser.add_argument("--set", action="append", metavar="NAME=VALUE", help="set a parameter, the value is parsed as json")
+  parser.add_argument("--case", action="append", nargs='+', metavar="FILE", help="input files followed by the output file")
+  parser.add_argument("--cohort", help="csv file with the input files followed by the output file on each line")
+  parser.add_argument("--processes", type=int, help="number of worker processes (default: number of cores)")
+  parser.add_argument("--threads", type=int, help="number of threads per process")
+  parser.add_argument("--compress", action="store_true", help="compress the output files")
+  parser.add_argument("--tiled", action="store_true", help="process the volumes block by block, for volumes larger than memory")
+  args = parser.parse_args(argv)
+
+  cases = []
+  for c in args.case or []:
+    if len(c) < 2:
+      parser.error("--case requires inputs and an output")
+    cases.append(BatchCase(c[:-1], c[-1]))
+  if args.cohort:
+    cases.extend(readCohort(args.cohort))
+  if not cases:
+    parser.error("no case to process, use --case or --cohort")
+
+  parameters = readParameters(args)
+
+  done = itertools.count(1)
+
+  def report(result):
+    n = next(done)
+    if result.error:
+      print(f"[{n}/{len(cases)}] {result.case.output} failed: {result.error}", file=sys.stderr)
+    else:
+      print(f"[{n}/{len(cases)}] {result.case.output} ({result.elapsedTime:3.1f}s)")
+    sys.stdout.flush()
+
+  try:
+    results = runCohort(args.filter, parameters, cases, args.processes, args.threads,
+                        args.compress, callback=report, tiled=args.tiled)
+  except Tiling.TilingError as e:
+    parser.error(str(e))
+  return 1 if any(r.error for r in results) else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,440 @@
+#!/usr/bin/env python
+#
+# Benchmark.py
+#
+# Headless benchmark of the SimpleITK filters of the SimpleFilters
+# module, driven by the "tests" blocks of the json descriptions. The
+# settings of each test are applied to synthetic volumes of a given size
+# and pixel type, and the wall time, CPU time, peak memory and the cost
+# of each stage of a run are recorded. Only SimpleITK is required, so
+# this script can be run with PythonSlicer or any Python where SimpleITK
+# is installed.
+#
+# Usage:
+#   Benchmark.py --size 256,256,128 --pixel-type Int16 --output results.json
+#   Benchmark.py --filter Median --filter Gaussian --repeat 5 \
+#                --baseline baseline.json --output results.json
+#
+# The inputs of the tests are not used, only their settings: the output
+# of a test is not checked against its md5 hash or tolerance. With
+# --baseline, the exit status is 1 when a test is slower, uses more
+# memory, or fails where it succeeded in the baseline.
+#
+
+import argparse
+import ast
+import glob
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import re
+import sys
+import time
+from collections import OrderedDict, namedtuple
+
+import SimpleITK as sitk
+
+if __package__ in (None, ""):
+  # run as a script, make the SimpleFiltersLib package importable
+  sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from SimpleFiltersLib import Batch
+from SimpleFiltersLib import PixelTypes
+from SimpleFiltersLib import Regions
+from SimpleFiltersLib.Profiling import peakRSS
+
+# version of the format of the results file
+RESULTS_VERSION = 1
+
+Regression = namedtuple("Regression", ["key", "metric", "baselineValue", "value"])
+
+
+def settingValue(sitkFilter, setting):
+  """Return the value of a setting of a json test for the filter. The
+  python value is preferred, C++ initializer lists and enumerations
+  such as "SimpleITK.sitkBall" or "SimpleITK.${name}.CED" are
+  converted."""
+  value = setting.get("python_value", setting.get("value"))
+  if isinstance(value, list):
+    return [_literalValue(sitkFilter, v) for v in value]
+  return _literalValue(sitkFilter, value)
+
+
+def _literalValue(sitkFilter, value):
+  if not isinstance(value, str):
+    return value
+  text = value.strip()
+  for prefix in ("SimpleITK.", "itk::simple::"):
+    if text.startswith(prefix):
+      obj = sitk
+      for name in text[len(prefix):].replace("::", ".").split("."):
+        if name == "${name}":
+          obj = type(sitkFilter)
+          continue
+        try:
+          obj = getattr(obj, name)
+        except AttributeError:
+          raise ValueError(f"Unknown value \"{value}\"")
+      return obj
+
+  text = {"true": "True", "false": "False"}.get(text, text)
+  try:
+    return ast.literal_eval(text.replace("{", "[").replace("}", "]"))
+  except (ValueError, SyntaxError):
+    return Batch.parameterValue(sitkFilter, text)
+
+
+def testDimension(test, defaultDimension):
+  """Return the dimension of the images of a json test, from the
+  dimension of its point settings or the format of its input files."""
+  for setting in test.get("settings", []):
+    if "dim" in setting:
+      return int(setting["dim"])
+  if any(f.lower().endswith(".png") for f in test.get("inputs", [])):
+    return 2
+  return defaultDimension
+
+
+def testSize(filterName, tag, size):
+  """Return size truncated to the dimension of the json test tag of a
+  filter, the whole size when the test is not found."""
+  try:
+    description = Batch.filterDescription(filterName) or {}
+  except ValueError:
+    description = {}
+  test = next((t for t in description.get("tests", []) if t.get("tag") == tag), {})
+  return [int(s) for s in size[:testDimension(test, len(size))]]
+
+
+def testInputCount(description, test):
+  if test.get("inputs"):
+    return len(test["inputs"])
+  return int(description.get("number_of_inputs") or 0) or len(description.get("inputs", [])) or 1
+
+
+def syntheticImage(size, pixelID, seed=0):
+  """Return a volume of the given size and pixel type with a smooth blob
+  and noise, in the range [0, 255]."""
+  img = sitk.GaussianSource(sitk.sitkFloat32, size, [s/4.0 for s in size], [s/2.0 for s in size], 200.0)
+  img = sitk.AdditiveGaussianNoise(img, 20.0, 0.0, seed)
+  img = sitk.Clamp(img, sitk.sitkFloat32, 0.0, 255.0)
+  return sitk.Cast(img, pixelID)
+
+
+def syntheticInputs(description, test, size, pixelID):
+  """Return the synthetic inputs of a json test. The inputs have the
+  requested pixel type, except masks which are binary, and the inputs
+  of filters of vector or complex images which are converted to the
+  closest pixel type the filter supports."""
+  inputNames = [i.get("name", "") for i in description.get("inputs", [])]
+  testInputs = test.get("inputs", [])
+  twoTypeLists = description.get("template_code_filename") == "DualImageFilter"
+
+  images = []
+  for idx in range(testInputCount(description, test)):
+    img = syntheticImage(size, pixelID, seed=idx+1)
+    name = inputNames[idx] if idx < len(inputNames) else ""
+    if "Mask" in name:
+      images.append(sitk.Cast(img > 100, sitk.sitkUInt8))
+      continue
+
+    typeList = description.get("pixel_types2" if twoTypeLists and idx > 0 else "pixel_types")
+    supported = PixelTypes.pixelIDs(typeList)
+    if supported and not supported & set(PixelTypes.TYPE_LISTS["BasicPixelIDTypeList"]):
+      vectorIDs = supported & set(PixelTypes.TYPE_LISTS["VectorPixelIDTypeList"])
+      if vectorIDs:
+        fileName = testInputs[idx] if idx < len(testInputs) else ""
+        components = 3 if "RGB" in fileName else len(size)
+        img = sitk.Compose([img]*components)
+        if img.GetPixelID() not in vectorIDs:
+          img = sitk.Cast(img, min(vectorIDs))
+      else:
+        real = sitk.Cast(img, sitk.sitkFloat32)
+        img = sitk.RealAndImaginaryToComplex(real, real)
+        complexIDs = supported & set(PixelTypes.TYPE_LISTS["ComplexPixelIDTypeList"])
+        if complexIDs and img.GetPixelID() not in complexIDs:
+          img = sitk.Cast(img, min(complexIDs))
+    images.append(img)
+  return images
+
+
+def createTestFilter(filterName, description, test, size, numberOfThreads=None):
+  """Return the filter with the settings of a json test. Voxel indices,
+  as seeds, are clamped into the synthetic volume."""
+  sitkFilter = Batch.createFilter(filterName, numberOfThreads=numberOfThreads)
+  for setting in test.get("settings", []):
+    getattr(sitkFilter, "Set"+setting["parameter"])(settingValue(sitkFilter, setting))
+
+  def clamp(point):
+    # components beyond the dimension of the volume are kept
+    return [min(max(int(p), 0), s-1) for p, s in zip(point, size)] + list(point[len(size):])
+
+  for name in Regions.indexParameterNames(description):
+    if not hasattr(sitkFilter, "Get"+name):
+      continue
+    value = getattr(sitkFilter, "Get"+name)()
+    if value and isinstance(value[0], (list, tuple)):
+      getattr(sitkFilter, "Set"+name)([clamp(point) for point in value])
+    elif value:
+      getattr(sitkFilter, "Set"+name)(clamp(value))
+  return sitkFilter
+
+
+def _median(values):
+  values = sorted(values)
+  n = len(values)
+  return values[n//2] if n % 2 else (values[n//2-1]+values[n//2])/2.0
+
+
+def runTest(filterName, tag, size, pixelType, repeat=1, numberOfThreads=None):
+  """Run the json test tag of a filter on synthetic inputs and return a
+  dictionary of its measures.
+
+  The inputs are synthesized once, then cast to the pixel types of the
+  filter and executed repeat times. The wall and CPU times, in seconds,
+  are the medians over the repetitions of the cast and execution, the
+  stages are timed separately. The status is "ok", "error" or
+  "skipped", the latter when the filter is not in this version of
+  SimpleITK.
+  """
+  result = OrderedDict([("filter", filterName), ("tag", tag), ("pixelType", pixelType),
+                        ("size", list(size)), ("status", "ok")])
+  try:
+    Batch.filterClass(filterName)
+  except ValueError as e:
+    result.update(status="skipped", error=str(e))
+    return result
+
+  stages = OrderedDict((name, {"wall": [], "cpu": []}) for name in ("synthesize", "cast", "execute"))
+
+  def timed(stage, f, *args):
+    startWall, startCPU = time.perf_counter(), time.process_time()
+    value = f(*args)
+    stages[stage]["wall"].append(time.perf_counter() - startWall)
+    stages[stage]["cpu"].append(time.process_time() - startCPU)
+    return value
+
+  result["startRSS"] = peakRSS()
+  try:
+    description = Batch.filterDescription(filterName)
+    test = next(t for t in description.get("tests", []) if t.get("tag") == tag)
+    dimension = testDimension(test, len(size))
+    testSize = [int(s) for s in size[:dimension]]
+    result["size"] = testSize
+
+    inputs = timed("synthesize", syntheticInputs, description, test, testSize, getattr(sitk, "sitk"+pixelType))
+    sitkFilter = createTestFilter(filterName, description, test, testSize, numberOfThreads)
+    for _ in range(max(1, repeat)):
+      castInputs = timed("cast", PixelTypes.castInputs, description, inputs)
+      img = timed("execute", sitkFilter.Execute, *castInputs)
+      del castInputs
+  except Exception as e:
+    result.update(status="error", error=str(e).strip().splitlines()[-1] if str(e).strip() else repr(e))
+    return result
+
+  result["outputPixelType"] = img.GetPixelIDTypeAsString()
+  result["outputSize"] = list(img.GetSize())
+  del img, inputs
+  for metric in ("wall", "cpu"):
+    result[metric] = _median([c+e for c, e in zip(stages["cast"][metric], stages["execute"][metric])])
+  result["peakRSS"] = peakRSS()
+  result["stages"] = OrderedDict((name, {"wall": _median(s["wall"]), "cpu": _median(s["cpu"])})
+                                 for name, s in stages.items() if s["wall"])
+  return result
+
+
+def listTests(filterPatterns=None, tagPatterns=None):
+  """Return the (filter name, test tag) of the json descriptions, which
+  match one of the regular expressions when they are given."""
+  def matches(text, patterns):
+    return not patterns or any(re.search(p, text) for p in patterns)
+
+  tests = []
+  for fname in sorted(glob.glob(os.path.join(Batch.JSON_DIR, "*.json"))):
+    try:
+      with open(fname) as fp:
+        description = json.load(fp)
+    except (OSError, ValueError):
+      continue
+    filterName = os.path.splitext(os.path.basename(fname))[0]
+    if not matches(filterName, filterPatterns):
+      continue
+    for test in description.get("tests", []):
+      if "tag" in test and matches(test["tag"], tagPatterns):
+        tests.append((filterName, test["tag"]))
+  return tests
+
+
+def runBenchmark(tests, sizes, pixelTypes, repeat=1, numberOfThreads=None, isolate=True, timeout=None,
+                 callback=None):
+  """Run the (filter name, test tag) tests for each size and pixel type,
+  one at a time. Returns the list of the results of runTest.
+
+  When isolate is set, each test runs in a new process so its peak
+  memory is not hidden by the tests before it, and a test running
+  longer than timeout seconds is stopped. callback is called with each
+  result.
+  """
+  context = multiprocessing.get_context("spawn")
+  results = []
+  for size in sizes:
+    for pixelType in pixelTypes:
+      for filterName, tag in tests:
+        args = (filterName, tag, size, pixelType, repeat, numberOfThreads)
+        if isolate:
+          with context.Pool(1) as pool:
+            try:
+              result = pool.apply_async(runTest, args).get(timeout)
+            except multiprocessing.TimeoutError:
+              result = OrderedDict([("filter", filterName), ("tag", tag), ("pixelType", pixelType),
+                                    ("size", testSize(filterName, tag, size)), ("status", "error"),
+                                    ("error", f"timeout after {timeout}s")])
+        else:
+          result = runTest(*args)
+        results.append(result)
+        if callback:
+          callback(result)
+  return results
+
+
+def environment(numberOfThreads=None):
+  """Return the versions and machine the benchmark is run with"""
+  return OrderedDict([
+    ("SimpleITK", sitk.Version.VersionString()),
+    ("ITK", f"{sitk.Version.ITKMajorVersion()}.{sitk.Version.ITKMinorVersion()}.{sitk.Version.ITKPatchVersion()}"),
+    ("python", platform.python_version()),
+    ("platform", platform.platform()),
+    ("processor", platform.processor()),
+    ("cpuCount", os.cpu_count()),
+    ("numberOfThreads", numberOfThreads or sitk.ProcessObject.GetGlobalDefaultNumberOfThreads()),
+    ("date", time.strftime("%Y-%m-%dT%H:%M:%S")),
+    ])
+
+
+def resultKey(result):
+  return (result["filter"], result["tag"], result["pixelType"], tuple(result["size"]))
+
+
+def compareResults(results, baseline, tolerance=0.25, memoryTolerance=0.25, minimumTime=0.01):
+  """Return the Regression of the results against the baseline results.
+
+  A test regresses when it fails but succeeded in the baseline, when its
+  wall time exceeds the baseline by more than tolerance, as a fraction,
+  and minimumTime seconds, or when the memory it allocated exceeds the
+  baseline by more than memoryTolerance.
+  """
+  baselineResults = {resultKey(r): r for r in baseline}
+  regressions = []
+  for result in results:
+    key = resultKey(result)
+    reference = baselineResults.get(key)
+    if reference is None or reference["status"] != "ok":
+      continue
+    if result["status"] != "ok":
+      if result["status"] == "error":
+        regressions.append(Regression(key, "status", reference["status"], result["status"]))
+      continue
+
+    if result["wall"] > reference["wall"]*(1.0+tolerance) and result["wall"]-reference["wall"] > minimumTime:
+      regressions.append(Regression(key, "wall", reference["wall"], result["wall"]))
+
+    # the memory of the interpreter and SimpleITK is not counted
+    def allocated(r):
+      if r.get("peakRSS") is None or r.get("startRSS") is None:
+        return None
+      return r["peakRSS"] - r["startRSS"]
+    memory, referenceMemory = allocated(result), allocated(reference)
+    if memory is not None and referenceMemory and memory > referenceMemory*(1.0+memoryTolerance):
+      regressions.append(Regression(key, "memory", referenceMemory, memory))
+  return regressions
+
+
+def readResults(fname):
+  with open(fname) as fp:
+    data = json.load(fp)
+  if data.get("version") != RESULTS_VERSION:
+    raise ValueError(f"{fname} is not a benchmark results file of version {RESULTS_VERSION}")
+  return data
+
+
+def writeResults(fname, results, numberOfThreads=None):
+  data = OrderedDict([("version", RESULTS_VERSION),
+                      ("environment", environment(numberOfThreads)),
+                      ("results", results)])
+  with open(fname, "w") as fp:
+    json.dump(data, fp, indent=1)
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description="Benchmark the SimpleITK filters with the settings of their json tests.")
+  parser.add_argument("--filter", action="append", metavar="REGEX", help="benchmark the filters matching a regular expression")
+  parser.add_argument("--tag", action="append", metavar="REGEX", help="benchmark the tests whose tag matches a regular expression")
+  parser.add_argument("--size", action="append", metavar="X,Y,Z",
+                      help="size of the synthetic volumes, the 2D tests use the first two axes (default: 128,128,128)")
+  parser.add_argument("--pixel-type", action="append", metavar="TYPE",
+                      help="pixel type of the synthetic volumes, such as UInt8 or Float32 (default: Int16)")
+  parser.add_argument("--repeat", type=int, default=3, help="number of executions of each test, the median is reported")
+  parser.add_argument("--threads", type=int, help="number of threads of the filters")
+  parser.add_argument("--timeout", type=float, help="stop a test after this number of seconds")
+  parser.add_argument("--no-isolate", action="store_true",
+                      help="run the tests in this process, faster but the peak memory is not measured by test")
+  parser.add_argument("--output", help="write the results to this json file")
+  parser.add_argument("--baseline", help="compare the results to a json file written by --output")
+  parser.add_argument("--tolerance", type=float, default=0.25, help="fraction of slow down flagged as a regression")
+  parser.add_argument("--memory-tolerance", type=float, default=0.25, help="fraction of memory increase flagged as a regression")
+  args = parser.parse_args(argv)
+
+  try:
+    sizes = [[int(s) for s in size.split(",")] for size in args.size or ["128,128,128"]]
+  except ValueError:
+    parser.error("--size expects comma separated integers")
+  pixelTypes = args.pixel_type or ["Int16"]
+  for pixelType in pixelTypes:
+    if not isinstance(getattr(sitk, "sitk"+pixelType, None), int):
+      parser.error(f"unknown pixel type \"{pixelType}\"")
+  baseline = readResults(args.baseline)["results"] if args.baseline else None
+  if args.timeout and args.no_isolate:
+    parser.error("--timeout requires the tests to be isolated")
+
+  tests = listTests(args.filter, args.tag)
+  if not tests:
+    parser.error("no test matches")
+
+  total = len(tests)*len(sizes)*len(pixelTypes)
+
+  done = itertools.count(1)
+
+  def report(result):
+    n = next(done)
+    name = f"{result['filter']} {result['tag']} {result['pixelType']} {'x'.join(str(s) for s in result['size'])}"
+    if result["status"] == "ok":
+      memory = f" {result['peakRSS']/2**20:.0f} MB" if result.get("peakRSS") else ""
+      print(f"[{n}/{total}] {name}: {result['wall']:.3f}s wall {result['cpu']:.3f}s cpu{memory}")
+    else:
+      print(f"[{n}/{total}] {name} {result['status']}: {result.get('error')}", file=sys.stderr)
+    sys.stdout.flush()
+
+  results = runBenchmark(tests, sizes, pixelTypes, args.repeat, args.threads,
+                         isolate=not args.no_isolate, timeout=args.timeout, callback=report)
+  if args.output:
+    writeResults(args.output, results, args.threads)
+
+  if baseline is None:
+    return 0
+  regressions = compareResults(results, baseline, args.tolerance, args.memory_tolerance)
+  for r in regressions:
+    name = " ".join(str(k) if not isinstance(k, tuple) else "x".join(str(s) for s in k) for k in r.key)
+    if r.metric == "wall":
+      print(f"{name}: {r.baselineValue:.3f}s -> {r.value:.3f}s ({r.value/r.baselineValue:.2f}x)")
+    elif r.metric == "memory":
+      print(f"{name}: {r.baselineValue/2**20:.0f} MB -> {r.value/2**20:.0f} MB")
+    else:
+      print(f"{name}: {r.baselineValue} -> {r.value}")
+  print(f"{len(regressions)} regression(s) against {args.baseline}")
+  return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+  sys.exit(main())
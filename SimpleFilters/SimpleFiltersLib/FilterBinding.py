@@ -0,0 +1,146 @@
+import re
+from collections import OrderedDict
+
+import SimpleITK as sitk
+
+#
+# FilterBinding
+#
+
+# names of the Get methods which have a matching Set method, by filter class
+_parameterNames = {}
+
+
+def parameterNames(filterClass):
+  """Return the names of the members of a filter class with both a Get
+  and a Set method. The result is computed once per class."""
+  names = _parameterNames.get(filterClass)
+  if names is None:
+    names = []
+    for key in dir(filterClass):
+      if key == 'GetName' or key.startswith('GetGlobal'):
+        continue
+      if key[:3] == 'Get' and hasattr(filterClass, "Set"+key[3:]):
+        names.append(key[3:])
+    _parameterNames[filterClass] = names
+  return names
+
+
+def filterParameterValues(sitkFilter):
+  """Return the values of the parameters of a filter, the members with
+  both a Get and a Set method, by name"""
+  return OrderedDict((name, getattr(sitkFilter, "Get"+name)())
+                     for name in parameterNames(sitkFilter.__class__))
+
+
+def cloneFilter(sitkFilter):
+  """Return a new filter of the same class with the same parameters"""
+  import sys
+  clone = sitkFilter.__class__()
+  for name, value in filterParameterValues(sitkFilter).items():
+    try:
+      getattr(clone, "Set"+name)(value)
+    except Exception as e:
+      sys.stderr.write(f"Unable to copy {name} of {sitkFilter.GetName()}: {e}\n")
+  return clone
+
+
+def _identity(value):
+  return value
+
+
+_SCALAR_CONVERTERS = {
+  "double": float, "float": float,
+  "bool": bool,
+  "uint8_t": int, "int8_t": int, "uint16_t": int, "int16_t": int,
+  "uint32_t": int, "int32_t": int, "uint64_t": int, "int64_t": int,
+  "unsigned int": int, "int": int,
+  }
+
+
+def converter(member):
+  """Return the function converting a GUI value to the type of a json
+  member description."""
+  t = member.get("type")
+  if "enum" in member or t in ("PixelIDValueEnum", "InterpolatorEnum"):
+    return _identity
+
+  m = re.search(r"<([a-zA-Z0-9_ ]+)>", t or "")
+  scalarType = m.group(1) if m else t
+  convert = _SCALAR_CONVERTERS.get(scalarType)
+  if convert is None:
+    return _identity
+
+  if "point_vec" in member:
+    return lambda points: [[convert(x) for x in pt] for pt in points]
+  if ("dim_vec" in member and int(member["dim_vec"])) or "std::vector" in (t or ""):
+    return lambda values: [convert(x) for x in values]
+  return convert
+
+
+class ParameterBinding:
+  """The bound Get and Set methods of a filter member, and the converter
+  of the values set from the GUI"""
+
+  __slots__ = ("name", "get", "set", "convert")
+
+  def __init__(self, name, getter, setter, convert=_identity):
+    self.name = name
+    self.get = getter
+    self.set = setter
+    self.convert = convert
+
+  def setValue(self, value):
+    self.set(self.convert(value))
+
+
+class FilterBinding:
+  """Resolved access to the parameters of a filter instance.
+
+  The bindings are built once from the json members of the filter, so
+  setting a parameter from the GUI is a call of a bound method with a
+  converted value, without compiling any Python code.
+  """
+
+  def __init__(self, description, sitkFilter=None):
+    self.name = description["name"]
+    self.filterClass = getattr(sitk, self.name)
+    self.filter = sitkFilter if sitkFilter is not None else self.filterClass()
+    self.parameters = OrderedDict()
+    for member in description.get("members", []):
+      if hasattr(self.filter, "Get"+member["name"]) and hasattr(self.filter, "Set"+member["name"]):
+        self.bind(member["name"], converter(member))
+
+  def bind(self, name, convert=_identity):
+    """Bind the Get/Set methods of name, and return the ParameterBinding"""
+    binding = ParameterBinding(name,
+                               getattr(self.filter, "Get"+name),
+                               getattr(self.filter, "Set"+name),
+                               convert)
+    self.parameters[name] = binding
+    return binding
+
+  def parameter(self, name):
+    binding = self.parameters.get(name)
+    if binding is None:
+      binding = self.bind(name)
+    return binding
+
+  def get(self, name):
+    return self.parameter(name).get()
+
+  def set(self, name, value):
+    self.parameter(name).setValue(value)
+
+  def enumValues(self, enumNames):
+    """Resolve the names of enumeration values, such as "sitkBall" or the
+    names of a json enum member, to their values."""
+    values = []
+    for e in enumNames:
+      if e.startswith("sitk."):
+        e = e[len("sitk."):]
+      if hasattr(self.filterClass, e):
+        values.append(getattr(self.filterClass, e))
+      else:
+        values.append(getattr(sitk, e))
+    return values
@@ -0,0 +1,473 @@
+import os
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import SimpleITK as sitk
+
+from SimpleFiltersLib import PixelTypes
+from SimpleFiltersLib import Regions
+
+#
+# Fused execution of pointwise filters
+#
+# A run of consecutive pointwise steps of a pipeline, as Add, Multiply,
+# Clamp, Sigmoid or Cast, is evaluated as one numpy expression over views
+# of the voxels of its inputs. The voxels are processed in chunks by a
+# pool of threads, numpy releases the GIL in its loops, and the values
+# of the intermediate steps only exist for one chunk at a time, so only
+# the output of the last step is allocated.
+#
+# Each filter is translated to a numpy function which follows the
+# arithmetic of its ITK functor, as computing in double before casting
+# to the output type. Filters, pixel types or parameters without an
+# exact translation are not fused, and run with SimpleITK.
+#
+# A single pointwise filter may also run in place, its output written
+# over the buffer of its first input, when the output has the same type.
+#
+
+# voxels of a chunk
+CHUNK_SIZE = 2**18
+
+_PIXEL_DTYPES = {
+  sitk.sitkUInt8: np.uint8, sitk.sitkInt8: np.int8,
+  sitk.sitkUInt16: np.uint16, sitk.sitkInt16: np.int16,
+  sitk.sitkUInt32: np.uint32, sitk.sitkInt32: np.int32,
+  sitk.sitkUInt64: np.uint64, sitk.sitkInt64: np.int64,
+  sitk.sitkFloat32: np.float32, sitk.sitkFloat64: np.float64,
+  }
+_DTYPE_PIXELS = {np.dtype(dtype): pixelID for pixelID, dtype in _PIXEL_DTYPES.items()}
+
+# types whose values are exactly represented as double, for the
+# functors computing in double
+_DOUBLE_EXACT = frozenset(np.dtype(t) for t in (np.uint8, np.int8, np.uint16, np.int16,
+                                                np.uint32, np.int32, np.float32, np.float64))
+
+
+def _limits(dtype):
+  info = np.finfo(dtype) if dtype.kind == 'f' else np.iinfo(dtype)
+  return float(info.min), float(info.max)
+
+
+def _toPixel(value, dtype):
+  """Convert a double parameter to a pixel value, as the static_cast
+  of ITK which truncates it, or return None when it is out of the range
+  of the type, the cast is then undefined"""
+  info = np.finfo(dtype) if dtype.kind == 'f' else np.iinfo(dtype)
+  if not info.min <= value <= info.max:
+    return None
+  return np.array(value).astype(dtype)
+
+
+def _castDouble(values, dtype):
+  """Cast values computed in double to dtype"""
+  return values.astype(dtype, copy=False)
+
+
+def _outputDtype(sitkFilter, dtype):
+  """Return the dtype of the OutputPixelType parameter, dtype when it is
+  not set, or None for a pixel type which is not scalar"""
+  getter = getattr(sitkFilter, "GetOutputPixelType", None)
+  pixelID = getter() if getter else sitk.sitkUnknown
+  if pixelID == sitk.sitkUnknown:
+    return dtype
+  return np.dtype(_PIXEL_DTYPES[pixelID]) if pixelID in _PIXEL_DTYPES else None
+
+
+# Translations, by filter class name, of a filter and the dtypes of its
+# inputs to a (function of the input arrays, output dtype), or None
+
+def _sameTypeBinary(ufunc):
+  def translate(f, dtypes):
+    if len(dtypes) != 2 or dtypes[0] != dtypes[1]:
+      return None
+    dtype = dtypes[0]
+    # integer arithmetic wraps around, as the cast of the C++ result
+    return (lambda a, b: ufunc(a, b, dtype=dtype, casting='unsafe')), dtype
+  return translate
+
+
+def _divide(f, dtypes):
+  if len(dtypes) != 2 or dtypes[0] != dtypes[1] or dtypes[0] not in _DOUBLE_EXACT:
+    return None
+  dtype = dtypes[0]
+  maximum = np.array(_limits(dtype)[1]).astype(dtype)
+
+  def divide(a, b):
+    with np.errstate(divide='ignore', invalid='ignore'):
+      q = a.astype(np.float64)/b
+    if dtype.kind != 'f':
+      # C++ integer division truncates towards zero
+      q = np.trunc(q)
+    return np.where(b != 0, _castDouble(q, dtype), maximum)
+  return divide, dtype
+
+
+def _doubleBinary(function):
+  def translate(f, dtypes):
+    if len(dtypes) != 2 or dtypes[0] != dtypes[1] or dtypes[0] not in _DOUBLE_EXACT:
+      return None
+    dtype = dtypes[0]
+    return (lambda a, b: _castDouble(function(a.astype(np.float64), b), dtype)), dtype
+  return translate
+
+
+def _comparison(ufunc):
+  def translate(f, dtypes):
+    if len(dtypes) != 2 or dtypes[0] != dtypes[1]:
+      return None
+    foreground = np.uint8(f.GetForegroundValue())
+    background = np.uint8(f.GetBackgroundValue())
+    return (lambda a, b: np.where(ufunc(a, b), foreground, background)), np.dtype(np.uint8)
+  return translate
+
+
+def _bitwise(ufunc):
+  def translate(f, dtypes):
+    if len(dtypes) != 2 or dtypes[0] != dtypes[1] or dtypes[0].kind == 'f':
+      return None
+    return (lambda a, b: ufunc(a, b)), dtypes[0]
+  return translate
+
+
+def _sameTypeUnary(ufunc):
+  def translate(f, dtypes):
+    if len(dtypes) != 1:
+      return None
+    dtype = dtypes[0]
+    return (lambda a: ufunc(a, dtype=dtype, casting='unsafe')), dtype
+  return translate
+
+
+def _realUnary(ufunc):
+  def translate(f, dtypes):
+    # the cast of a non finite result to an integer is undefined
+    if len(dtypes) != 1 or dtypes[0].kind != 'f':
+      return None
+    dtype = dtypes[0]
+    return (lambda a: _castDouble(ufunc(a.astype(np.float64)), dtype)), dtype
+  return translate
+
+
+def _clamp(f, dtypes):
+  if len(dtypes) != 1 or dtypes[0] not in _DOUBLE_EXACT:
+    return None
+  dtype = _outputDtype(f, dtypes[0])
+  if dtype is None or dtype not in _DOUBLE_EXACT:
+    return None
+  low, high = _limits(dtype)
+  lower, upper = max(f.GetLowerBound(), low), min(f.GetUpperBound(), high)
+  if lower > upper:
+    return None
+  return (lambda a: _castDouble(np.clip(a.astype(np.float64), lower, upper), dtype)), dtype
+
+
+def _sigmoid(f, dtypes):
+  if len(dtypes) != 1 or dtypes[0] not in _DOUBLE_EXACT or f.GetAlpha() == 0:
+    return None
+  dtype = dtypes[0]
+  alpha, beta = f.GetAlpha(), f.GetBeta()
+  # the output range is in the output type
+  minimum, maximum = _toPixel(f.GetOutputMinimum(), dtype), _toPixel(f.GetOutputMaximum(), dtype)
+  if minimum is None or maximum is None:
+    return None
+  minimum, maximum = float(minimum), float(maximum)
+
+  def sigmoid(a):
+    e = 1.0/(1.0+np.exp(-(a.astype(np.float64)-beta)/alpha))
+    return _castDouble((maximum-minimum)*e + minimum, dtype)
+  return sigmoid, dtype
+
+
+def _threshold(f, dtypes):
+  if len(dtypes) != 1:
+    return None
+  dtype = dtypes[0]
+  lower, upper = _toPixel(f.GetLower(), dtype), _toPixel(f.GetUpper(), dtype)
+  outside = _toPixel(f.GetOutsideValue(), dtype)
+  if lower is None or upper is None or outside is None:
+    return None
+  return (lambda a: np.where((a >= lower) & (a <= upper), a, outside)), dtype
+
+
+def _binaryThreshold(f, dtypes):
+  if len(dtypes) != 1:
+    return None
+  dtype = dtypes[0]
+  lower, upper = _toPixel(f.GetLowerThreshold(), dtype), _toPixel(f.GetUpperThreshold(), dtype)
+  if lower is None or upper is None or lower > upper:
+    return None
+  inside, outside = np.uint8(f.GetInsideValue()), np.uint8(f.GetOutsideValue())
+  return (lambda a: np.where((a >= lower) & (a <= upper), inside, outside)), np.dtype(np.uint8)
+
+
+def _shiftScale(f, dtypes):
+  if len(dtypes) != 1 or dtypes[0] not in _DOUBLE_EXACT:
+    return None
+  dtype = _outputDtype(f, dtypes[0])
+  if dtype is None or dtype not in _DOUBLE_EXACT:
+    return None
+  shift, scale = f.GetShift(), f.GetScale()
+  low, high = _limits(dtype)
+  # the result is clamped to the range of the output type
+  return (lambda a: _castDouble(np.clip((a.astype(np.float64)+shift)*scale, low, high), dtype)), dtype
+
+
+def _intensityWindowing(f, dtypes):
+  if len(dtypes) != 1 or dtypes[0] not in _DOUBLE_EXACT:
+    return None
+  dtype = dtypes[0]
+  # the window is in the input type, the output range in the output type
+  windowMinimum, windowMaximum = _toPixel(f.GetWindowMinimum(), dtype), _toPixel(f.GetWindowMaximum(), dtype)
+  outputMinimum, outputMaximum = _toPixel(f.GetOutputMinimum(), dtype), _toPixel(f.GetOutputMaximum(), dtype)
+  if None in (windowMinimum, windowMaximum, outputMinimum, outputMaximum) or windowMaximum == windowMinimum:
+    return None
+  windowMinimum, windowMaximum = float(windowMinimum), float(windowMaximum)
+  scale = (float(outputMaximum)-float(outputMinimum))/(windowMaximum-windowMinimum)
+  shift = float(outputMinimum) - windowMinimum*scale
+
+  def window(a):
+    values = _castDouble(a.astype(np.float64)*scale + shift, dtype)
+    values = np.where(a < windowMinimum, outputMinimum, values)
+    return np.where(a > windowMaximum, outputMaximum, values)
+  return window, dtype
+
+
+def _invertIntensity(f, dtypes):
+  if len(dtypes) != 1:
+    return None
+  dtype = dtypes[0]
+  maximum = _toPixel(f.GetMaximum(), dtype)
+  if maximum is None:
+    return None
+  return (lambda a: np.subtract(maximum, a, dtype=dtype, casting='unsafe')), dtype
+
+
+def _mask(f, dtypes):
+  if len(dtypes) != 2 or dtypes[1].kind == 'f':
+    return None
+  dtype = dtypes[0]
+  outside = _toPixel(f.GetOutsideValue(), dtype)
+  maskingValue = _toPixel(f.GetMaskingValue(), dtypes[1])
+  if outside is None or maskingValue is None:
+    return None
+  return (lambda a, m: np.where(m == maskingValue, outside, a)), dtype
+
+
+def _cast(f, dtypes):
+  if len(dtypes) != 1:
+    return None
+  dtype = _outputDtype(f, dtypes[0])
+  if dtype is None:
+    return None
+  return (lambda a: a.astype(dtype, copy=False)), dtype
+
+
+_TRANSLATORS = {
+  "AddImageFilter": _sameTypeBinary(np.add),
+  "SubtractImageFilter": _sameTypeBinary(np.subtract),
+  "MultiplyImageFilter": _sameTypeBinary(np.multiply),
+  "MaximumImageFilter": _sameTypeBinary(np.maximum),
+  "MinimumImageFilter": _sameTypeBinary(np.minimum),
+  "DivideImageFilter": _divide,
+  "AbsoluteValueDifferenceImageFilter": _doubleBinary(lambda a, b: np.abs(a-b)),
+  "SquaredDifferenceImageFilter": _doubleBinary(lambda a, b: (a-b)*(a-b)),
+  "EqualImageFilter": _comparison(np.equal),
+  "NotEqualImageFilter": _comparison(np.not_equal),
+  "GreaterImageFilter": _comparison(np.greater),
+  "GreaterEqualImageFilter": _comparison(np.greater_equal),
+  "LessImageFilter": _comparison(np.less),
+  "LessEqualImageFilter": _comparison(np.less_equal),
+  "AndImageFilter": _bitwise(np.bitwise_and),
+  "OrImageFilter": _bitwise(np.bitwise_or),
+  "XorImageFilter": _bitwise(np.bitwise_xor),
+  "AbsImageFilter": _sameTypeUnary(np.abs),
+  "UnaryMinusImageFilter": _sameTypeUnary(np.negative),
+  "SqrtImageFilter": _realUnary(np.sqrt),
+  "SquareImageFilter": _realUnary(np.square),
+  "ExpImageFilter": _realUnary(np.exp),
+  "LogImageFilter": _realUnary(np.log),
+  "Log10ImageFilter": _realUnary(np.log10),
+  "SinImageFilter": _realUnary(np.sin),
+  "CosImageFilter": _realUnary(np.cos),
+  "TanImageFilter": _realUnary(np.tan),
+  "AtanImageFilter": _realUnary(np.arctan),
+  "ClampImageFilter": _clamp,
+  "SigmoidImageFilter": _sigmoid,
+  "ThresholdImageFilter": _threshold,
+  "BinaryThresholdImageFilter": _binaryThreshold,
+  "ShiftScaleImageFilter": _shiftScale,
+  "IntensityWindowingImageFilter": _intensityWindowing,
+  "InvertIntensityImageFilter": _invertIntensity,
+  "MaskImageFilter": _mask,
+  "CastImageFilter": _cast,
+  }
+
+
+def isFusible(sitkFilter):
+  """True if the filter may be fused, depending on its pixel types"""
+  return sitkFilter.__class__.__name__ in _TRANSLATORS
+
+
+class FusedSteps:
+  """Pointwise steps of a pipeline compiled for the dtypes of their
+  inputs.
+
+  The inputs of the steps are the leaves, images computed before the
+  first step, or the outputs of earlier steps of the run. The program
+  lists, for each step, its numpy function and its arguments, as
+  ("leaf", i) or ("step", j), with the casts chosen by
+  PixelTypes.castPixelIDs.
+  """
+
+  def __init__(self, program, dtype):
+    self.program = program
+    self.dtype = dtype
+
+  @staticmethod
+  def compile(steps, first, last, leafKeys, leafDtypes):
+    """Return the FusedSteps of steps[first:last+1], whose inputs not
+    computed by these steps are the leaves leafKeys, or None if one of
+    the steps has no exact translation for its pixel types"""
+    program = []
+    stepDtypes = {}
+    for index, step in enumerate(steps[first:last+1], first):
+      args, dtypes = [], []
+      for source in step.inputs:
+        if source[0] == "step" and source[1] >= first:
+          args.append(("step", source[1]))
+          dtypes.append(stepDtypes[source[1]])
+        else:
+          leaf = leafKeys.index(tuple(source))
+          args.append(("leaf", leaf))
+          dtypes.append(leafDtypes[leaf])
+
+      casts = PixelTypes.castPixelIDs(step.description, [_DTYPE_PIXELS[d] for d in dtypes]) or [None]*len(dtypes)
+      casts = [None if pixelID is None else np.dtype(_PIXEL_DTYPES[pixelID]) for pixelID in casts]
+      dtypes = [d if c is None else c for d, c in zip(dtypes, casts)]
+
+      translate = _TRANSLATORS.get(step.filter.__class__.__name__)
+      translated = translate(step.filter, dtypes) if translate else None
+      if translated is None:
+        return None
+      function, stepDtypes[index] = translated
+      program.append((index, function, args, casts))
+    return FusedSteps(program, stepDtypes[last])
+
+  def evaluate(self, leaves):
+    """Return the output of the last step for chunks of the leaves"""
+    values = {}
+    for index, function, args, casts in self.program:
+      arrays = [leaves[i] if kind == "leaf" else values[i] for kind, i in args]
+      arrays = [a if c is None else a.astype(c, copy=False) for a, c in zip(arrays, casts)]
+      values[index] = function(*arrays)
+    return values[self.program[-1][0]]
+
+
+def sameGeometry(images):
+  reference = images[0]
+  for img in images[1:]:
+    if (img.GetSize() != reference.GetSize()
+        or not np.allclose(img.GetOrigin(), reference.GetOrigin())
+        or not np.allclose(img.GetSpacing(), reference.GetSpacing())
+        or not np.allclose(img.GetDirection(), reference.GetDirection())):
+      return False
+  return True
+
+
+def _compileFused(steps, first, last, images):
+  """Return the FusedSteps of steps[first:last+1] for the images, and the
+  views of the voxels of the images, or None"""
+  leafKeys = list(images.keys())
+  leafImages = [images[k] for k in leafKeys]
+  if (not leafImages
+      or any(img.GetPixelID() not in _PIXEL_DTYPES for img in leafImages)
+      or not sameGeometry(leafImages)):
+    return None
+
+  leafArrays = [sitk.GetArrayViewFromImage(img) for img in leafImages]
+  fused = FusedSteps.compile(steps, first, last, leafKeys, [a.dtype for a in leafArrays])
+  if fused is None:
+    return None
+  return fused, leafArrays
+
+
+def _canWrite(output, shape, dtype):
+  return (output.shape == shape and output.dtype == dtype
+          and output.flags.c_contiguous and output.flags.writeable)
+
+
+def executeFused(steps, first, last, images, numberOfWorkers=None, abortCallback=None, output=None):
+  """Run steps[first:last+1] as one fused expression and return the
+  output of the last one, or None if the steps cannot be fused for these
+  inputs or on abort.
+
+  images gives the image of each input of the steps which is not
+  computed by these steps, by source as in PipelineStep.inputs. The
+  output is written to the numpy array output when given, which may be
+  the buffer of an input as each chunk is read before it is written.
+  """
+  compiled = _compileFused(steps, first, last, images)
+  if compiled is None:
+    return None
+  fused, leafArrays = compiled
+
+  shape = leafArrays[0].shape
+  if output is None:
+    output = np.empty(shape, fused.dtype)
+  elif not _canWrite(output, shape, fused.dtype):
+    return None
+  leaves = [a.reshape(-1) for a in leafArrays]
+  flatOutput = output.reshape(-1)
+  numberOfPixels = flatOutput.size
+
+  def evaluateChunk(start):
+    if abortCallback and abortCallback():
+      return False
+    end = min(start+CHUNK_SIZE, numberOfPixels)
+    # as the ITK functors, invalid values and overflows are not reported
+    with np.errstate(all='ignore'):
+      flatOutput[start:end] = fused.evaluate([leaf[start:end] for leaf in leaves])
+    return True
+
+  with ThreadPoolExecutor(max_workers=numberOfWorkers or os.cpu_count() or 1) as executor:
+    if not all(executor.map(evaluateChunk, range(0, numberOfPixels, CHUNK_SIZE))):
+      return None
+
+  img = Regions.imageFromArray(output)
+  img.CopyInformation(images[next(iter(images))])
+  if Regions.canViewArrays():
+    # the image is a view, it keeps the array alive
+    img._fusedBuffer = output
+  return img
+
+
+# a filter run on its own, as a step of a pipeline
+_FilterStep = namedtuple("_FilterStep", ["filter", "inputs", "description"])
+
+
+def _filterStep(sitkFilter, images, description):
+  step = _FilterStep(sitkFilter, [("input", k) for k in range(len(images))], description)
+  return [step], OrderedDict((("input", k), img) for k, img in enumerate(images))
+
+
+def canExecuteInPlace(sitkFilter, images, output, description=None):
+  """Return True if executeInPlace can write the output of the filter
+  over the numpy array output. Where SimpleITK cannot wrap an array,
+  the output would be copied again, the filter is not run in place."""
+  if not Regions.canViewArrays():
+    return False
+  steps, leaves = _filterStep(sitkFilter, images, description)
+  compiled = _compileFused(steps, 0, 0, leaves)
+  return compiled is not None and _canWrite(output, compiled[1][0].shape, compiled[0].dtype)
+
+
+def executeInPlace(sitkFilter, images, output, description=None, numberOfWorkers=None, abortCallback=None):
+  """Run a pointwise filter on images, writing its output over the numpy
+  array output, as the buffer of the volume of the first image. Return
+  the output as an image, or None if the filter cannot be run this way
+  or on abort. description is the json description of the filter, its
+  inputs are cast as chosen by PixelTypes.castPixelIDs."""
+  steps, leaves = _filterStep(sitkFilter, images, description)
+  return executeFused(steps, 0, 0, leaves, numberOfWorkers, abortCallback, output)
@@ -0,0 +1,325 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import SimpleITK as sitk
+
+from SimpleFiltersLib import PixelTypes
+from SimpleFiltersLib.ResultCache import imageSizeInBytes
+
+#
+# Peak memory of a run
+#
+# Before a filter runs, its peak memory is estimated from the sizes and
+# pixel types of its inputs: the copies made when pulling the inputs
+# from the volume nodes, the crop or shrink of the inputs, their cast to
+# a supported pixel type, or to float on the retry of a filter whose
+# pixel types are not known, the output, the working memory of the
+# filter and the copy made when pushing the output to its node.
+#
+# The working memory of a filter is a factor of the bytes of its inputs
+# and output, learned by a MemoryModel from the increase of the memory
+# sampled while it executed. A run whose estimate exceeds the budget is refused
+# before it starts, instead of swapping or being killed once it runs,
+# with suggestions to reduce its memory, see checkBudget.
+#
+# The peak memory of a pipeline is the largest one of its steps, with
+# the outputs of the earlier steps still in use at that step.
+#
+
+# fraction of the available memory a run may use when no budget is set
+DEFAULT_BUDGET_FRACTION = 0.8
+
+# working memory of a filter which has not been measured yet, relative
+# to the bytes of its inputs and output
+DEFAULT_WORKING_FACTOR = 1.0
+
+# number of measured factors kept by filter
+MAX_SAMPLES = 5
+
+
+class MemoryBudgetError(ValueError):
+  """The estimated peak memory of a run exceeds the budget"""
+
+
+def availableMemory():
+  """Return the memory available to new allocations in bytes, or None
+  where it is not known."""
+  try:
+    with open("/proc/meminfo") as fp:
+      for line in fp:
+        if line.startswith("MemAvailable:"):
+          return int(line.split()[1]) * 1024
+  except (OSError, ValueError, IndexError):
+    pass
+  try:
+    return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+  except (ValueError, OSError, AttributeError):
+    return None
+
+
+def memoryBudget(budget=0, allocated=0):
+  """Return the bytes a run may use: budget when it is above 0,
+  otherwise DEFAULT_BUDGET_FRACTION of the available memory plus the
+  bytes the run already allocated. None when it is not known."""
+  if budget:
+    return budget
+  available = availableMemory()
+  if available is None:
+    return None
+  return int(available*DEFAULT_BUDGET_FRACTION) + allocated
+
+
+def formatBytes(nbytes):
+  if nbytes >= 2**30:
+    return f"{nbytes/2**30:.1f} GB"
+  return f"{nbytes/2**20:.0f} MB"
+
+
+def checkBudget(name, estimate, budget, suggestions=()):
+  """Raise a MemoryBudgetError when the MemoryEstimate of a run named
+  name exceeds budget, explaining it with the suggestions to reduce the
+  memory of the run. A budget of None is not checked."""
+  if budget is None or estimate.total <= budget:
+    return
+  message = (f"{name} needs about {formatBytes(estimate.total)} ({estimate.describe()}), "
+             f"above the memory budget of {formatBytes(budget)}.")
+  suggestions = list(suggestions) + ["raise the memory budget"]
+  message += (f" To run it, {', '.join(suggestions[:-1])}"
+              f"{' or ' if len(suggestions) > 1 else ''}{suggestions[-1]}.")
+  raise MemoryBudgetError(message)
+
+
+class MemoryEstimate:
+  """Estimated peak memory of a run, as the bytes of its parts.
+
+  executeBytes are the bytes of the inputs and output of the execution
+  of the filter, its working memory is relative to them, and outputBytes
+  the bytes of its output.
+  """
+
+  def __init__(self):
+    self.parts = OrderedDict()
+    self.executeBytes = 0
+    self.outputBytes = 0
+
+  def add(self, name, nbytes):
+    if nbytes:
+      self.parts[name] = self.parts.get(name, 0) + int(nbytes)
+
+  @property
+  def total(self):
+    return sum(self.parts.values())
+
+  def describe(self):
+    return ", ".join(f"{name} {formatBytes(nbytes)}" for name, nbytes in self.parts.items())
+
+
+def estimatePeakMemory(inputImages, castPixelIDs, outputPixelID, workingFactor=DEFAULT_WORKING_FACTOR,
+                       copiedBytes=0, processedPixels=None, reduction="crop", outputPixels=None,
+                       pushCopy=False, floatRetry=False):
+  """Return the MemoryEstimate of a run of a filter on inputImages.
+
+  copiedBytes were copied when pulling the inputs from the volume nodes.
+  The filter runs on processedPixels voxels of each input, by default all
+  of them, which are copied by a crop or shrink named reduction when
+  they are fewer, and cast to castPixelIDs as chosen by
+  PixelTypes.castPixelIDs. floatRetry tells that the pixel types of the
+  filter are not known, the inputs may then be cast to float.
+
+  The output of the filter has the pixel type outputPixelID. It is
+  resampled or pasted into a volume of outputPixels voxels when set and
+  different, and is copied to the output node when pushCopy is set.
+  """
+  estimate = MemoryEstimate()
+  estimate.add("pull", copiedBytes)
+
+  numberOfPixels = max(1, inputImages[0].GetNumberOfPixels())
+  if processedPixels is None:
+    processedPixels = numberOfPixels
+  fraction = processedPixels / numberOfPixels
+  inputBytes = [imageSizeInBytes(img)*fraction for img in inputImages]
+  if fraction < 1.0:
+    estimate.add(reduction, sum(inputBytes))
+
+  def castBytes(img, nbytes, pixelID):
+    return nbytes / img.GetSizeOfPixelComponent() * (PixelTypes.componentSize(pixelID) or img.GetSizeOfPixelComponent())
+
+  casts = castPixelIDs or [None]*len(inputImages)
+  floatRetry = floatRetry and not castPixelIDs
+  if floatRetry:
+    casts = [sitk.sitkFloat32]*len(inputImages)
+  executeBytes = [nbytes if pixelID is None else castBytes(img, nbytes, pixelID)
+                  for img, nbytes, pixelID in zip(inputImages, inputBytes, casts)]
+  estimate.add("float retry cast" if floatRetry else "cast",
+               sum(nbytes for nbytes, pixelID in zip(executeBytes, casts) if pixelID is not None))
+
+  components = 1
+  if outputPixelID in PixelTypes.TYPE_LISTS["VectorPixelIDTypeList"]:
+    components = inputImages[0].GetNumberOfComponentsPerPixel()
+  outputBytes = processedPixels * components * (PixelTypes.componentSize(outputPixelID)
+                                                or inputImages[0].GetSizeOfPixelComponent())
+  estimate.add("output", outputBytes)
+  estimate.executeBytes = sum(executeBytes) + outputBytes
+  estimate.outputBytes = outputBytes
+  estimate.add("working", workingFactor*estimate.executeBytes)
+
+  finalBytes = outputBytes
+  if outputPixels is not None and outputPixels != processedPixels:
+    finalBytes = outputBytes / processedPixels * outputPixels
+    estimate.add("full size output", finalBytes)
+  if pushCopy:
+    estimate.add("push", finalBytes)
+  return estimate
+
+
+class ImageInfo:
+  """The number of pixels and pixel type of an image which does not
+  exist yet, as the output of a pipeline step, answering the methods of
+  SimpleITK.Image used by estimatePeakMemory"""
+
+  def __init__(self, numberOfPixels, pixelID, components=1):
+    self.numberOfPixels = numberOfPixels
+    self.pixelID = pixelID
+    self.components = components
+
+  def GetNumberOfPixels(self):
+    return self.numberOfPixels
+
+  def GetPixelID(self):
+    return self.pixelID
+
+  def GetNumberOfComponentsPerPixel(self):
+    return self.components
+
+  def GetSizeOfPixelComponent(self):
+    return PixelTypes.componentSize(self.pixelID) or 4
+
+
+def estimatePipelinePeakMemory(pipeline, inputImages, workingFactor=None, copiedBytes=0):
+  """Return the MemoryEstimate of the step of a Pipeline with the
+  largest peak memory, counting the outputs of the earlier steps which
+  are still used, or shown, at that step. The outputs of the steps are
+  assumed to have the size of their first input. workingFactor returns
+  the working factor of a filter name, by default
+  DEFAULT_WORKING_FACTOR.
+
+  The estimate is not split between the execution of one filter and the
+  rest, its executeBytes are 0, so no working factor is learned from
+  the run of a pipeline."""
+  lastUses = pipeline.lastUses()
+  outputs = {}
+  shownBytes = 0
+  peak = MemoryEstimate()
+  peak.add("pull", copiedBytes)
+  for index, step in enumerate(pipeline.steps):
+    images = [inputImages[i] if kind == "input" else outputs[i] for kind, i in step.inputs]
+    pixelIDs = [img.GetPixelID() for img in images]
+    castPixelIDs = PixelTypes.castPixelIDs(step.description, pixelIDs)
+    executePixelIDs = [p if c is None else c for p, c in zip(pixelIDs, castPixelIDs or [None]*len(images))]
+    outputPixelID = PixelTypes.outputPixelID(step.description, executePixelIDs, step.filter)
+    factor = workingFactor(step.name) if workingFactor else DEFAULT_WORKING_FACTOR
+    stepEstimate = estimatePeakMemory(images, castPixelIDs, outputPixelID, factor)
+
+    estimate = MemoryEstimate()
+    estimate.add("pull", copiedBytes)
+    estimate.add("earlier outputs", sum(imageSizeInBytes(img) for img in outputs.values()) + shownBytes)
+    for name, nbytes in stepEstimate.parts.items():
+      estimate.add(f"step {index+1} {name}", nbytes)
+    if estimate.total > peak.total:
+      peak = estimate
+
+    components = 1
+    if outputPixelID in PixelTypes.TYPE_LISTS["VectorPixelIDTypeList"]:
+      components = images[0].GetNumberOfComponentsPerPixel()
+    outputs[index] = ImageInfo(images[0].GetNumberOfPixels(), outputPixelID, components)
+    for i in [i for i in outputs if i != index and lastUses.get(i, -1) <= index]:
+      if pipeline.steps[i].display:
+        # the output of a shown step stays in its volume node
+        shownBytes += imageSizeInBytes(outputs[i])
+      del outputs[i]
+  return peak
+
+
+def measuredWorkingFactor(profile, estimate):
+  """Return the working factor of the filter measured in a run, from the
+  increase of the memory sampled during its last execute stage, the one
+  of the retry on float inputs if any, see Profiling.MemorySampler.
+  Returns None when it was not sampled."""
+  if not estimate.executeBytes:
+    return None
+  factor = None
+  for stage in profile.stages:
+    if stage.name != "execute" or None in (stage.startMemory, stage.sampledPeak):
+      continue
+    working = stage.sampledPeak - stage.startMemory - estimate.outputBytes
+    factor = max(0.0, working / estimate.executeBytes)
+  return factor
+
+
+class MemoryModel:
+  """Working memory factors of the filters, learned from the measured
+  runs and saved in a json file.
+
+  The sampled memory is the one of the process, so runs of other filters
+  at the same time raise the factors, the estimate errs on the safe side.
+  The factor of a filter is the largest of its last measured runs.
+  """
+
+  def __init__(self, fileName=None):
+    self.fileName = fileName
+    # filter name -> measured factors
+    self.samples = {}
+    self._lock = threading.Lock()
+    self.load()
+
+  def load(self):
+    if not self.fileName or not os.path.exists(self.fileName):
+      return
+    try:
+      with open(self.fileName) as fp:
+        samples = json.load(fp)
+    except (OSError, ValueError):
+      return
+    if isinstance(samples, dict):
+      with self._lock:
+        self.samples = samples
+
+  def save(self):
+    if not self.fileName:
+      return
+    with self._lock:
+      data = json.dumps(self.samples)
+    try:
+      os.makedirs(os.path.dirname(self.fileName), exist_ok=True)
+      with open(self.fileName, "w") as fp:
+        fp.write(data)
+    except OSError as e:
+      import sys
+      sys.stderr.write(f"Cannot save the memory model to {self.fileName}: {e}\n")
+
+  def clear(self):
+    with self._lock:
+      self.samples = {}
+    self.save()
+
+  def record(self, filterName, factor):
+    with self._lock:
+      factors = self.samples.setdefault(filterName, [])
+      factors.append(factor)
+      del factors[:-MAX_SAMPLES]
+
+  def recordRun(self, filterName, estimate, profile):
+    """Add the working factor measured in the profile of a run, return
+    True if there was one"""
+    factor = measuredWorkingFactor(profile, estimate)
+    if factor is None:
+      return False
+    self.record(filterName, factor)
+    return True
+
+  def workingFactor(self, filterName):
+    with self._lock:
+      factors = self.samples.get(filterName)
+      return max(factors) if factors else DEFAULT_WORKING_FACTOR
@@ -0,0 +1,250 @@
+import json
+from collections import OrderedDict
+
+import SimpleITK as sitk
+
+from SimpleFiltersLib import Fusion, PixelTypes
+from SimpleFiltersLib.FilterBinding import FilterBinding, filterParameterValues, cloneFilter
+
+#
+# Pipelines of filters
+#
+# A pipeline is an ordered list of filters run one after the other on
+# SimpleITK images, without pushing the intermediate images to the
+# scene. The inputs of a step are the inputs of the pipeline, as
+# ("input", k), or the outputs of earlier steps, as ("step", j). The
+# output of a step is released as soon as the last step using it has
+# run, unless the step is marked for display.
+#
+# Runs of consecutive pointwise steps whose intermediate outputs are not
+# displayed nor used after the run are executed fused, see Fusion.py.
+#
+
+# version of the format of the pipeline files
+PIPELINE_VERSION = 1
+
+# parameters which are not saved, they depend on the machine
+_UNSAVED_PARAMETERS = ("NumberOfThreads", "NumberOfWorkUnits", "Debug")
+
+
+class PipelineStep:
+  """A filter of a pipeline, its inputs and the name of its output.
+
+  output names the volume the result of a step marked for display, or of
+  the last step, is written to. outputLabelMap tells whether it is a
+  label map.
+  """
+
+  def __init__(self, sitkFilter, inputs, display=False, description=None, output=None, outputLabelMap=False):
+    self.filter = sitkFilter
+    self.inputs = [tuple(i) for i in inputs]
+    self.display = display
+    # json description of the filter, to cast the inputs before execution
+    self.description = description
+    self.output = output
+    self.outputLabelMap = outputLabelMap
+
+  @property
+  def name(self):
+    return self.filter.GetName()
+
+  def toDict(self):
+    parameters = OrderedDict((name, value) for name, value in filterParameterValues(self.filter).items()
+                             if name not in _UNSAVED_PARAMETERS)
+    return OrderedDict([("filter", self.filter.__class__.__name__),
+                        ("parameters", parameters),
+                        ("inputs", [list(i) for i in self.inputs]),
+                        ("display", self.display),
+                        ("output", self.output),
+                        ("outputLabelMap", self.outputLabelMap)])
+
+  @staticmethod
+  def fromDict(data, filterDescription=None):
+    filterClass = getattr(sitk, data["filter"], None)
+    if not isinstance(filterClass, type) or not issubclass(filterClass, sitk.ProcessObject):
+      raise ValueError(f"Unknown SimpleITK filter \"{data['filter']}\"")
+    sitkFilter = filterClass()
+    description = filterDescription(data["filter"]) if filterDescription else None
+    # the json values are converted to the types of the members, as
+    # the values set from the GUI
+    binding = FilterBinding(description, sitkFilter) if description else None
+    for name, value in data.get("parameters", {}).items():
+      if not hasattr(sitkFilter, "Set"+name):
+        raise ValueError(f"{sitkFilter.GetName()} has no parameter \"{name}\"")
+      if binding is not None:
+        binding.set(name, value)
+      else:
+        getattr(sitkFilter, "Set"+name)(value)
+    return PipelineStep(sitkFilter, data.get("inputs", []), data.get("display", False), description,
+                        data.get("output"), data.get("outputLabelMap", False))
+
+
+class Pipeline:
+  """Ordered list of PipelineStep, with the names of its inputs"""
+
+  def __init__(self):
+    self.steps = []
+    self.inputNames = []
+
+  def addStep(self, sitkFilter, inputs=None, display=False, description=None, output=None, outputLabelMap=False):
+    """Append a step and return it. By default the only input of a step
+    is the output of the previous one, or the first input of the
+    pipeline for the first step."""
+    if inputs is None:
+      inputs = [("step", len(self.steps)-1)] if self.steps else [("input", 0)]
+    for kind, index in inputs:
+      if kind == "step" and not 0 <= index < len(self.steps):
+        raise ValueError(f"Step {len(self.steps)+1} cannot use the output of step {index+1}")
+      if kind not in ("step", "input"):
+        raise ValueError(f"Unknown input \"{kind}\"")
+    step = PipelineStep(sitkFilter, inputs, display, description, output, outputLabelMap)
+    self.steps.append(step)
+    return step
+
+  def removeStep(self, index):
+    """Remove a step, the steps using its output use its first input
+    instead"""
+    removed = self.steps.pop(index)
+    for step in self.steps[index:]:
+      inputs = []
+      for kind, i in step.inputs:
+        if kind == "step" and i == index:
+          inputs.append(removed.inputs[0] if removed.inputs else ("input", 0))
+        elif kind == "step" and i > index:
+          inputs.append(("step", i-1))
+        else:
+          inputs.append((kind, i))
+      step.inputs = inputs
+
+  def numberOfInputs(self):
+    return max([i+1 for step in self.steps for kind, i in step.inputs if kind == "input"] + [len(self.inputNames)])
+
+  def lastUses(self):
+    """Return the index of the last step using the output of each step"""
+    lastUses = {}
+    for index, step in enumerate(self.steps):
+      for kind, i in step.inputs:
+        if kind == "step":
+          lastUses[i] = index
+    return lastUses
+
+  def fusedRuns(self):
+    """Return the (first, last) steps of the runs of two or more steps
+    which may be executed fused, depending on the pixel types"""
+    lastUses = self.lastUses()
+    runs = []
+    first = 0
+    while first < len(self.steps):
+      end = first
+      while end+1 < len(self.steps) and Fusion.isFusible(self.steps[end+1].filter):
+        end += 1
+      last = None
+      if Fusion.isFusible(self.steps[first].filter):
+        for candidate in range(end, first, -1):
+          if all(not self.steps[j].display and lastUses.get(j, -1) <= candidate
+                 for j in range(first, candidate)):
+            last = candidate
+            break
+      if last is None:
+        first += 1
+      else:
+        runs.append((first, last))
+        first = last+1
+    return runs
+
+  def setNumberOfThreads(self, numberOfThreads):
+    for step in self.steps:
+      if hasattr(step.filter, "SetNumberOfThreads"):
+        step.filter.SetNumberOfThreads(numberOfThreads)
+
+  def clone(self):
+    """Return a copy of the pipeline with copies of the filters, so the
+    original can be edited while the copy runs"""
+    pipeline = Pipeline()
+    pipeline.inputNames = list(self.inputNames)
+    for step in self.steps:
+      pipeline.steps.append(PipelineStep(cloneFilter(step.filter), step.inputs, step.display, step.description,
+                                         step.output, step.outputLabelMap))
+    return pipeline
+
+  def execute(self, inputImages, outputCallback=None, stepCallback=None, abortCallback=None):
+    """Run the steps on the input images and return the output of the
+    last step, or None if aborted.
+
+    stepCallback is called with the indices of the first and last steps
+    before each step, or run of fused steps, runs. outputCallback is
+    called with the index and output of each step marked for display.
+    The images given to outputCallback are not modified afterwards. The
+    output of a step is released once the steps using it have run.
+    """
+    if not self.steps:
+      raise ValueError("The pipeline has no step")
+    lastUses = self.lastUses()
+    fusedRuns = dict(self.fusedRuns())
+    last = len(self.steps)-1
+    outputs = {}
+    index = 0
+    while index <= last:
+      if abortCallback and abortCallback():
+        return None
+      step = self.steps[index]
+      img = None
+      if index in fusedRuns:
+        runLast = fusedRuns[index]
+        sources = list(OrderedDict.fromkeys((kind, i) for s in self.steps[index:runLast+1] for kind, i in s.inputs
+                                            if kind == "input" or i < index))
+        if stepCallback:
+          stepCallback(index, runLast)
+        images = OrderedDict((source, inputImages[source[1]] if source[0] == "input" else outputs[source[1]])
+                             for source in sources)
+        numberOfThreads = getattr(step.filter, "GetNumberOfThreads", lambda: 0)()
+        img = Fusion.executeFused(self.steps, index, runLast, images, numberOfThreads, abortCallback)
+        del images
+        if img is not None:
+          index = runLast
+          step = self.steps[index]
+        elif abortCallback and abortCallback():
+          return None
+      if img is None:
+        if stepCallback:
+          stepCallback(index, index)
+        images = [inputImages[i] if kind == "input" else outputs[i] for kind, i in step.inputs]
+        images = PixelTypes.castInputs(step.description, images)
+        img = step.filter.Execute(*images)
+        del images
+
+      if step.display and index != last and outputCallback:
+        outputCallback(index, img)
+      outputs[index] = img
+      for i in [i for i in outputs if i != index and lastUses.get(i, -1) <= index]:
+        del outputs[i]
+      index += 1
+    return outputs[last]
+
+  def toDict(self):
+    return OrderedDict([("version", PIPELINE_VERSION),
+                        ("inputNames", self.inputNames),
+                        ("steps", [step.toDict() for step in self.steps])])
+
+  @staticmethod
+  def fromDict(data, filterDescription=None):
+    """Return the pipeline of a dictionary written by toDict.
+    filterDescription returns the json description of a filter class
+    name, to cast the inputs of the steps."""
+    if data.get("version") != PIPELINE_VERSION:
+      raise ValueError(f"Unsupported pipeline version {data.get('version')}")
+    pipeline = Pipeline()
+    pipeline.inputNames = list(data.get("inputNames", []))
+    for stepData in data.get("steps", []):
+      step = PipelineStep.fromDict(stepData, filterDescription)
+      pipeline.addStep(step.filter, step.inputs, step.display, step.description, step.output, step.outputLabelMap)
+    return pipeline
+
+  def save(self, fname):
+    with open(fname, "w") as fp:
+      json.dump(self.toDict(), fp, indent=2, default=list)
+
+  @staticmethod
+  def load(fname, filterDescription=None):
+    with open(fname) as fp:
+      return Pipeline.fromDict(json.load(fp), filterDescription)
@@ -0,0 +1,228 @@
+import re
+
+import SimpleITK as sitk
+
+#
+# Pixel types supported by the filters
+#
+# The json descriptions give the pixel types a filter is instantiated
+# for, as the name of a SimpleITK type list. These helpers resolve the
+# type lists and choose the pixel type the inputs are cast to before
+# execution, instead of retrying a failed execution.
+#
+
+_SCALAR_INFO = {
+  # pixel id: (bits, signed, floating point)
+  sitk.sitkUInt8: (8, False, False),
+  sitk.sitkInt8: (8, True, False),
+  sitk.sitkUInt16: (16, False, False),
+  sitk.sitkInt16: (16, True, False),
+  sitk.sitkUInt32: (32, False, False),
+  sitk.sitkInt32: (32, True, False),
+  sitk.sitkUInt64: (64, False, False),
+  sitk.sitkInt64: (64, True, False),
+  sitk.sitkFloat32: (32, True, True),
+  sitk.sitkFloat64: (64, True, True),
+  }
+
+_INTEGER = [sitk.sitkUInt8, sitk.sitkInt8, sitk.sitkUInt16, sitk.sitkInt16,
+            sitk.sitkUInt32, sitk.sitkInt32, sitk.sitkUInt64, sitk.sitkInt64]
+_REAL = [sitk.sitkFloat32, sitk.sitkFloat64]
+_BASIC = _INTEGER + _REAL
+_COMPLEX = [sitk.sitkComplexFloat32, sitk.sitkComplexFloat64]
+_VECTOR = [sitk.sitkVectorUInt8, sitk.sitkVectorInt8, sitk.sitkVectorUInt16, sitk.sitkVectorInt16,
+           sitk.sitkVectorUInt32, sitk.sitkVectorInt32, sitk.sitkVectorUInt64, sitk.sitkVectorInt64,
+           sitk.sitkVectorFloat32, sitk.sitkVectorFloat64]
+_REAL_VECTOR = [sitk.sitkVectorFloat32, sitk.sitkVectorFloat64]
+
+TYPE_LISTS = {
+  "BasicPixelIDTypeList": _BASIC,
+  "IntegerPixelIDTypeList": _INTEGER,
+  "RealPixelIDTypeList": _REAL,
+  "ScalarPixelIDTypeList": _BASIC,
+  "SignedPixelIDTypeList": [sitk.sitkInt8, sitk.sitkInt16, sitk.sitkInt32, sitk.sitkInt64] + _REAL,
+  "ComplexPixelIDTypeList": _COMPLEX,
+  "VectorPixelIDTypeList": _VECTOR,
+  "RealVectorPixelIDTypeList": _REAL_VECTOR,
+  "NonLabelPixelIDTypeList": _BASIC + _COMPLEX + _VECTOR,
+  }
+
+_BASIC_PIXEL_ID = {
+  "uint8_t": sitk.sitkUInt8, "int8_t": sitk.sitkInt8,
+  "uint16_t": sitk.sitkUInt16, "int16_t": sitk.sitkInt16,
+  "uint32_t": sitk.sitkUInt32, "int32_t": sitk.sitkInt32,
+  "uint64_t": sitk.sitkUInt64, "int64_t": sitk.sitkInt64,
+  "float": sitk.sitkFloat32, "double": sitk.sitkFloat64,
+  }
+
+
+def pixelIDs(typeList):
+  """Return the set of pixel ids of a type list expression from a json
+  description, or None if it is not understood."""
+  if not typeList:
+    return None
+  typeList = typeList.strip()
+
+  if typeList in TYPE_LISTS:
+    ids = set(TYPE_LISTS[typeList])
+  else:
+    m = re.match(r'typelist::Append\s*<(.*)>::Type$', typeList)
+    n = re.match(r'typelist::MakeTypeList\s*<(.*)>::Type$', typeList)
+    if m:
+      ids = set()
+      for name in m.group(1).split(','):
+        sub = pixelIDs(name)
+        if sub is None:
+          return None
+        ids |= sub
+    elif n:
+      ids = set()
+      for name in re.findall(r'BasicPixelID\s*<\s*(\w+)\s*>', n.group(1)):
+        if name not in _BASIC_PIXEL_ID:
+          return None
+        ids.add(_BASIC_PIXEL_ID[name])
+      if not ids:
+        return None
+    else:
+      return None
+
+  # pixel types which are not instantiated in SimpleITK have a negative id
+  return {i for i in ids if i >= 0}
+
+
+def canRepresent(fromID, toID):
+  """True if every value of pixel type fromID is exactly represented by
+  pixel type toID."""
+  if fromID == toID:
+    return True
+  if fromID not in _SCALAR_INFO or toID not in _SCALAR_INFO:
+    return False
+  fromBits, fromSigned, fromReal = _SCALAR_INFO[fromID]
+  toBits, toSigned, toReal = _SCALAR_INFO[toID]
+  if toReal:
+    # the significand of float has 24 bits, the one of double 53
+    significand = 24 if toBits == 32 else 53
+    return (fromReal and fromBits <= toBits) or (not fromReal and fromBits < significand)
+  if fromReal:
+    return False
+  if fromSigned == toSigned:
+    return toBits >= fromBits
+  return toSigned and toBits > fromBits
+
+
+def narrowestPixelID(supported, fromIDs):
+  """Return the narrowest pixel id of supported which represents all the
+  pixel types fromIDs. If there is none, integers are cast to the
+  widest supported floating point type, and None is returned for other
+  pixel types."""
+  fromIDs = set(fromIDs)
+  if len(fromIDs) == 1 and fromIDs <= supported:
+    return next(iter(fromIDs))
+
+  candidates = [toID for toID in supported if all(canRepresent(f, toID) for f in fromIDs)]
+  if candidates:
+    # fewest bits first, integers before floating point
+    return min(candidates, key=lambda i: (_SCALAR_INFO[i][0], _SCALAR_INFO[i][2]))
+
+  if all(f in _INTEGER for f in fromIDs):
+    for toID in reversed(_REAL):
+      if toID in supported:
+        return toID
+  return None
+
+
+def pixelTypesKnown(description):
+  """True if the pixel types the filter of the json description supports
+  are known, so castPixelIDs chooses its casts"""
+  return description is not None and pixelIDs(description.get("pixel_types")) is not None
+
+
+def castPixelIDs(description, inputPixelIDs):
+  """Return the pixel id each input should be cast to before executing the
+  filter of the json description, None for the inputs which are used as
+  is. Returns None when no input is cast, or when the pixel types of the
+  filter are not known, see pixelTypesKnown.
+
+  Inputs which share a type list are cast to a common type, except for
+  mask images which SimpleITK converts itself.
+  """
+  if description is None:
+    return None
+  supported = pixelIDs(description.get("pixel_types"))
+  if supported is None:
+    return None
+
+  inputNames = [i.get("name", "") for i in description.get("inputs", [])]
+  twoTypeLists = description.get("template_code_filename") == "DualImageFilter" and len(inputPixelIDs) > 1
+
+  targets = [None] * len(inputPixelIDs)
+  shared = []
+  for idx, pixelID in enumerate(inputPixelIDs):
+    name = inputNames[idx] if idx < len(inputNames) else ""
+    if "Mask" in name:
+      continue
+    if twoTypeLists and idx > 0:
+      supported2 = pixelIDs(description.get("pixel_types2"))
+      if supported2 is not None and pixelID not in supported2:
+        targets[idx] = narrowestPixelID(supported2, [pixelID])
+      continue
+    shared.append(idx)
+
+  if shared:
+    toID = narrowestPixelID(supported, [inputPixelIDs[idx] for idx in shared])
+    for idx in shared:
+      if toID is not None and toID != inputPixelIDs[idx]:
+        targets[idx] = toID
+  if all(pixelID is None for pixelID in targets):
+    return None
+  return targets
+
+
+def castInputs(description, images):
+  """Cast the images as chosen by castPixelIDs"""
+  targets = castPixelIDs(description, [img.GetPixelID() for img in images])
+  if not targets:
+    return list(images)
+  return [img if pixelID is None else sitk.Cast(img, pixelID) for img, pixelID in zip(images, targets)]
+
+
+_VECTOR_COMPONENT = dict(zip(_VECTOR, _BASIC))
+_COMPLEX_COMPONENT = {sitk.sitkComplexFloat32: sitk.sitkFloat32, sitk.sitkComplexFloat64: sitk.sitkFloat64}
+
+
+def componentSize(pixelID):
+  """Return the size in bytes of a component of a pixel of type
+  pixelID, or None if it is not known."""
+  if pixelID in _COMPLEX_COMPONENT:
+    return 2 * componentSize(_COMPLEX_COMPONENT[pixelID])
+  pixelID = _VECTOR_COMPONENT.get(pixelID, pixelID)
+  if pixelID not in _SCALAR_INFO:
+    return None
+  return _SCALAR_INFO[pixelID][0] // 8
+
+
+def outputPixelID(description, inputPixelIDs, sitkFilter=None):
+  """Return the pixel id of the output of a filter run on inputs of
+  pixel ids inputPixelIDs, after the casts, from its OutputPixelType
+  parameter or the output_pixel_type of its json description. When
+  neither tells, the output has the type of the first input."""
+  inputID = inputPixelIDs[0] if inputPixelIDs else sitk.sitkFloat32
+  getter = getattr(sitkFilter, "GetOutputPixelType", None)
+  if getter is not None and getter() != sitk.sitkUnknown:
+    return getter()
+
+  name = (description or {}).get("output_pixel_type", "")
+  if name in _BASIC_PIXEL_ID:
+    return _BASIC_PIXEL_ID[name]
+  if name.startswith("std::complex"):
+    return sitk.sitkComplexFloat32 if inputID == sitk.sitkFloat32 else sitk.sitkComplexFloat64
+  if "RealType" in name:
+    # itk::NumericTraits<T>::RealType is double based
+    if inputID in _VECTOR:
+      return sitk.sitkVectorFloat64
+    return sitk.sitkComplexFloat64 if inputID in _COMPLEX else sitk.sitkFloat64
+  if "InputImageType2" in name and len(inputPixelIDs) > 1:
+    return _VECTOR_COMPONENT.get(inputPixelIDs[1], inputPixelIDs[1])
+  if "value_type" in name:
+    return _VECTOR_COMPONENT.get(inputID, inputID)
+  return inputID
@@ -0,0 +1,197 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque, namedtuple
+from contextlib import contextmanager
+
+#
+# Profiling of the stages of a run
+#
+# A RunProfile records the stages of one run of a filter, as pulling the
+# inputs from the volume nodes, casting, executing, waiting for the main
+# thread and pushing the result, with their duration, the bytes they
+# copied and the memory of the process. The memory of a stage may also
+# be sampled while it runs, to measure its own peak. A Profiler keeps the profiles
+# of the last runs and writes them as a trace file in the Chrome trace
+# event format, which can be opened in chrome://tracing or Perfetto.
+#
+
+StageRecord = namedtuple("StageRecord", ["name", "start", "duration", "nbytes", "memory", "peakMemory", "thread",
+                                         "startMemory", "sampledPeak"],
+                         defaults=(None, None))
+
+
+def currentRSS():
+  """Return the resident memory of the process in bytes, or None where
+  it is not available."""
+  try:
+    with open("/proc/self/statm") as fp:
+      return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+  except (OSError, ValueError, IndexError, AttributeError):
+    return None
+
+
+def peakRSS():
+  """Return the peak resident memory of the process in bytes, or None
+  where it is not available."""
+  try:
+    import resource
+  except ImportError:
+    return None
+  rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+  # kilobytes on Linux, bytes on macOS
+  return rss if sys.platform == "darwin" else rss*1024
+
+
+class MemorySampler:
+  """Samples the resident memory of the process every INTERVAL seconds
+  in a thread, to measure the peak of a stage. The peak of getrusage is
+  the one of the whole life of the process, it tells nothing about a
+  stage which stays below it.
+
+  A peak shorter than the interval may be missed, and the memory of the
+  other threads of the process is counted too.
+  """
+
+  INTERVAL = 0.01
+
+  def __init__(self):
+    self.startMemory = None
+    self.peak = None
+    self._stop = threading.Event()
+    self._thread = None
+
+  def start(self):
+    self.startMemory = self.peak = currentRSS()
+    if self.startMemory is None:
+      return
+    self._thread = threading.Thread(target=self._run, name="MemorySampler", daemon=True)
+    self._thread.start()
+
+  def _run(self):
+    while not self._stop.wait(self.INTERVAL):
+      self.peak = max(self.peak, currentRSS() or 0)
+
+  def stop(self):
+    """Stop sampling and return the peak, or None where the resident
+    memory is not available"""
+    if self._thread is not None:
+      self._stop.set()
+      self._thread.join()
+      self._thread = None
+      self.peak = max(self.peak, currentRSS() or 0)
+    return self.peak
+
+
+class RunProfile:
+  """Stages of one run of a filter.
+
+  Stages may be recorded from the worker thread and the main thread.
+  The peak memory of a stage is the peak of the process at its end, it
+  only tells the memory a stage used when the stage set a new peak. The
+  sampled peak of a stage recorded with sampleMemory is its own.
+  """
+
+  def __init__(self, name):
+    self.name = name
+    self.startTime = time.perf_counter()
+    self.stages = []
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def now():
+    return time.perf_counter()
+
+  @contextmanager
+  def stage(self, name, nbytes=None, sampleMemory=False):
+    """Record the block of a with statement as a stage. nbytes may be
+    a callable returning the number of bytes once the stage ran. When
+    sampleMemory is set, the memory is sampled while the stage runs, see
+    MemorySampler."""
+    sampler = None
+    if sampleMemory:
+      sampler = MemorySampler()
+      sampler.start()
+    start = self.now()
+    try:
+      yield
+    finally:
+      end = self.now()
+      sampledPeak = sampler.stop() if sampler else None
+      self.addStage(name, start, end, nbytes() if callable(nbytes) else nbytes,
+                    sampler.startMemory if sampler else None, sampledPeak)
+
+  def addStage(self, name, start, end, nbytes=None, startMemory=None, sampledPeak=None):
+    """Record a stage from start to end, as returned by now(), with the
+    memory at its start and its sampled peak when they were measured"""
+    record = StageRecord(name, start, end-start, nbytes, currentRSS(), peakRSS(),
+                         threading.current_thread().name, startMemory, sampledPeak)
+    with self._lock:
+      self.stages.append(record)
+
+  def duration(self):
+    """Time from the start of the run to the end of its last stage"""
+    with self._lock:
+      if not self.stages:
+        return 0.0
+      return max(s.start+s.duration for s in self.stages) - self.startTime
+
+  def totals(self):
+    """Return the total duration, bytes copied and peak memory by stage
+    name, in the order the stages first ran"""
+    totals = OrderedDict()
+    with self._lock:
+      for s in self.stages:
+        duration, nbytes, peakMemory = totals.get(s.name, (0.0, None, None))
+        if s.nbytes is not None:
+          nbytes = (nbytes or 0) + s.nbytes
+        if s.peakMemory is not None:
+          peakMemory = max(peakMemory or 0, s.peakMemory)
+        totals[s.name] = (duration + s.duration, nbytes, peakMemory)
+    return totals
+
+  def summary(self):
+    lines = [f"{self.name}: {self.duration():.3f}s"]
+    for name, (duration, nbytes, peakMemory) in self.totals().items():
+      copied = f", {nbytes/2**20:.1f} MB copied" if nbytes else ""
+      lines.append(f"  {name}: {duration*1000.0:.1f} ms{copied}")
+    return "\n".join(lines)
+
+  def traceEvents(self):
+    """Return the stages as complete events of the Chrome trace format"""
+    pid = os.getpid()
+    events = [{"name": self.name, "cat": "run", "ph": "X", "pid": pid, "tid": "run",
+               "ts": self.startTime*1e6, "dur": self.duration()*1e6}]
+    with self._lock:
+      for s in self.stages:
+        args = {"filter": self.name}
+        for key in ("nbytes", "memory", "peakMemory", "startMemory", "sampledPeak"):
+          if getattr(s, key) is not None:
+            args[key] = getattr(s, key)
+        events.append({"name": s.name, "cat": "stage", "ph": "X", "pid": pid, "tid": s.thread,
+                       "ts": s.start*1e6, "dur": s.duration*1e6, "args": args})
+    return events
+
+
+class Profiler:
+  """The profiles of the last maxRuns runs"""
+
+  def __init__(self, maxRuns=100):
+    self.profiles = deque(maxlen=maxRuns)
+
+  def add(self, profile):
+    self.profiles.append(profile)
+
+  def clear(self):
+    self.profiles.clear()
+
+  def writeTrace(self, fname):
+    """Write the profiles as a json trace file in the Chrome trace event
+    format"""
+    events = []
+    for profile in self.profiles:
+      events.extend(profile.traceEvents())
+    with open(fname, "w") as fp:
+      json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fp)
@@ -0,0 +1,138 @@
+import threading
+from collections import OrderedDict
+
+import SimpleITK as sitk
+
+from SimpleFiltersLib import Regions
+from SimpleFiltersLib.FilterBinding import filterParameterValues
+from SimpleFiltersLib.ResultCache import imageSizeInBytes
+
+#
+# Draft resolution
+#
+# A draft runs the filter on the inputs shrunk by 2**level along each
+# axis, with the parameters in voxels rescaled to the shrunk grid, and
+# the result is resampled back to the grid of the first input. The
+# shrunk inputs are kept in a PyramidCache, so tuning the parameters
+# only shrinks the inputs once.
+#
+
+# an axis is not shrunk below this number of voxels
+MINIMUM_SIZE = 8
+
+
+def shrinkFactors(size, level):
+  """Return the shrink factor of each axis of an image of the given size
+  at a level of the pyramid, a power of two up to 2**level"""
+  factors = []
+  for s in size:
+    f = 1
+    while f < 2**level and 2*f*MINIMUM_SIZE <= s:
+      f *= 2
+    factors.append(f)
+  return factors
+
+
+def shrinkImage(img, factors, isLabel=False):
+  """Return img shrunk by integer factors, averaging the voxels of each
+  bin, or sampling them for a label map"""
+  if all(f == 1 for f in factors):
+    return img
+  if isLabel:
+    return sitk.Shrink(img, factors)
+  return sitk.BinShrink(img, factors)
+
+
+def upsampleImage(img, referenceImage, isLabel=False):
+  """Return img resampled on the grid of referenceImage"""
+  interpolator = sitk.sitkNearestNeighbor if isLabel else sitk.sitkLinear
+  return sitk.Resample(img, referenceImage, sitk.Transform(), interpolator, 0.0, img.GetPixelID())
+
+
+def scaleParameters(sitkFilter, description, factors):
+  """Rescale the parameters of a filter in voxels to an image shrunk by
+  factors: the radii, kernel widths and seed indices. Parameters in
+  physical units are left unchanged unless the filter has
+  UseImageSpacing off."""
+  values = filterParameterValues(sitkFilter)
+  indexNames = Regions.indexParameterNames(description)
+  useImageSpacing = values.get("UseImageSpacing", True)
+
+  def scaleRadius(value):
+    if isinstance(value, (list, tuple)):
+      return [0 if v == 0 else max(1, int(round(v/f))) for v, f in zip(value, factors)]
+    return value if value == 0 else max(1, int(round(value/max(factors))))
+
+  def scaleIndex(point):
+    # the extra components, as the value of the trial points, are kept
+    return [int(p//f) for p, f in zip(point, factors)] + list(point[len(factors):])
+
+  for name, value in values.items():
+    if isinstance(value, str):
+      continue
+    scaled = None
+    if name in indexNames:
+      if value and isinstance(value[0], (list, tuple)):
+        scaled = [scaleIndex(point) for point in value]
+      else:
+        scaled = scaleIndex(value)
+    elif name.endswith("Radius") or name == "MaximumKernelWidth":
+      scaled = scaleRadius(value)
+    elif not useImageSpacing and "Sigma" in name and name != "RangeSigma":
+      scaled = [v/f for v, f in zip(value, factors)] if isinstance(value, (list, tuple)) else value/max(factors)
+    elif not useImageSpacing and name == "Variance":
+      scaled = [v/f**2 for v, f in zip(value, factors)] if isinstance(value, (list, tuple)) else value/max(factors)**2
+    if scaled is not None:
+      getattr(sitkFilter, "Set"+name)(scaled)
+
+
+class PyramidCache:
+  """Shrunk copies of the input volumes, by level of the pyramid.
+
+  The entries are keyed by a key of the volume, as its node and
+  modification time, and the least recently used ones are evicted when
+  they exceed maxMemory bytes. A level is shrunk from the level below it
+  when that one is cached.
+  """
+
+  def __init__(self, maxMemory=512*2**20):
+    self.maxMemory = maxMemory
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, key, img, level, isLabel=False):
+    """Return img, identified by key, shrunk to level"""
+    if all(f == 1 for f in shrinkFactors(img.GetSize(), level)):
+      # img may be a view of a volume node, it is not cached
+      return img
+    # the geometry is part of the key, it may change without the voxels
+    key = (key, tuple(img.GetOrigin()), tuple(img.GetSpacing()), tuple(img.GetDirection()), isLabel)
+
+    with self._lock:
+      entry = self._entries.get((key, level))
+      if entry is not None:
+        self._entries.move_to_end((key, level))
+        return entry
+      # the closest cached level below
+      source, sourceLevel = img, 0
+      for lower in range(level-1, 0, -1):
+        if (key, lower) in self._entries:
+          source, sourceLevel = self._entries[(key, lower)], lower
+          break
+
+    size = img.GetSize()
+    factors = [int(f//s) for f, s in zip(shrinkFactors(size, level), shrinkFactors(size, sourceLevel))]
+    shrunk = shrinkImage(source, factors, isLabel)
+
+    with self._lock:
+      self._entries[(key, level)] = shrunk
+      while len(self._entries) > 1 and self.memoryUsed() > self.maxMemory:
+        self._entries.popitem(last=False)
+    return shrunk
+
+  def memoryUsed(self):
+    return sum(imageSizeInBytes(img) for img in self._entries.values())
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
@@ -0,0 +1,212 @@
+import math
+
+import SimpleITK as sitk
+
+from SimpleFiltersLib.FilterBinding import filterParameterValues
+
+#
+# Running a filter on a region of the inputs
+#
+# A region is a pair of (index, size) lists in the index order of
+# SimpleITK. The inputs are cropped with RegionOfInterest, which keeps
+# the physical location of the voxels, so the result is placed at the
+# right position in the scene. The region is grown by a margin so the
+# voxels near its border see the same neighbourhood as in a run on the
+# whole volume.
+#
+
+# Parameters named *Radius are in voxels, the Gaussian scales are in
+# physical units unless the filter has UseImageSpacing off. RangeSigma
+# is an intensity scale.
+_SIGMA_EXCLUDED = ("RangeSigma",)
+
+# number of standard deviations covered by a Gaussian kernel
+GAUSSIAN_EXTENT = 3.0
+
+# Filters whose output at a voxel only depends on the inputs within the
+# margin estimated by filterMargin: their radius is the exact extent of
+# their kernel or structuring element. The margin of the others is a
+# heuristic, as for Gaussian kernels truncated at GAUSSIAN_EXTENT, the
+# infinite impulse response of the recursive Gaussians, the stencils of
+# finite differences, iterated diffusion or flows, or structuring
+# elements applied twice, their result on a region only approximates
+# the one on the whole volume near its border.
+EXACT_MARGIN_FILTERS = frozenset([
+  "BinaryDilateImageFilter", "BinaryErodeImageFilter", "BinaryMedianImageFilter",
+  "BoxMeanImageFilter", "BoxSigmaImageFilter", "GrayscaleDilateImageFilter",
+  "GrayscaleErodeImageFilter", "MeanImageFilter", "MedianImageFilter",
+  "MorphologicalGradientImageFilter", "NoiseImageFilter",
+  ])
+
+
+def _perAxis(value, dimension):
+  if isinstance(value, (list, tuple)):
+    value = list(value) + [value[-1]]*(dimension-len(value))
+    return [float(v) for v in value[:dimension]]
+  return [float(value)]*dimension
+
+
+def filterMargin(sitkFilter, spacing):
+  """Return the number of voxels, by axis, a voxel of the output
+  depends on around it, estimated from the radius, sigma, variance and
+  iteration parameters of the filter.
+
+  Filters without such parameters get a margin of 0. The estimate does
+  not hold for filters which propagate information over the whole
+  image, as region growing or level sets, and is approximate for most
+  of the others, see isMarginExact.
+  """
+  dimension = len(spacing)
+  values = filterParameterValues(sitkFilter)
+  useImageSpacing = values.get("UseImageSpacing", True)
+  physical = [s if useImageSpacing else 1.0 for s in spacing]
+
+  margin = [0.0]*dimension
+  for name, value in values.items():
+    if isinstance(value, str) or (isinstance(value, (list, tuple)) and not value):
+      continue
+    try:
+      if name.endswith("Radius"):
+        extent = _perAxis(value, dimension)
+      elif "Sigma" in name and name not in _SIGMA_EXCLUDED:
+        extent = [GAUSSIAN_EXTENT*s/p for s, p in zip(_perAxis(value, dimension), physical)]
+      elif name == "Variance":
+        extent = [GAUSSIAN_EXTENT*math.sqrt(max(v, 0.0))/p for v, p in zip(_perAxis(value, dimension), physical)]
+      elif name in ("NumberOfIterations", "Repetitions"):
+        # diffusion, flow and repeated blur filters spread by about a
+        # voxel per iteration
+        extent = _perAxis(value, dimension)
+      else:
+        continue
+    except (TypeError, ValueError):
+      continue
+    margin = [m+e for m, e in zip(margin, extent)]
+  return [int(math.ceil(m)) for m in margin]
+
+
+def isMarginExact(sitkFilter):
+  """Return True if the margin estimated by filterMargin covers all the
+  voxels an output voxel of the filter depends on, see
+  EXACT_MARGIN_FILTERS"""
+  return sitkFilter.__class__.__name__ in EXACT_MARGIN_FILTERS
+
+
+def clampRegion(index, size, imageSize):
+  """Return the intersection of a region with the image, or None if it
+  is empty"""
+  lower = [max(0, int(i)) for i in index]
+  upper = [min(int(n), int(i)+int(s)) for i, s, n in zip(index, size, imageSize)]
+  if any(u <= l for l, u in zip(lower, upper)):
+    return None
+  return lower, [u-l for l, u in zip(lower, upper)]
+
+
+def padRegion(index, size, margin, imageSize):
+  """Return a region grown by margin voxels on each side, within the image"""
+  return clampRegion([i-m for i, m in zip(index, margin)],
+                     [s+2*m for s, m in zip(size, margin)],
+                     imageSize)
+
+
+def sliceRegion(imageSize, axis, sliceIndex):
+  """Return the region of the slice sliceIndex along axis, or None if
+  the slice is outside of the image"""
+  if sliceIndex < 0 or sliceIndex >= imageSize[axis]:
+    return None
+  index = [0]*len(imageSize)
+  size = list(imageSize)
+  index[axis] = sliceIndex
+  size[axis] = 1
+  return index, size
+
+
+def cropImage(img, region):
+  """Return the voxels of the region of img, at the same physical location"""
+  index, size = region
+  return sitk.RegionOfInterest(img, [int(s) for s in size], [int(i) for i in index])
+
+
+def trimImage(img, processedRegion, region):
+  """Return the voxels of region from the result of a run on the
+  larger processedRegion. A result which does not have the size of the
+  processed region, from a filter changing the size of the image, is
+  returned as is."""
+  if list(img.GetSize()) != [int(s) for s in processedRegion[1]]:
+    return img
+  return cropImage(img, ([r-p for r, p in zip(region[0], processedRegion[0])], region[1]))
+
+
+def pasteImage(img, region, reference):
+  """Return an image with the size and geometry of reference, with the
+  voxels of img in region and zero elsewhere"""
+  components = img.GetNumberOfComponentsPerPixel()
+  if components > 1:
+    full = sitk.Image(reference.GetSize(), img.GetPixelID(), components)
+  else:
+    full = sitk.Image(reference.GetSize(), img.GetPixelID())
+  full.CopyInformation(reference)
+  return sitk.Paste(full, img, img.GetSize(), [0]*img.GetDimension(), [int(i) for i in region[0]])
+
+
+def canViewArrays():
+  """True if SimpleITK can wrap the buffer of a numpy array as an image,
+  see imageFromArray"""
+  return hasattr(sitk, "GetImageViewFromArray")
+
+
+def imageFromArray(arr, isVector=False):
+  """Return an image of the voxels of a numpy array, a view of its
+  buffer when canViewArrays, otherwise a copy. A view does not keep the
+  array alive, it must be referenced as long as the image is used."""
+  if canViewArrays():
+    return sitk.GetImageViewFromArray(arr, isVector=isVector)
+  return sitk.GetImageFromArray(arr, isVector=isVector)
+
+
+def indexParameterNames(description):
+  """Return the names of the parameters of a filter which hold voxel
+  indices, a single index or a list of them, from its json description"""
+  names = []
+  if description is None:
+    return names
+  template = description.get("template_code_filename")
+  if template == "RegionGrowingImageFilter":
+    names.append("SeedList")
+  elif template == "FastMarchingImageFilter":
+    names.append("TrialPoints")
+  for member in description.get("members", []):
+    if "point_vec" in member:
+      names.append(member["name"])
+    elif "dim_vec" in member and int(member["dim_vec"]) and member.get("itk_type", "").endswith("IndexType"):
+      names.append(member["name"])
+  return names
+
+
+def shiftIndexParameters(sitkFilter, names, region):
+  """Move the index parameters of a filter into the index space of a
+  region. Only the index components of a point are moved, the extra
+  ones, as the value of the FastMarching trial points, are kept. Points
+  of a list outside the region are dropped, a ValueError is raised when
+  none of them is inside it, or for a single index outside it."""
+  index, size = region
+  dimension = len(index)
+
+  def shift(point):
+    return [p-i for p, i in zip(point[:dimension], index)] + list(point[dimension:])
+
+  def inside(point):
+    return all(0 <= p < s for p, s in zip(point[:dimension], size))
+
+  for name in names:
+    if not hasattr(sitkFilter, "Get"+name):
+      continue
+    value = getattr(sitkFilter, "Get"+name)()
+    if value and isinstance(value[0], (list, tuple)):
+      shifted = [point for point in map(shift, value) if inside(point)]
+      if not shifted:
+        raise ValueError(f"None of the {name} is inside the processed region")
+    else:
+      shifted = shift(value)
+      if shifted and not inside(shifted):
+        raise ValueError(f"{name} {list(value)} is outside of the processed region")
+    getattr(sitkFilter, "Set"+name)(shifted)
@@ -0,0 +1,252 @@
+import hashlib
+import itertools
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import SimpleITK as sitk
+
+#
+# ResultCache
+#
+
+def imageSizeInBytes(img):
+  return img.GetNumberOfPixels() * img.GetNumberOfComponentsPerPixel() * img.GetSizeOfPixelComponent()
+
+
+class _CacheEntry:
+  def __init__(self, image, nbytes):
+    self.image = image
+    self.nbytes = nbytes
+    self.spillFile = None
+    # the image is being written to spillFile, it is still in memory
+    self.spilling = False
+    # (vtkDataArray, MTime, node ID) of the volume node scalars sharing
+    # the buffer
+    self.guards = []
+
+
+class ResultCache:
+  """Bounded cache of filter results.
+
+  Results are keyed by the filter name, its parameters and a key of each
+  input (see makeKey). The least recently used results are evicted when
+  the cached images exceed maxMemory bytes. If a spill directory is set
+  they are written there instead, up to maxSpill bytes.
+
+  A cached image may share its buffer with the output volume node it
+  was pushed to. Such an entry is guarded by the modification time of
+  the node's scalar array, and discarded if the voxels were modified.
+  Its voxels are held by the node anyway, they are counted apart from
+  maxMemory, see sharedMemoryUsed, as long as the array is the scalars
+  of the node, as returned by nodeScalars for the ID of the node.
+  The entries are discarded with discardShared before a filter writes
+  over the voxels of the node, as the modification is only signalled
+  once it is done.
+
+  The evicted images are written to the spill directory by a thread, so
+  put does not wait for the disk. An image is no longer counted in
+  memory once its spill has started.
+  """
+
+  def __init__(self, maxMemory=512*2**20, spillDirectory=None, maxSpill=0, nodeScalars=None):
+    self.maxMemory = maxMemory
+    self.spillDirectory = spillDirectory
+    self.maxSpill = maxSpill
+    # returns the scalar array of the volume node of an ID, or None,
+    # without it no entry is counted as shared
+    self.nodeScalars = nodeScalars
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+    self._spiller = None
+    self._spillNumbers = itertools.count()
+    self.hits = 0
+    self.misses = 0
+
+  @staticmethod
+  def makeKey(filterName, parameters, inputKeys):
+    """Return a key from the filter name, a dictionary of parameter names
+    to values, and json serializable keys identifying the inputs."""
+    canonical = json.dumps([filterName,
+                            sorted((name, repr(value)) for name, value in parameters.items()),
+                            inputKeys], separators=(',', ':'), default=repr)
+    return hashlib.sha1(canonical.encode()).hexdigest()
+
+  def memoryUsed(self):
+    """Bytes of the cached images which are not shared with a node"""
+    return sum(e.nbytes for e in self._entries.values()
+               if e.image is not None and not e.spilling and not self._isShared(e))
+
+  def sharedMemoryUsed(self):
+    """Bytes of the cached images shared with a node"""
+    return sum(e.nbytes for e in self._entries.values() if e.image is not None and self._isShared(e))
+
+  def spillUsed(self):
+    return sum(e.nbytes for e in self._entries.values() if e.spillFile is not None)
+
+  def get(self, key):
+    """Return the cached image, or None."""
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and not self._isValid(entry):
+        self._remove(key)
+        entry = None
+      if entry is None:
+        self.misses += 1
+        return None
+
+      self._entries.move_to_end(key)
+      img = entry.image
+      if entry.spilling:
+        # the image is still in memory, the file being written is dropped
+        entry.spilling = False
+        entry.spillFile = None
+        self._evict()
+      elif img is None:
+        img = entry.image = sitk.ReadImage(entry.spillFile)
+        self._removeSpillFile(entry)
+        self._evict()
+      self.hits += 1
+      return img
+
+  def put(self, key, img, sharedArray=None, nodeID=None):
+    """Cache img. sharedArray is the vtk array of the volume node of
+    nodeID img was pushed to, when they share their buffer, see guard."""
+    nbytes = imageSizeInBytes(img)
+    with self._lock:
+      self._remove(key)
+      entry = _CacheEntry(img, nbytes)
+      if sharedArray is not None:
+        entry.guards.append((sharedArray, sharedArray.GetMTime(), nodeID))
+      fits = self.maxMemory > 0 and (nbytes <= self.maxMemory or self._isShared(entry))
+      if not fits and not self._canSpill(nbytes):
+        return
+      self._entries[key] = entry
+      self._evict()
+
+  def guard(self, key, vtkArray, nodeID=None):
+    """Discard the entry if vtkArray, the scalars of the volume node of
+    nodeID which share the buffer of the cached image, is modified."""
+    with self._lock:
+      entry = self._entries.get(key)
+      if entry is not None and vtkArray is not None:
+        entry.guards.append((vtkArray, vtkArray.GetMTime(), nodeID))
+
+  def discardShared(self, vtkArray):
+    """Remove the entries sharing the buffer of vtkArray, before its
+    voxels are written over"""
+    with self._lock:
+      for key in [key for key, entry in self._entries.items()
+                  if any(array is vtkArray for array, mtime, nodeID in entry.guards)]:
+        self._remove(key)
+
+  def isShared(self, vtkArray):
+    """True if a cached image shares the buffer of vtkArray"""
+    with self._lock:
+      return any(array is vtkArray for entry in self._entries.values() for array, mtime, nodeID in entry.guards)
+
+  def setLimits(self, maxMemory, maxSpill):
+    """Change the bounds of the cache, evicting entries as needed"""
+    with self._lock:
+      self.maxMemory = maxMemory
+      self.maxSpill = maxSpill
+      self._evict()
+
+  def clear(self):
+    with self._lock:
+      for key in list(self._entries):
+        self._remove(key)
+
+  def flush(self):
+    """Wait for the spills in progress to be written"""
+    with self._lock:
+      spiller = self._spiller
+    if spiller is not None:
+      # the spills run one after the other
+      spiller.submit(lambda: None).result()
+
+  def _isValid(self, entry):
+    return all(array.GetMTime() == mtime for array, mtime, nodeID in entry.guards)
+
+  def _isShared(self, entry):
+    # other references to the array, as its Python wrapper or the vtk
+    # pipeline, do not tell whether the node still uses it
+    if self.nodeScalars is None:
+      return False
+    return any(nodeID is not None and self.nodeScalars(nodeID) is array for array, mtime, nodeID in entry.guards)
+
+  def _canSpill(self, nbytes):
+    return self.spillDirectory is not None and nbytes <= self.maxSpill
+
+  def _evict(self):
+    if self.maxMemory <= 0:
+      # the cache is disabled, the shared images are not kept either
+      for key in [key for key, entry in self._entries.items() if entry.image is not None and self._isShared(entry)]:
+        self._remove(key)
+
+    # least recently used entries are first
+    for key in list(self._entries):
+      if self.memoryUsed() <= self.maxMemory:
+        break
+      entry = self._entries[key]
+      if entry.image is None or entry.spilling or self._isShared(entry):
+        continue
+      if self._canSpill(entry.nbytes) and self._isValid(entry):
+        self._spill(key, entry)
+      else:
+        self._remove(key)
+
+    for key in list(self._entries):
+      if self.spillUsed() <= self.maxSpill:
+        break
+      if self._entries[key].spillFile is not None:
+        self._remove(key)
+
+  def _spill(self, key, entry):
+    """Start writing the image of an entry to the spill directory"""
+    if self._spiller is None:
+      self._spiller = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ResultCacheSpill")
+    # a file name of its own, a new entry of the same key may be spilled
+    # while this one is written
+    entry.spillFile = os.path.join(self.spillDirectory, f"{key}-{next(self._spillNumbers)}.mha")
+    entry.spilling = True
+    self._spiller.submit(self._writeSpill, key, entry, entry.image, entry.spillFile)
+
+  def _writeSpill(self, key, entry, img, fileName):
+    try:
+      os.makedirs(self.spillDirectory, exist_ok=True)
+      sitk.WriteImage(img, fileName)
+      written = True
+    except Exception:
+      written = False
+    with self._lock:
+      if entry.spilling and entry.spillFile == fileName:
+        entry.spilling = False
+        if written:
+          entry.image = None
+          entry.guards = []
+          return
+        if self._entries.get(key) is entry:
+          self._remove(key)
+    # the entry was read or removed while it was written
+    try:
+      os.remove(fileName)
+    except OSError:
+      pass
+
+  def _remove(self, key):
+    entry = self._entries.pop(key, None)
+    if entry is not None:
+      entry.spilling = False
+      self._removeSpillFile(entry)
+
+  @staticmethod
+  def _removeSpillFile(entry):
+    if entry.spillFile is not None:
+      try:
+        os.remove(entry.spillFile)
+      except OSError:
+        pass
+      entry.spillFile = None
@@ -0,0 +1,102 @@
+import re
+from collections import defaultdict
+
+#
+# SearchIndex
+#
+
+# splits CamelCase and words with digits, as "Log10ImageFilter"
+_WORD = re.compile(r'[A-Z]+(?![a-z])|[A-Z]?[a-z]+|[0-9]+')
+
+
+def words(text):
+  """Return the lower case words of a text, CamelCase names are split"""
+  return [w.lower() for w in _WORD.findall(text or "")]
+
+
+def trigrams(word):
+  """Return the set of trigrams of a word, padded so short words and
+  prefixes have trigrams too"""
+  padded = "$" + word + "$"
+  return {padded[i:i+3] for i in range(max(1, len(padded)-2))}
+
+
+class SearchIndex:
+  """Ranked fuzzy search of documents made of weighted text fields.
+
+  Each field of a document is split into words, and the trigrams of the
+  words are indexed. A query term matches a field when at least
+  MIN_SIMILARITY of its trigrams are found in the field, so misspelled
+  and partial terms still match. The score of a term is the best
+  similarity over the fields, times the weight of the field, with a
+  bonus when the term is a substring of the first field. A document
+  matches a query when all the terms match, and is ranked by the sum of
+  the scores of the terms.
+  """
+
+  MIN_SIMILARITY = 0.6
+  SUBSTRING_BONUS = 1.0
+
+  def __init__(self, fieldWeights):
+    """fieldWeights lists the weight of each field of the documents"""
+    self.fieldWeights = list(fieldWeights)
+    self.documentCount = 0
+    # trigram to list of (document, field)
+    self.postings = defaultdict(list)
+    # lower case text of the first field of each document, without spaces
+    self.keys = []
+
+  def add(self, fields):
+    """Index a document given as the list of the texts of its fields,
+    and return its number"""
+    document = self.documentCount
+    self.documentCount += 1
+    for field, text in enumerate(fields):
+      grams = set()
+      for w in words(text):
+        grams |= trigrams(w)
+      for g in grams:
+        self.postings[g].append((document, field))
+    self.keys.append((fields[0] or "").lower().replace(" ", ""))
+    return document
+
+  def termScores(self, term):
+    """Return the score of a term by document, for the documents it matches"""
+    grams = trigrams(term)
+    counts = defaultdict(int)
+    for g in grams:
+      for posting in self.postings.get(g, ()):
+        counts[posting] += 1
+
+    scores = {}
+    for (document, field), count in counts.items():
+      similarity = count/len(grams)
+      if similarity < self.MIN_SIMILARITY:
+        continue
+      score = similarity*self.fieldWeights[field]
+      if score > scores.get(document, 0.0):
+        scores[document] = score
+    # a substring of a name matches even across words
+    for document, key in enumerate(self.keys):
+      if term in key:
+        scores[document] = scores.get(document, 0.0) + self.SUBSTRING_BONUS
+    return scores
+
+  def search(self, query):
+    """Return the (document, score) matching all the terms of the query,
+    best first. An empty query matches all the documents with a score
+    of 0, in the order they were added."""
+    terms = [t.lower() for t in query.split()]
+    if not terms:
+      return [(document, 0.0) for document in range(self.documentCount)]
+
+    total = None
+    for term in terms:
+      scores = self.termScores(term)
+      if total is None:
+        total = scores
+      else:
+        total = {d: s+scores[d] for d, s in total.items() if d in scores}
+      if not total:
+        return []
+    return sorted(total.items(), key=lambda item: (-item[1], item[0]))
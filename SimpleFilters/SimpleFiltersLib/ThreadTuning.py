@@ -0,0 +1,117 @@
+import json
+import os
+import threading
+
+#
+# Tuning of the number of threads of the filters
+#
+# The throughput of a filter, in voxels per second, depends on the
+# number of threads in a way which differs between filters and image
+# sizes: memory bound filters stop scaling after a few threads and small
+# images pay the cost of starting them. A ThreadTuner learns, for each
+# filter and bucket of image size, the number of threads giving the best
+# throughput from the execution time of the runs.
+#
+
+# number of throughput samples kept by filter, size bucket and thread count
+MAX_SAMPLES = 5
+
+
+def sizeBucket(numberOfPixels):
+  """Return the bucket of an image size, the sizes of a bucket are
+  within a factor of 4"""
+  return max(0, int(numberOfPixels).bit_length()-1) // 2
+
+
+def candidateThreadCounts(maxThreads):
+  """Return the thread counts tried by the tuner: the powers of two below
+  maxThreads, and maxThreads"""
+  counts = []
+  n = 1
+  while n < maxThreads:
+    counts.append(n)
+    n *= 2
+  counts.append(max(1, maxThreads))
+  return counts
+
+
+def _median(values):
+  values = sorted(values)
+  n = len(values)
+  return values[n//2] if n % 2 else (values[n//2-1]+values[n//2])/2.0
+
+
+class ThreadTuner:
+  """Number of threads giving the best throughput by filter and image
+  size, learned from the runs and saved in a json file.
+
+  Until each candidate thread count has been run once for a filter and
+  size bucket, the candidates are tried from the largest down, then the
+  count with the best median throughput is chosen.
+  """
+
+  def __init__(self, fileName=None):
+    self.fileName = fileName
+    # filter name -> size bucket -> thread count -> throughput samples,
+    # the keys are strings as in the json file
+    self.samples = {}
+    self._lock = threading.Lock()
+    self.load()
+
+  def load(self):
+    if not self.fileName or not os.path.exists(self.fileName):
+      return
+    try:
+      with open(self.fileName) as fp:
+        samples = json.load(fp)
+    except (OSError, ValueError):
+      return
+    if isinstance(samples, dict):
+      with self._lock:
+        self.samples = samples
+
+  def save(self):
+    if not self.fileName:
+      return
+    with self._lock:
+      data = json.dumps(self.samples)
+    try:
+      os.makedirs(os.path.dirname(self.fileName), exist_ok=True)
+      with open(self.fileName, "w") as fp:
+        fp.write(data)
+    except OSError as e:
+      import sys
+      sys.stderr.write(f"Cannot save the thread tuning to {self.fileName}: {e}\n")
+
+  def clear(self):
+    with self._lock:
+      self.samples = {}
+    self.save()
+
+  def record(self, filterName, numberOfPixels, numberOfThreads, seconds):
+    """Add the execution time of a run of a filter on numberOfPixels
+    voxels with numberOfThreads threads"""
+    if seconds <= 0 or numberOfPixels <= 0 or not numberOfThreads:
+      return
+    with self._lock:
+      bucket = self.samples.setdefault(filterName, {}).setdefault(str(sizeBucket(numberOfPixels)), {})
+      throughputs = bucket.setdefault(str(int(numberOfThreads)), [])
+      throughputs.append(numberOfPixels/seconds)
+      del throughputs[:-MAX_SAMPLES]
+
+  def throughputs(self, filterName, numberOfPixels):
+    """Return the median throughput by thread count of a filter for the
+    size bucket of numberOfPixels"""
+    with self._lock:
+      bucket = self.samples.get(filterName, {}).get(str(sizeBucket(numberOfPixels)), {})
+      return {int(n): _median(t) for n, t in bucket.items() if t}
+
+  def choose(self, filterName, numberOfPixels, maxThreads):
+    """Return the number of threads, up to maxThreads, to run a filter
+    on numberOfPixels voxels with"""
+    throughputs = self.throughputs(filterName, numberOfPixels)
+    candidates = candidateThreadCounts(maxThreads)
+    for n in reversed(candidates):
+      if n not in throughputs:
+        return n
+    return max(candidates, key=lambda n: throughputs[n])
@@ -0,0 +1,289 @@
+import os
+import tempfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import numpy as np
+import SimpleITK as sitk
+
+from SimpleFiltersLib import Regions
+from SimpleFiltersLib.FilterBinding import cloneFilter
+
+#
+# Tiled execution
+#
+# A filter whose output at a voxel only depends on the inputs in a
+# neighbourhood of that voxel is run block by block. Each block is
+# read with a halo of the size of the neighbourhood, filtered, trimmed
+# back to the block and written into the output, which can be backed by
+# a temporary file. Only the blocks in progress are in memory, besides
+# the inputs when they are images and not files.
+#
+
+# voxels of a block along each axis, before the halo is added
+DEFAULT_BLOCK_SIZE = (256, 256, 128)
+
+
+class TilingError(ValueError):
+  """Raised for a filter which cannot be run block by block"""
+
+
+# The stitched output of a tiled run. image is a view of buffer, which
+# does not keep it alive: buffer must be referenced as long as image is
+# used. Where SimpleITK cannot wrap an array image is a copy of buffer,
+# see Regions.imageFromArray.
+TiledImage = namedtuple("TiledImage", ["image", "buffer"])
+
+
+# Filters whose output at a voxel depends on the inputs at that voxel only
+POINTWISE_FILTERS = frozenset([
+  "AbsImageFilter", "AbsoluteValueDifferenceImageFilter", "AcosImageFilter",
+  "AddImageFilter", "AndImageFilter", "AsinImageFilter", "Atan2ImageFilter",
+  "AtanImageFilter", "BinaryThresholdImageFilter", "BitwiseNotImageFilter",
+  "BoundedReciprocalImageFilter", "CastImageFilter", "ChangeLabelImageFilter",
+  "ClampImageFilter", "ComplexToImaginaryImageFilter", "ComplexToModulusImageFilter",
+  "ComplexToPhaseImageFilter", "ComplexToRealImageFilter", "ComposeImageFilter",
+  "CosImageFilter", "DivideFloorImageFilter", "DivideImageFilter",
+  "DivideRealImageFilter", "EqualImageFilter", "ExpImageFilter",
+  "ExpNegativeImageFilter", "GreaterEqualImageFilter", "GreaterImageFilter",
+  "IntensityWindowingImageFilter", "InvertIntensityImageFilter",
+  "LessEqualImageFilter", "LessImageFilter", "Log10ImageFilter", "LogImageFilter",
+  "MaskImageFilter", "MaskNegatedImageFilter", "MaximumImageFilter",
+  "MinimumImageFilter", "ModulusImageFilter", "MultiplyImageFilter",
+  "NaryAddImageFilter", "NaryMaximumImageFilter", "NotEqualImageFilter",
+  "NotImageFilter", "OrImageFilter", "PowImageFilter", "RoundImageFilter",
+  "ShiftScaleImageFilter", "SigmoidImageFilter", "SinImageFilter",
+  "SqrtImageFilter", "SquareImageFilter", "SquaredDifferenceImageFilter",
+  "SubtractImageFilter", "TanImageFilter", "ThresholdImageFilter",
+  "UnaryMinusImageFilter", "VectorIndexSelectionCastImageFilter",
+  "VectorMagnitudeImageFilter", "XorImageFilter",
+  ])
+
+# Filters with a bounded neighbourhood. The halo is scale times the
+# margin estimated from the parameters (Regions.filterMargin) plus
+# extra voxels for the fixed size stencils, as finite differences.
+# Openings, closings and top hats apply the structuring element twice.
+#
+# The recursive Gaussians, and UnsharpMask which smooths with one, have
+# an infinite impulse response. Their halo is twice the margin, that is
+# 2*GAUSSIAN_EXTENT sigmas, where the response and the effect of the
+# block border have decayed below the float precision: their tiled
+# output is close to, but not bitwise, the one on the whole volume.
+# The anisotropic diffusion filters scale their conductance by the mean
+# gradient of the whole image, and LaplacianSharpening rescales its
+# output to the intensity range of the whole image, they are not local
+# and cannot be tiled.
+NEIGHBOURHOOD_FILTERS = {
+  "BilateralImageFilter": (1, 0),
+  "BinaryDilateImageFilter": (1, 0),
+  "BinaryErodeImageFilter": (1, 0),
+  "BinaryMedianImageFilter": (1, 0),
+  "BinaryMorphologicalClosingImageFilter": (2, 0),
+  "BinaryMorphologicalOpeningImageFilter": (2, 0),
+  "BinomialBlurImageFilter": (1, 0),
+  "BlackTopHatImageFilter": (2, 0),
+  "BoxMeanImageFilter": (1, 0),
+  "BoxSigmaImageFilter": (1, 0),
+  "CurvatureFlowImageFilter": (1, 1),
+  "DerivativeImageFilter": (1, 2),
+  "DiscreteGaussianImageFilter": (1, 0),
+  "GradientImageFilter": (1, 1),
+  "GradientMagnitudeImageFilter": (1, 1),
+  "GradientMagnitudeRecursiveGaussianImageFilter": (2, 1),
+  "GradientRecursiveGaussianImageFilter": (2, 1),
+  "GrayscaleDilateImageFilter": (1, 0),
+  "GrayscaleErodeImageFilter": (1, 0),
+  "GrayscaleMorphologicalClosingImageFilter": (2, 0),
+  "GrayscaleMorphologicalOpeningImageFilter": (2, 0),
+  "HessianRecursiveGaussianImageFilter": (2, 2),
+  "LaplacianImageFilter": (1, 1),
+  "LaplacianRecursiveGaussianImageFilter": (2, 2),
+  "MeanImageFilter": (1, 0),
+  "MedianImageFilter": (1, 0),
+  "MinMaxCurvatureFlowImageFilter": (2, 1),
+  "MorphologicalGradientImageFilter": (1, 0),
+  "NoiseImageFilter": (1, 0),
+  "RecursiveGaussianImageFilter": (2, 0),
+  "SmoothingRecursiveGaussianImageFilter": (2, 0),
+  "SobelEdgeDetectionImageFilter": (1, 1),
+  "UnsharpMaskImageFilter": (2, 0),
+  "WhiteTopHatImageFilter": (2, 0),
+  "ZeroCrossingBasedEdgeDetectionImageFilter": (1, 2),
+  "ZeroCrossingImageFilter": (1, 1),
+  }
+
+
+def tilingMargin(sitkFilter, spacing):
+  """Return the halo, in voxels by axis, a block is read with to run the
+  filter block by block. Raises a TilingError for a filter which is not
+  known to be local in space, its result would differ from a run on the
+  whole volume."""
+  name = sitkFilter.__class__.__name__
+  if name in POINTWISE_FILTERS:
+    return [0]*len(spacing)
+  if name in NEIGHBOURHOOD_FILTERS:
+    scale, extra = NEIGHBOURHOOD_FILTERS[name]
+    return [scale*m+extra for m in Regions.filterMargin(sitkFilter, spacing)]
+  raise TilingError(f"{sitkFilter.GetName()} is not known to be local in space, it cannot be run block by block.")
+
+
+def blockRegions(region, blockSize):
+  """Return the blocks, as (index, size) regions, covering a region"""
+  index, size = region
+  dimension = len(size)
+  blockSize = [int(b) for b in (list(blockSize) + [blockSize[-1]]*dimension)[:dimension]]
+  counts = [-(-int(s)//b) for s, b in zip(size, blockSize)]
+
+  blocks = []
+  for n in np.ndindex(*reversed(counts)):
+    n = list(reversed(n))
+    lower = [int(i)+k*b for i, k, b in zip(index, n, blockSize)]
+    upper = [min(l+b, int(i)+int(s)) for l, b, i, s in zip(lower, blockSize, index, size)]
+    blocks.append((lower, [u-l for l, u in zip(lower, upper)]))
+  return blocks
+
+
+class ImageSource:
+  """Blocks of an image in memory"""
+
+  def __init__(self, img):
+    self.image = img
+    self.pixelID = img.GetPixelID()
+    self.size = list(img.GetSize())
+    self.spacing = list(img.GetSpacing())
+    self.origin = list(img.GetOrigin())
+    self.direction = list(img.GetDirection())
+
+  def read(self, region):
+    return Regions.cropImage(self.image, region)
+
+
+class FileSource:
+  """Blocks of an image file. Only the block is read from formats which
+  support streaming, as MetaImage and NRRD, the others are read whole
+  for each block."""
+
+  def __init__(self, fileName):
+    self.fileName = fileName
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(fileName)
+    reader.ReadImageInformation()
+    self.pixelID = reader.GetPixelID()
+    self.size = list(reader.GetSize())
+    self.spacing = list(reader.GetSpacing())
+    self.origin = list(reader.GetOrigin())
+    self.direction = list(reader.GetDirection())
+
+  def read(self, region):
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(self.fileName)
+    reader.SetExtractIndex([int(i) for i in region[0]])
+    reader.SetExtractSize([int(s) for s in region[1]])
+    return reader.Execute()
+
+
+def allocateOutput(shape, dtype, directory=None):
+  """Return a zero filled array, backed by an anonymous temporary file
+  in directory, or in memory when directory is None"""
+  if directory is None:
+    return np.zeros(shape, dtype)
+  os.makedirs(directory, exist_ok=True)
+  # the mapping keeps the file alive, it is deleted once unmapped
+  with tempfile.TemporaryFile(dir=directory) as fp:
+    return np.memmap(fp, dtype=dtype, mode='w+', shape=shape)
+
+
+def executeTiled(sitkFilter, inputs, region=None, fullSizeOutput=False, blockSize=None,
+                 castPixelIDs=None, numberOfWorkers=None, numberOfThreads=None,
+                 outputDirectory=None, progressCallback=None, abortCallback=None):
+  """Run a filter block by block and return the stitched result as a
+  TiledImage.
+
+  inputs are SimpleITK images, ImageSource or FileSource. The blocks
+  cover the region (index, size) of the first input, by default all of
+  it. The result has the size of the region, or of the first input when
+  fullSizeOutput is set, zero outside the region. Its voxels are in a
+  temporary file of outputDirectory when given.
+
+  The blocks are processed by numberOfWorkers threads, by default one by
+  thread of the run. The run uses numberOfThreads threads, by default
+  one by core, they are split between the workers with
+  SetNumberOfThreads. The inputs are cast to castPixelIDs, as in SimpleFiltersLogic.
+  progressCallback is called with the fraction of the blocks done, and
+  None is returned as soon as abortCallback returns True.
+  """
+  sources = [s if hasattr(s, "read") else ImageSource(s) for s in inputs]
+  reference = sources[0]
+  imageSize = reference.size
+  dimension = len(imageSize)
+  margin = tilingMargin(sitkFilter, reference.spacing)
+
+  if region is None:
+    region = ([0]*dimension, list(imageSize))
+  blocks = blockRegions(region, blockSize or DEFAULT_BLOCK_SIZE)
+
+  numberOfThreads = numberOfThreads or os.cpu_count() or 1
+  numberOfWorkers = max(1, min(numberOfWorkers or numberOfThreads, len(blocks)))
+  threadsPerBlock = max(1, numberOfThreads // numberOfWorkers)
+
+  def processBlock(block):
+    if abortCallback and abortCallback():
+      return None
+    processedRegion = Regions.padRegion(block[0], block[1], margin, imageSize)
+    images = [s.read(processedRegion) for s in sources]
+    if castPixelIDs:
+      images = [img if pixelID is None else sitk.Cast(img, pixelID)
+                for img, pixelID in zip(images, castPixelIDs)]
+    blockFilter = cloneFilter(sitkFilter)
+    if hasattr(blockFilter, "SetNumberOfThreads"):
+      blockFilter.SetNumberOfThreads(threadsPerBlock)
+    result = blockFilter.Execute(*images)
+    if list(result.GetSize()) != list(processedRegion[1]):
+      raise TilingError(f"{sitkFilter.GetName()} changes the size of the image, it cannot be run block by block.")
+    return Regions.trimImage(result, processedRegion, block)
+
+  # the pixel type of the output is known from the first block
+  first = processBlock(blocks[0])
+  if first is None:
+    return None
+  components = first.GetNumberOfComponentsPerPixel()
+  outputIndex = [0]*dimension if fullSizeOutput else list(region[0])
+  outputSize = list(imageSize) if fullSizeOutput else list(region[1])
+  shape = tuple(reversed(outputSize)) + ((components,) if components > 1 else ())
+  output = allocateOutput(shape, sitk.GetArrayViewFromImage(first).dtype, outputDirectory)
+
+  def store(block, img):
+    lower = [b-o for b, o in zip(block[0], outputIndex)]
+    slices = tuple(slice(l, l+s) for l, s in reversed(list(zip(lower, block[1]))))
+    output[slices] = sitk.GetArrayViewFromImage(img)
+
+  store(blocks[0], first)
+  del first
+  done = 1
+  if progressCallback:
+    progressCallback(done/len(blocks))
+
+  with ThreadPoolExecutor(max_workers=numberOfWorkers) as executor:
+    futures = {executor.submit(processBlock, block): block for block in blocks[1:]}
+    try:
+      for future in as_completed(futures):
+        block = futures.pop(future)
+        img = future.result()
+        if img is None or (abortCallback and abortCallback()):
+          return None
+        store(block, img)
+        done += 1
+        if progressCallback:
+          progressCallback(done/len(blocks))
+    finally:
+      # the blocks not started yet are dropped on abort or error
+      for pending in futures:
+        pending.cancel()
+
+  img = Regions.imageFromArray(output, isVector=components > 1)
+  img.SetSpacing(reference.spacing)
+  img.SetDirection(reference.direction)
+  direction = np.array(reference.direction).reshape(dimension, dimension)
+  origin = np.array(reference.origin) + direction @ (np.array(outputIndex)*np.array(reference.spacing))
+  img.SetOrigin(origin.tolist())
+  return TiledImage(img, output)
@@ -0,0 +1,295 @@
+import numpy as np
+import vtk
+import vtk.util.numpy_support
+import SimpleITK as sitk
+
+from SimpleFiltersLib import Regions
+from SimpleFiltersLib.ResultCache import imageSizeInBytes
+
+#
+# VolumeBridge
+#
+
+class VolumeBridge:
+  """Exchange voxel buffers between volume nodes and SimpleITK images
+  without copying them.
+
+  Inputs are wrapped as SimpleITK images which are views of the
+  vtkImageData scalar array of the volume node, and results are adopted
+  as the scalar array of the output node. The geometry (origin, spacing
+  and directions) is carried over as meta-data, converted between RAS
+  and LPS. When the buffer cannot be shared, because of the pixel type,
+  the number of components or the memory layout, the voxels are copied
+  with sitkUtils instead.
+
+  A result which is copied is written into the existing scalar array of
+  the output node when it has the size, type and number of components
+  of the result, so repeated runs into the same node do not allocate a
+  new buffer, and the node is only marked modified. An array adopted
+  from an earlier result is only written over when no cached image
+  still shares it.
+
+  The buffers of the input views are only valid while the bridge holds
+  a reference to them, call release() once the images are no longer
+  used. copiedBytes counts the bytes of the voxels which were copied.
+
+  The image owning an adopted buffer is kept in _adoptedImages, by
+  address of the vtk array, until the array is deleted. The Python
+  wrapper of the array may be collected before, while the node still
+  uses the array.
+
+  The voxels of the nodes are accessed through vtk, slicer and sitkUtils
+  are only imported to copy the voxels of images which cannot be shared
+  and to look up nodes in the scene.
+  """
+
+  # numpy types which SimpleITK can wrap
+  SHARED_DTYPES = (np.int8, np.uint8, np.int16, np.uint16, np.int32, np.uint32,
+                   np.int64, np.uint64, np.float32, np.float64)
+
+  # scalar SimpleITK pixel types which vtk can adopt
+  SHARED_PIXEL_IDS = (sitk.sitkInt8, sitk.sitkUInt8, sitk.sitkInt16, sitk.sitkUInt16,
+                      sitk.sitkInt32, sitk.sitkUInt32, sitk.sitkInt64, sitk.sitkUInt64,
+                      sitk.sitkFloat32, sitk.sitkFloat64)
+
+  # address of an adopted vtk array -> (image, buffer) owning its voxels
+  _adoptedImages = {}
+
+  def __init__(self, allowSharing=True, reuseBuffers=True):
+    self.allowSharing = allowSharing
+    self.reuseBuffers = reuseBuffers
+    self._references = []
+    self.copiedBytes = 0
+
+  def release(self):
+    """Release the input buffers referenced by the views."""
+    self._references = []
+
+  def pull(self, volumeNode):
+    """Return a SimpleITK image of the voxels of volumeNode, sharing
+    the buffer of the node when possible."""
+    arr = self._sharedInputArray(volumeNode)
+    if arr is None:
+      import sitkUtils
+      img = sitkUtils.PullVolumeFromSlicer(volumeNode)
+      self.copiedBytes += imageSizeInBytes(img)
+      return img
+
+    img = sitk.GetImageViewFromArray(arr, isVector=arr.ndim == 4)
+    self.copyGeometryFromNode(img, volumeNode)
+
+    # Keep the vtk array and the image data alive while the view is used
+    self._references.append((volumeNode.GetImageData(), arr))
+    return img
+
+  def push(self, img, volumeNode, share=True, buffer=None, isShared=None):
+    """Set img as the voxels of volumeNode, adopting the buffer of the
+    image when possible and share is set. Otherwise the voxels are
+    copied, into the buffer of the node when it matches. Returns the vtk
+    array sharing the buffer of img, or None if the voxels were
+    copied.
+
+    buffer is the array img is a view of, when the image does not own
+    its voxels, as the output of Tiling.executeTiled. It is kept alive
+    with the image by the vtk array.
+
+    isShared tells whether a vtk array adopted from an earlier result
+    still shares its buffer with another image, as ResultCache.isShared.
+    Such arrays are not copied into when it is not given."""
+    if not (share and self._canAdopt(img)) and self._copyIntoNode(img, volumeNode, isShared):
+      return None
+    if not self._canAdopt(img):
+      import sitkUtils
+      sitkUtils.PushVolumeToSlicer(img, volumeNode)
+      self.copiedBytes += imageSizeInBytes(img)
+      return None
+    if not share:
+      img = sitk.Image(img)
+      img.MakeUnique()
+      self.copiedBytes += imageSizeInBytes(img)
+
+    arr = sitk.GetArrayViewFromImage(img)
+    vtkArray = vtk.util.numpy_support.numpy_to_vtk(arr.reshape(-1), deep=False)
+    # The numpy view does not own the image buffer, the image is kept
+    # alive as long as the vtk array exists.
+    self._adopt(vtkArray, img, buffer if share else None)
+
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(img.GetSize())
+    imageData.GetPointData().SetScalars(vtkArray)
+
+    wasModifying = volumeNode.StartModify()
+    self.copyGeometryToNode(img, volumeNode)
+    volumeNode.SetAndObserveImageData(imageData)
+    if volumeNode.GetDisplayNode() is None:
+      volumeNode.CreateDefaultDisplayNodes()
+    volumeNode.EndModify(wasModifying)
+    return vtkArray
+
+  @staticmethod
+  def copyGeometryFromNode(img, volumeNode):
+    """Set the origin, spacing and direction of img from volumeNode."""
+    directions = vtk.vtkMatrix4x4()
+    volumeNode.GetIJKToRASDirectionMatrix(directions)
+    origin = volumeNode.GetOrigin()
+
+    # RAS to LPS
+    img.SetOrigin((-origin[0], -origin[1], origin[2]))
+    img.SetSpacing(volumeNode.GetSpacing())
+    img.SetDirection([(-1 if r < 2 else 1) * directions.GetElement(r, c)
+                      for r in range(3) for c in range(3)])
+
+  @staticmethod
+  def copyGeometryToNode(img, volumeNode):
+    """Set the origin, spacing and directions of volumeNode from img."""
+    origin = img.GetOrigin()
+    direction = img.GetDirection()
+
+    directions = vtk.vtkMatrix4x4()
+    for r in range(3):
+      for c in range(3):
+        # LPS to RAS
+        directions.SetElement(r, c, (-1 if r < 2 else 1) * direction[3*r+c])
+
+    volumeNode.SetOrigin(-origin[0], -origin[1], origin[2])
+    volumeNode.SetSpacing(img.GetSpacing())
+    volumeNode.SetIJKToRASDirectionMatrix(directions)
+
+  @staticmethod
+  def nodeScalars(nodeID):
+    """Return the scalar array of the volume node of the scene with this
+    ID, or None"""
+    import slicer
+    node = slicer.mrmlScene.GetNodeByID(nodeID)
+    imageData = node.GetImageData() if node is not None else None
+    if imageData is None:
+      return None
+    return imageData.GetPointData().GetScalars()
+
+  @staticmethod
+  def arrayFromNode(volumeNode):
+    """Return the numpy view of the scalars of volumeNode, indexed by
+    k, j, i and the component when there are several, as
+    slicer.util.arrayFromVolume"""
+    imageData = volumeNode.GetImageData()
+    scalars = imageData.GetPointData().GetScalars()
+    shape = tuple(reversed(imageData.GetDimensions()))
+    if scalars.GetNumberOfComponents() > 1:
+      shape += (scalars.GetNumberOfComponents(),)
+    return vtk.util.numpy_support.vtk_to_numpy(scalars).reshape(shape)
+
+  @staticmethod
+  def arrayModified(volumeNode):
+    """Signal that the voxels of volumeNode were written, as
+    slicer.util.arrayFromVolumeModified"""
+    scalars = volumeNode.GetImageData().GetPointData().GetScalars()
+    if scalars is not None:
+      scalars.Modified()
+    volumeNode.Modified()
+
+  @staticmethod
+  def rasToIndex(volumeNode, rasPoints):
+    """Return the indices of the voxels of volumeNode nearest to the
+    given RAS points.
+
+    The points are transformed with the RAS to IJK matrix of the node,
+    the voxels are not accessed.
+    """
+    rasToIJK = vtk.vtkMatrix4x4()
+    volumeNode.GetRASToIJKMatrix(rasToIJK)
+    m = np.array([[rasToIJK.GetElement(r, c) for c in range(4)] for r in range(3)])
+
+    points = np.asarray(rasPoints, dtype=float).reshape(-1, 3)
+    ijk = points @ m[:, :3].T + m[:, 3]
+
+    # round half up, like Image.TransformPhysicalPointToIndex
+    return np.floor(ijk + 0.5).astype(int).tolist()
+
+  @staticmethod
+  def rasBoundsToRegion(volumeNode, boundedNode):
+    """Return the region (index, size) of volumeNode covering the RAS
+    bounds of a displayable node, as a markups ROI, or None if they do
+    not intersect. The region of a rotated ROI covers its bounding box.
+    """
+    bounds = [0.0]*6
+    boundedNode.GetRASBounds(bounds)
+    if bounds[0] > bounds[1]:
+      # the node is empty
+      return None
+    corners = [[bounds[i], bounds[2+j], bounds[4+k]] for i in (0, 1) for j in (0, 1) for k in (0, 1)]
+    indices = np.array(VolumeBridge.rasToIndex(volumeNode, corners))
+    lower = indices.min(axis=0)
+    upper = indices.max(axis=0) + 1
+
+    dimensions = volumeNode.GetImageData().GetDimensions()
+    lower = np.maximum(lower, 0)
+    upper = np.minimum(upper, dimensions)
+    if np.any(upper <= lower):
+      return None
+    return lower.tolist(), (upper - lower).tolist()
+
+  def _sharedInputArray(self, volumeNode):
+    """Return the numpy view of the node's scalars if a SimpleITK image
+    can be wrapped around it, otherwise None."""
+    if not self.allowSharing or not Regions.canViewArrays():
+      return None
+    imageData = volumeNode.GetImageData()
+    if imageData is None or imageData.GetPointData().GetScalars() is None:
+      return None
+
+    arr = self.arrayFromNode(volumeNode)
+    if arr.dtype.type not in self.SHARED_DTYPES or not arr.flags.c_contiguous:
+      return None
+    return arr
+
+  def canAdopt(self, pixelID, dimension=3):
+    """True if push adopts the buffer of an image of this pixel type and
+    dimension instead of copying it."""
+    if not self.allowSharing or dimension != 3:
+      return False
+    # Vector images may require a vector volume node, they are copied
+    return pixelID in self.SHARED_PIXEL_IDS
+
+  def _canAdopt(self, img):
+    return self.canAdopt(img.GetPixelID(), img.GetDimension())
+
+  @classmethod
+  def _adopt(cls, vtkArray, img, buffer=None):
+    key = vtkArray.__this__
+    cls._adoptedImages[key] = (img, buffer)
+    # the observer does not reference the array, which would keep it alive
+    vtkArray.AddObserver(vtk.vtkCommand.DeleteEvent, lambda caller, event: cls._adoptedImages.pop(key, None))
+
+  @classmethod
+  def isAdopted(cls, vtkArray):
+    """True if vtkArray uses the buffer of an image pushed by a bridge"""
+    return vtkArray.__this__ in cls._adoptedImages
+
+  def _copyIntoNode(self, img, volumeNode, isShared=None):
+    """Copy the voxels of img into the scalar array of volumeNode if it
+    has the size, type and number of components of img, and mark the
+    node modified once. Returns False if the array does not match, or
+    is adopted from an image which isShared."""
+    imageData = volumeNode.GetImageData()
+    if not self.reuseBuffers or img.GetDimension() != 3 or imageData is None:
+      return False
+    scalars = imageData.GetPointData().GetScalars()
+    if scalars is None:
+      return False
+    if self.isAdopted(scalars) and (isShared is None or isShared(scalars)):
+      return False
+    if (list(imageData.GetDimensions()) != list(img.GetSize())
+        or scalars.GetNumberOfComponents() != img.GetNumberOfComponentsPerPixel()):
+      return False
+    arr = self.arrayFromNode(volumeNode)
+    voxels = sitk.GetArrayViewFromImage(img)
+    if arr.dtype != voxels.dtype or arr.size != voxels.size or not arr.flags.c_contiguous:
+      return False
+
+    wasModifying = volumeNode.StartModify()
+    self.copyGeometryToNode(img, volumeNode)
+    np.copyto(arr, voxels.reshape(arr.shape))
+    self.arrayModified(volumeNode)
+    volumeNode.EndModify(wasModifying)
+    self.copiedBytes += imageSizeInBytes(img)
+    return True
@@ -0,0 +1,3 @@
+#
+# Helper modules of the SimpleFilters module
+#
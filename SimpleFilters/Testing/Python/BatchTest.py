@@ -0,0 +1,151 @@
+import argparse
+import contextlib
+import io
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+
+import SimpleFiltersTesting  # puts SimpleFiltersLib on the path
+from SimpleFiltersLib import Batch
+
+
+class BatchTest(unittest.TestCase):
+  """Tests of the headless batch processing of volumes"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory, ignore_errors=True)
+
+  def path(self, name):
+    return os.path.join(self.directory, name)
+
+  def writeImage(self, name, seed=1, pixelID=sitk.sitkFloat32):
+    img = sitk.AdditiveGaussianNoise(sitk.Image([24, 20, 16], sitk.sitkFloat32), 20.0, 50.0, seed)
+    img = sitk.Cast(img, pixelID)
+    sitk.WriteImage(img, self.path(name))
+    return img
+
+  def assertSameImage(self, fileName, expected):
+    result = sitk.ReadImage(self.path(fileName))
+    self.assertEqual(result.GetPixelID(), expected.GetPixelID())
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(result), sitk.GetArrayFromImage(expected))
+
+  def test_filterClass(self):
+    self.assertIs(Batch.filterClass("MedianImageFilter"), sitk.MedianImageFilter)
+    self.assertIs(Batch.filterClass("Median"), sitk.MedianImageFilter)
+    with self.assertRaises(ValueError):
+      Batch.filterClass("NoSuch")
+    # functions are not filters
+    with self.assertRaises(ValueError):
+      Batch.filterClass("ReadImage")
+
+  def test_createFilter(self):
+    median = Batch.createFilter("Median", {"Radius": [2, 1, 3]}, numberOfThreads=2)
+    self.assertEqual(median.GetRadius(), (2, 1, 3))
+    self.assertEqual(median.GetNumberOfThreads(), 2)
+    with self.assertRaises(ValueError):
+      Batch.createFilter("Median", {"NoSuchParameter": 1})
+
+  def test_parameterValue(self):
+    morphology = sitk.BinaryDilateImageFilter()
+    self.assertEqual(Batch.parameterValue(morphology, "sitkCross"), sitk.sitkCross)
+    connected = sitk.ConnectedThresholdImageFilter()
+    self.assertEqual(Batch.parameterValue(connected, "FullConnectivity"), connected.FullConnectivity)
+    self.assertEqual(Batch.parameterValue(morphology, "text"), "text")
+    self.assertEqual(Batch.parameterValue(morphology, 3), 3)
+
+  def test_readCohort(self):
+    with open(self.path("cohort.csv"), "w") as fp:
+      fp.write("# inputs, output\n"
+               "a.mha, b.mha, out1.mha\n"
+               "\n"
+               "c.mha,out2.mha\n")
+    self.assertEqual(Batch.readCohort(self.path("cohort.csv")),
+                     [Batch.BatchCase(["a.mha", "b.mha"], "out1.mha"), Batch.BatchCase(["c.mha"], "out2.mha")])
+    with open(self.path("invalid.csv"), "w") as fp:
+      fp.write("a.mha\n")
+    with self.assertRaises(ValueError):
+      Batch.readCohort(self.path("invalid.csv"))
+
+  def test_readParameters(self):
+    args = argparse.Namespace(parameters='{"Radius": [1, 1, 1], "Mode": "x"}', set=["Radius=[2,2,2]", "Name=text"])
+    self.assertEqual(Batch.readParameters(args), {"Radius": [2, 2, 2], "Mode": "x", "Name": "text"})
+    args = argparse.Namespace(parameters=None, set=["Radius"])
+    with self.assertRaises(ValueError):
+      Batch.readParameters(args)
+
+  def test_processFiles(self):
+    img = self.writeImage("in.mha")
+    Batch.processFiles("Median", {"Radius": [1, 1, 1]}, [self.path("in.mha")], self.path("out.mha"))
+    self.assertSameImage("out.mha", sitk.Median(img, [1, 1, 1]))
+
+  def test_processFilesCast(self):
+    # the inputs are cast to a pixel type supported by the filter
+    img = self.writeImage("in.mha", pixelID=sitk.sitkInt16)
+    Batch.processFiles("Derivative", {}, [self.path("in.mha")], self.path("out.mha"))
+    self.assertSameImage("out.mha", sitk.Derivative(sitk.Cast(img, sitk.sitkFloat32)))
+
+  def test_processFilesTiled(self):
+    img = self.writeImage("in.mha")
+    Batch.processFiles("Median", {"Radius": [2, 2, 2]}, [self.path("in.mha")], self.path("out.mha"),
+                       numberOfThreads=2, tiled=True)
+    self.assertSameImage("out.mha", sitk.Median(img, [2, 2, 2]))
+
+  def test_runCohort(self):
+    first, second = self.writeImage("a.mha", 1), self.writeImage("b.mha", 2)
+    cases = [([self.path("a.mha"), self.path("b.mha")], self.path("sum.mha")),
+             ([self.path("a.mha"), self.path("missing.mha")], self.path("failed.mha"))]
+    reported = []
+    results = Batch.runCohort("Add", {}, cases, processes=2, callback=reported.append)
+    self.assertEqual(len(results), 2)
+    self.assertEqual(sorted(reported, key=lambda r: r.case.output), sorted(results, key=lambda r: r.case.output))
+
+    byOutput = {os.path.basename(r.case.output): r for r in results}
+    self.assertIsNone(byOutput["sum.mha"].error)
+    self.assertSameImage("sum.mha", sitk.Add(first, second))
+    # a failed case does not stop the others
+    self.assertIsNotNone(byOutput["failed.mha"].error)
+    self.assertFalse(os.path.exists(self.path("failed.mha")))
+
+    # the filter and parameters are checked before the pool starts
+    with self.assertRaises(ValueError):
+      Batch.runCohort("Median", {"NoSuchParameter": 1}, cases)
+
+  def test_main(self):
+    img = self.writeImage("in.mha")
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+      status = Batch.main(["--filter", "Median", "--set", "Radius=[1,1,1]", "--processes", "1",
+                           "--case", self.path("in.mha"), self.path("out.mha")])
+    self.assertEqual(status, 0)
+    self.assertIn("[1/1]", output.getvalue())
+    self.assertSameImage("out.mha", sitk.Median(img, [1, 1, 1]))
+
+    with contextlib.redirect_stderr(io.StringIO()):
+      self.assertEqual(Batch.main(["--filter", "Median", "--processes", "1",
+                                   "--case", self.path("missing.mha"), self.path("out.mha")]), 1)
+      with self.assertRaises(SystemExit):
+        Batch.main(["--filter", "Median"])
+
+  def test_script(self):
+    # run as a script the package is found next to it
+    img = self.writeImage("in.mha")
+    with open(self.path("cohort.csv"), "w") as fp:
+      fp.write(f"{self.path('in.mha')},{self.path('out.mha')}\n")
+    subprocess.run([sys.executable, Batch.__file__, "--filter", "Abs", "--processes", "1",
+                    "--cohort", self.path("cohort.csv")],
+                   check=True, stdout=subprocess.DEVNULL, cwd=self.directory,
+                   env=dict(os.environ, PYTHONPATH=""))
+    self.assertSameImage("out.mha", sitk.Abs(img))
+
+
+if __name__ == '__main__':
+  unittest.main()
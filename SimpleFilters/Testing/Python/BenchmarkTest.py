@@ -0,0 +1,73 @@
+import unittest
+
+import SimpleITK as sitk
+
+import SimpleFiltersTesting  # puts SimpleFiltersLib on the path
+from SimpleFiltersLib import Benchmark
+
+
+class BenchmarkTest(unittest.TestCase):
+  """Tests of the benchmark of the filters driven by the json tests"""
+
+  @staticmethod
+  def result(wall=1.0, status="ok", startRSS=100*2**20, peakRSS=200*2**20, tag="defaults"):
+    return {"filter": "Median", "tag": tag, "pixelType": "Int16", "size": [8, 8, 8],
+            "status": status, "wall": wall, "startRSS": startRSS, "peakRSS": peakRSS}
+
+  def test_settingValue(self):
+    f = sitk.ConnectedThresholdImageFilter()
+    setting = {"parameter": "Connectivity", "value": "itk::simple::${name}::FullConnectivity",
+               "python_value": "SimpleITK.${name}.FullConnectivity"}
+    self.assertEqual(Benchmark.settingValue(f, setting), sitk.ConnectedThresholdImageFilter.FullConnectivity)
+    # without a python value the C++ one is converted
+    del setting["python_value"]
+    self.assertEqual(Benchmark.settingValue(f, setting), sitk.ConnectedThresholdImageFilter.FullConnectivity)
+
+    self.assertEqual(Benchmark.settingValue(f, {"value": "SimpleITK.sitkBall"}), sitk.sitkBall)
+    self.assertEqual(Benchmark.settingValue(f, {"value": "{1,2,3}"}), [1, 2, 3])
+    self.assertEqual(Benchmark.settingValue(f, {"value": ["{1, 2}", "{3, 4}"]}), [[1, 2], [3, 4]])
+    self.assertEqual(Benchmark.settingValue(f, {"value": "true"}), True)
+    self.assertEqual(Benchmark.settingValue(f, {"value": 2.5}), 2.5)
+    # a name of an enumeration of the filter
+    self.assertEqual(Benchmark.settingValue(f, {"value": "FaceConnectivity"}),
+                     sitk.ConnectedThresholdImageFilter.FaceConnectivity)
+    with self.assertRaises(ValueError):
+      Benchmark.settingValue(f, {"value": "SimpleITK.${name}.NoSuchValue"})
+
+  def test_compareStatus(self):
+    baseline = [self.result(), self.result(tag="error", status="error")]
+    results = [self.result(status="error"), self.result(tag="error", status="error")]
+    regressions = Benchmark.compareResults(results, baseline)
+    self.assertEqual(regressions, [Benchmark.Regression(("Median", "defaults", "Int16", (8, 8, 8)), "status", "ok", "error")])
+    # a skipped test is not a regression
+    self.assertEqual(Benchmark.compareResults([self.result(status="skipped")], baseline), [])
+
+  def test_compareWall(self):
+    baseline = [self.result(wall=1.0)]
+    self.assertEqual(Benchmark.compareResults([self.result(wall=1.2)], baseline), [])
+    regressions = Benchmark.compareResults([self.result(wall=1.5)], baseline)
+    self.assertEqual([(r.metric, r.baselineValue, r.value) for r in regressions], [("wall", 1.0, 1.5)])
+    # below minimumTime the difference is noise
+    self.assertEqual(Benchmark.compareResults([self.result(wall=0.008)], [self.result(wall=0.004)]), [])
+
+  def test_compareMemory(self):
+    baseline = [self.result()]
+    self.assertEqual(Benchmark.compareResults([self.result(peakRSS=220*2**20)], baseline), [])
+    regressions = Benchmark.compareResults([self.result(peakRSS=300*2**20)], baseline)
+    self.assertEqual([(r.metric, r.baselineValue, r.value) for r in regressions], [("memory", 100*2**20, 200*2**20)])
+    # the memory is not compared when it was not measured
+    self.assertEqual(Benchmark.compareResults([self.result(peakRSS=None)], baseline), [])
+
+  def test_runTest(self):
+    results = Benchmark.runBenchmark([("Median", "defaults")], [[16, 16, 8]], ["UInt8"], isolate=False)
+    self.assertEqual(len(results), 1)
+    result = results[0]
+    self.assertEqual(result["status"], "ok", result.get("error"))
+    self.assertEqual(result["outputSize"], [16, 16, 8])
+    self.assertEqual(list(result["stages"]), ["synthesize", "cast", "execute"])
+    self.assertGreaterEqual(result["wall"], 0.0)
+    self.assertEqual(Benchmark.runTest("NoSuchFilter", "defaults", [8, 8, 8], "UInt8")["status"], "skipped")
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,126 @@
+import unittest
+
+import SimpleITK as sitk
+
+from SimpleFiltersTesting import filterDescription
+from SimpleFiltersLib import FilterBinding
+
+
+class FilterBindingTest(unittest.TestCase):
+  """Tests of the bindings of the filter parameters to the GUI values"""
+
+  def binding(self, name):
+    return FilterBinding.FilterBinding(filterDescription(name))
+
+  def test_scalar(self):
+    binding = self.binding("DiscreteGaussianImageFilter")
+    # the GUI values are floats, or strings from the saved parameters
+    binding.set("MaximumKernelWidth", 16.0)
+    self.assertEqual(binding.filter.GetMaximumKernelWidth(), 16)
+    self.assertIsInstance(binding.get("MaximumKernelWidth"), int)
+    binding.set("UseImageSpacing", 0)
+    self.assertIs(binding.get("UseImageSpacing"), False)
+
+    binding = self.binding("ConnectedThresholdImageFilter")
+    binding.set("ReplaceValue", "3")
+    self.assertEqual(binding.filter.GetReplaceValue(), 3)
+
+  def test_vector(self):
+    binding = self.binding("DiscreteGaussianImageFilter")
+    binding.set("Variance", ["1", 2, 3.5])
+    self.assertEqual(binding.filter.GetVariance(), (1.0, 2.0, 3.5))
+
+    binding = self.binding("ResampleImageFilter")
+    direction = [0, 1, 0, 1, 0, 0, 0, 0, 1]
+    binding.set("OutputDirection", direction)
+    self.assertEqual(binding.get("OutputDirection"), tuple(float(x) for x in direction))
+
+  def test_boolVector(self):
+    binding = self.binding("FlipImageFilter")
+    binding.set("FlipAxes", [1, 0, 1])
+    self.assertEqual(binding.filter.GetFlipAxes(), (True, False, True))
+    self.assertEqual(binding.get("FlipAxes"), (True, False, True))
+
+  def test_enum(self):
+    binding = self.binding("ConnectedThresholdImageFilter")
+    face, full = binding.enumValues(["FaceConnectivity", "FullConnectivity"])
+    self.assertEqual(face, sitk.ConnectedThresholdImageFilter.FaceConnectivity)
+    binding.set("Connectivity", full)
+    self.assertEqual(binding.filter.GetConnectivity(), sitk.ConnectedThresholdImageFilter.FullConnectivity)
+
+    binding = self.binding("CastImageFilter")
+    binding.set("OutputPixelType", sitk.sitkFloat64)
+    self.assertEqual(binding.get("OutputPixelType"), sitk.sitkFloat64)
+
+    binding = self.binding("ResampleImageFilter")
+    binding.set("Interpolator", sitk.sitkNearestNeighbor)
+    self.assertEqual(binding.get("Interpolator"), sitk.sitkNearestNeighbor)
+
+  def test_enumValues(self):
+    binding = self.binding("ConnectedThresholdImageFilter")
+    # the values of the filter class, then the ones of the module
+    self.assertEqual(binding.enumValues(["FullConnectivity", "sitk.sitkBall", "sitkLinear"]),
+                     [sitk.ConnectedThresholdImageFilter.FullConnectivity, sitk.sitkBall, sitk.sitkLinear])
+    with self.assertRaises(AttributeError):
+      binding.enumValues(["NoSuchValue"])
+
+  def test_pointList(self):
+    binding = self.binding("FastMarchingImageFilter")
+    binding.set("TrialPoints", [[1.0, 2.0, 3.0], ["4", 5, 6]])
+    self.assertEqual([list(pt) for pt in binding.get("TrialPoints")], [[1, 2, 3], [4, 5, 6]])
+
+    # the seeds of the template are bound on demand, without converter
+    binding = self.binding("ConnectedThresholdImageFilter")
+    self.assertNotIn("SeedList", binding.parameters)
+    binding.set("SeedList", [[1, 2, 3]])
+    self.assertIn("SeedList", binding.parameters)
+    self.assertEqual([list(pt) for pt in binding.get("SeedList")], [[1, 2, 3]])
+
+  def test_converter(self):
+    self.assertIs(FilterBinding.converter({"name": "Connectivity", "enum": ["A", "B"]})("B"), "B")
+    self.assertEqual(FilterBinding.converter({"name": "Radius", "type": "unsigned int", "dim_vec": 1})([1.0, 2.0]),
+                     [1, 2])
+    # a dim_vec of 0 is a scalar
+    self.assertEqual(FilterBinding.converter({"name": "Sigma", "type": "double", "dim_vec": 0})("2"), 2.0)
+    self.assertEqual(FilterBinding.converter({"name": "Seeds", "type": "unsigned int", "point_vec": 1})([[1.0, 2.0]]),
+                     [[1, 2]])
+    self.assertEqual(FilterBinding.converter({"name": "Origin", "type": "std::vector<double>"})([1, 2]), [1.0, 2.0])
+    # the types without a converter are passed through
+    value = object()
+    self.assertIs(FilterBinding.converter({"name": "Transform", "type": "Transform"})(value), value)
+
+  def test_parameterBinding(self):
+    values = []
+    binding = FilterBinding.ParameterBinding("Radius", lambda: values[-1], values.append, int)
+    binding.setValue(2.0)
+    self.assertEqual(values, [2])
+    self.assertEqual(binding.get(), 2)
+    binding.set("3")
+    self.assertEqual(values, [2, "3"])
+
+  def test_filterParameterValues(self):
+    median = sitk.MedianImageFilter()
+    median.SetRadius([2, 3, 4])
+    values = FilterBinding.filterParameterValues(median)
+    self.assertEqual(values["Radius"], (2, 3, 4))
+    self.assertNotIn("Name", values)
+    self.assertFalse(any(name.startswith("Global") for name in values))
+    self.assertIs(FilterBinding.parameterNames(sitk.MedianImageFilter),
+                  FilterBinding.parameterNames(sitk.MedianImageFilter))
+
+  def test_cloneFilter(self):
+    binding = self.binding("DiscreteGaussianImageFilter")
+    binding.set("Variance", [1.0, 2.0, 3.0])
+    binding.set("UseImageSpacing", False)
+    clone = FilterBinding.cloneFilter(binding.filter)
+    self.assertIsNot(clone, binding.filter)
+    self.assertEqual(FilterBinding.filterParameterValues(clone), FilterBinding.filterParameterValues(binding.filter))
+
+    # the clone is bound as the filter of a binding
+    cloneBinding = FilterBinding.FilterBinding(filterDescription("DiscreteGaussianImageFilter"), clone)
+    self.assertIs(cloneBinding.filter, clone)
+    self.assertEqual(cloneBinding.get("Variance"), (1.0, 2.0, 3.0))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,276 @@
+import unittest
+from collections import OrderedDict
+from unittest import mock
+
+import numpy as np
+import SimpleITK as sitk
+
+import SimpleFiltersTesting  # puts SimpleFiltersLib on the path
+from SimpleFiltersLib import Fusion
+from SimpleFiltersLib import Regions
+from SimpleFiltersLib.Pipeline import PipelineStep
+
+PIXEL_IDS = [sitk.sitkUInt8, sitk.sitkInt8, sitk.sitkUInt16, sitk.sitkInt16, sitk.sitkUInt32, sitk.sitkInt32,
+             sitk.sitkUInt64, sitk.sitkInt64, sitk.sitkFloat32, sitk.sitkFloat64]
+
+
+def _filter(filterClass, **parameters):
+  def create():
+    f = filterClass()
+    for name, value in parameters.items():
+      getattr(f, "Set"+name)(value)
+    return f
+  return create
+
+
+# filter factories and number of inputs, the second input of Mask is a
+# mask image
+FILTERS = OrderedDict([
+  ("Add", (_filter(sitk.AddImageFilter), 2)),
+  ("Subtract", (_filter(sitk.SubtractImageFilter), 2)),
+  ("Multiply", (_filter(sitk.MultiplyImageFilter), 2)),
+  ("Maximum", (_filter(sitk.MaximumImageFilter), 2)),
+  ("Minimum", (_filter(sitk.MinimumImageFilter), 2)),
+  ("Divide", (_filter(sitk.DivideImageFilter), 2)),
+  ("AbsoluteValueDifference", (_filter(sitk.AbsoluteValueDifferenceImageFilter), 2)),
+  ("SquaredDifference", (_filter(sitk.SquaredDifferenceImageFilter), 2)),
+  ("Equal", (_filter(sitk.EqualImageFilter, ForegroundValue=3), 2)),
+  ("NotEqual", (_filter(sitk.NotEqualImageFilter), 2)),
+  ("Greater", (_filter(sitk.GreaterImageFilter), 2)),
+  ("GreaterEqual", (_filter(sitk.GreaterEqualImageFilter, BackgroundValue=7), 2)),
+  ("Less", (_filter(sitk.LessImageFilter), 2)),
+  ("LessEqual", (_filter(sitk.LessEqualImageFilter), 2)),
+  ("And", (_filter(sitk.AndImageFilter), 2)),
+  ("Or", (_filter(sitk.OrImageFilter), 2)),
+  ("Xor", (_filter(sitk.XorImageFilter), 2)),
+  ("Abs", (_filter(sitk.AbsImageFilter), 1)),
+  ("UnaryMinus", (_filter(sitk.UnaryMinusImageFilter), 1)),
+  ("Sqrt", (_filter(sitk.SqrtImageFilter), 1)),
+  ("Square", (_filter(sitk.SquareImageFilter), 1)),
+  ("Exp", (_filter(sitk.ExpImageFilter), 1)),
+  ("Log", (_filter(sitk.LogImageFilter), 1)),
+  ("Log10", (_filter(sitk.Log10ImageFilter), 1)),
+  ("Sin", (_filter(sitk.SinImageFilter), 1)),
+  ("Cos", (_filter(sitk.CosImageFilter), 1)),
+  ("Tan", (_filter(sitk.TanImageFilter), 1)),
+  ("Atan", (_filter(sitk.AtanImageFilter), 1)),
+  ("Clamp", (_filter(sitk.ClampImageFilter, LowerBound=-20.5, UpperBound=200.0), 1)),
+  ("ClampUInt8", (_filter(sitk.ClampImageFilter, OutputPixelType=sitk.sitkUInt8), 1)),
+  ("Sigmoid", (_filter(sitk.SigmoidImageFilter, Alpha=10.0, Beta=50.0, OutputMinimum=-5.0, OutputMaximum=100.0), 1)),
+  ("Sigmoid2", (_filter(sitk.SigmoidImageFilter, Alpha=-20.0, Beta=10.0, OutputMinimum=2.7, OutputMaximum=99.0), 1)),
+  ("Threshold", (_filter(sitk.ThresholdImageFilter, Lower=-10.5, Upper=1000.0, OutsideValue=9.0), 1)),
+  ("Threshold2", (_filter(sitk.ThresholdImageFilter, Lower=10.7, Upper=100.2, OutsideValue=9.0), 1)),
+  ("BinaryThreshold", (_filter(sitk.BinaryThresholdImageFilter, LowerThreshold=0.0, UpperThreshold=127.5,
+                                InsideValue=2, OutsideValue=5), 1)),
+  ("ShiftScale", (_filter(sitk.ShiftScaleImageFilter, Shift=-3.0, Scale=2.5), 1)),
+  ("ShiftScaleFloat", (_filter(sitk.ShiftScaleImageFilter, Shift=1.5, Scale=-0.5, OutputPixelType=sitk.sitkFloat32), 1)),
+  ("IntensityWindowing", (_filter(sitk.IntensityWindowingImageFilter, WindowMinimum=-10.0, WindowMaximum=300.0,
+                                   OutputMinimum=0.0, OutputMaximum=100.0), 1)),
+  ("IntensityWindowing2", (_filter(sitk.IntensityWindowingImageFilter, WindowMinimum=10.5, WindowMaximum=120.5,
+                                    OutputMinimum=3.0, OutputMaximum=90.0), 1)),
+  ("InvertIntensity", (_filter(sitk.InvertIntensityImageFilter, Maximum=100.0), 1)),
+  ("Mask", (_filter(sitk.MaskImageFilter, OutsideValue=4.0, MaskingValue=0.0), 2)),
+  ("Mask2", (_filter(sitk.MaskImageFilter, OutsideValue=7.9, MaskingValue=1.0), 2)),
+  ("CastInt16", (_filter(sitk.CastImageFilter, OutputPixelType=sitk.sitkInt16), 1)),
+  ("CastFloat32", (_filter(sitk.CastImageFilter, OutputPixelType=sitk.sitkFloat32), 1)),
+  ("CastFloat64", (_filter(sitk.CastImageFilter, OutputPixelType=sitk.sitkFloat64), 1)),
+  ])
+
+
+def values(dtype, seed):
+  """Return test values of a dtype: its limits, values around zero and
+  random values, the integers are also drawn from a small range so the
+  binary filters see equal values"""
+  rng = np.random.RandomState(seed)
+  dtype = np.dtype(dtype)
+  if dtype.kind == 'f':
+    special = [0.0, -0.0, 1.0, -1.0, 0.5, -2.5, 100.25, -1e3, 1e6, 3.0]
+    random = rng.uniform(-300.0, 300.0, 54)
+  else:
+    info = np.iinfo(dtype)
+    special = [info.min, info.min+1, info.max-1, info.max, 0, 1, 2, 3, 100, 255]
+    if dtype.kind == 'i':
+      special += [-1, -2, -100]
+    special = [v for v in special if info.min <= v <= info.max]
+    low, high = max(int(info.min), -300), min(int(info.max), 300)
+    random = np.concatenate([rng.randint(low, high+1, 40), rng.randint(0, 4, 14)])
+  return np.concatenate([np.array(special, dtype=dtype), np.asarray(random).astype(dtype)])
+
+
+def image(arr):
+  img = sitk.GetImageFromArray(arr.reshape(1, 1, -1))
+  img.SetSpacing([0.5, 1.0, 2.0])
+  return img
+
+
+def executeFused(filters, images):
+  """Run the filters, each one on the output of the previous one, the
+  first on images, fused"""
+  steps = [PipelineStep(filters[0], [("input", k) for k in range(len(images))])]
+  for f in filters[1:]:
+    steps.append(PipelineStep(f, [("step", len(steps)-1)]))
+  leaves = OrderedDict((("input", k), img) for k, img in enumerate(images))
+  return Fusion.executeFused(steps, 0, len(steps)-1, leaves, numberOfWorkers=2)
+
+
+class FusionTest(unittest.TestCase):
+  """Tests of the fused execution of pointwise filters, against the
+  execution of the filters with SimpleITK"""
+
+  def assertSameOutput(self, fused, expected, message):
+    self.assertEqual(fused.GetPixelID(), expected.GetPixelID(), message)
+    self.assertEqual(fused.GetSize(), expected.GetSize(), message)
+    self.assertEqual(fused.GetSpacing(), expected.GetSpacing(), message)
+    actual, desired = sitk.GetArrayFromImage(fused), sitk.GetArrayFromImage(expected)
+    if actual.dtype.kind == 'f':
+      # the math library of numpy may differ from the C++ one by an ulp
+      np.testing.assert_allclose(actual, desired, rtol=1e-6, atol=0, equal_nan=True, err_msg=message)
+    else:
+      np.testing.assert_array_equal(actual, desired, err_msg=message)
+
+  def test_translators(self):
+    self.assertEqual(set(f().__class__.__name__ for f, arity in FILTERS.values()), set(Fusion._TRANSLATORS))
+    fusedCount = 0
+    for name, (create, arity) in FILTERS.items():
+      for pixelID in PIXEL_IDS:
+        dtype = sitk.GetArrayViewFromImage(sitk.Image([1, 1, 1], pixelID)).dtype
+        images = [image(values(dtype, 1))]
+        if name.startswith("Mask"):
+          images.append(image(values(np.uint8, 2) % 2))
+        elif arity == 2:
+          images.append(image(values(dtype, 2)))
+        message = f"{name} {sitk.GetPixelIDValueAsString(pixelID)}"
+        try:
+          expected = create().Execute(*images)
+        except RuntimeError:
+          # not instantiated for this pixel type
+          continue
+        fused = executeFused([create()], images)
+        if fused is None:
+          continue
+        fusedCount += 1
+        self.assertSameOutput(fused, expected, message)
+    # most of the filters and pixel types have a translation
+    self.assertGreater(fusedCount, len(FILTERS)*len(PIXEL_IDS)//2)
+
+  def test_chain(self):
+    img = image(values(np.int16, 3))
+    other = image(values(np.int16, 4))
+    shiftScale = _filter(sitk.ShiftScaleImageFilter, Shift=2.0, Scale=0.5, OutputPixelType=sitk.sitkFloat32)
+    clamp = _filter(sitk.ClampImageFilter, LowerBound=-50.0, UpperBound=50.0)
+    threshold = _filter(sitk.BinaryThresholdImageFilter, LowerThreshold=0.0, UpperThreshold=20.0)
+    filters = [sitk.AddImageFilter(), shiftScale(), clamp(), threshold()]
+
+    fused = executeFused(filters, [img, other])
+    expected = filters[0].Execute(img, other)
+    for f in filters[1:]:
+      expected = f.Execute(expected)
+    self.assertSameOutput(fused, expected, "chain")
+    self.assertEqual(fused.GetOrigin(), img.GetOrigin())
+
+  def test_chunks(self):
+    # several chunks are evaluated by the threads
+    arr = np.arange(2*Fusion.CHUNK_SIZE+17, dtype=np.float32).reshape(1, 1, -1)
+    img = sitk.GetImageFromArray(arr)
+    sqrt = sitk.SqrtImageFilter()
+    self.assertSameOutput(executeFused([sqrt], [img]), sqrt.Execute(img), "chunks")
+
+  def test_notFused(self):
+    img = image(values(np.float32, 5))
+    # different pixel types
+    self.assertIsNone(executeFused([sitk.AddImageFilter()], [img, image(values(np.int16, 6))]))
+    # different geometries
+    moved = image(values(np.float32, 6))
+    moved.SetOrigin([1.0, 0.0, 0.0])
+    self.assertIsNone(executeFused([sitk.AddImageFilter()], [img, moved]))
+    # a vector image
+    self.assertIsNone(executeFused([sitk.AbsImageFilter()], [sitk.Compose(img, img)]))
+    self.assertFalse(Fusion.isFusible(sitk.MedianImageFilter()))
+    self.assertTrue(Fusion.isFusible(sitk.AddImageFilter()))
+
+  def test_abort(self):
+    img = image(values(np.float32, 7))
+    steps = [PipelineStep(sitk.AbsImageFilter(), [("input", 0)])]
+    self.assertIsNone(Fusion.executeFused(steps, 0, 0, OrderedDict([(("input", 0), img)]),
+                                          abortCallback=lambda: True))
+
+  @unittest.skipUnless(Regions.canViewArrays(), "SimpleITK cannot wrap numpy arrays")
+  def test_executeInPlace(self):
+    arr = values(np.float32, 8).reshape(1, 1, -1)
+    img = sitk.GetImageViewFromArray(arr)
+    expected = sitk.Abs(sitk.GetImageFromArray(arr))
+    self.assertTrue(Fusion.canExecuteInPlace(sitk.AbsImageFilter(), [img], arr))
+    result = Fusion.executeInPlace(sitk.AbsImageFilter(), [img], arr)
+    self.assertSameOutput(result, expected, "in place")
+    np.testing.assert_array_equal(arr.reshape(-1), sitk.GetArrayViewFromImage(expected).reshape(-1))
+
+  def test_executeInPlaceAll(self):
+    # the output written over the buffer of the first input is the one of
+    # SimpleITK, for each filter whose output has the type of the input
+    inPlaceCount = 0
+    for name, (create, numberOfInputs) in FILTERS.items():
+      for pixelID in PIXEL_IDS:
+        dtype = Fusion._PIXEL_DTYPES[pixelID]
+        arr = values(dtype, 10)
+        images = [image(arr)]
+        if name.startswith("Mask"):
+          images.append(image(np.resize(values(np.uint8, 11) % 2, arr.size)))
+        elif numberOfInputs == 2:
+          images.append(image(np.resize(values(dtype, 11), arr.size)))
+        try:
+          expected = create().Execute(*images)
+        except RuntimeError:
+          # not instantiated for this pixel type
+          continue
+        message = f"{name} {sitk.GetPixelIDValueAsString(pixelID)}"
+        output = arr.reshape(1, 1, -1)
+        with mock.patch.object(Regions, "canViewArrays", return_value=True):
+          canExecute = Fusion.canExecuteInPlace(create(), images, output)
+        result = Fusion.executeInPlace(create(), images, output)
+        self.assertEqual(result is not None, canExecute, message)
+        if result is None:
+          continue
+        inPlaceCount += 1
+        self.assertEqual(expected.GetPixelID(), pixelID, message)
+        self.assertSameOutput(result, expected, message)
+        self.assertSameOutput(image(arr), expected, message)
+    self.assertGreater(inPlaceCount, len(FILTERS))
+
+  def test_canExecuteInPlace(self):
+    arr = values(np.int16, 9).reshape(1, 1, -1)
+    img = sitk.GetImageFromArray(arr)
+    # the output is uint8
+    self.assertFalse(Fusion.canExecuteInPlace(sitk.BinaryThresholdImageFilter(), [img], arr))
+    self.assertFalse(Fusion.canExecuteInPlace(sitk.MedianImageFilter(), [img], arr))
+    self.assertEqual(Fusion.canExecuteInPlace(sitk.AbsImageFilter(), [img], arr), Regions.canViewArrays())
+
+  def test_refuseInPlace(self):
+    arr = values(np.int16, 12).reshape(1, 1, -1)
+    img = sitk.GetImageFromArray(arr)
+    mask = np.resize(values(np.uint8, 13) % 2, arr.shape)
+    maskImage = sitk.GetImageFromArray(mask)
+    with mock.patch.object(Regions, "canViewArrays", return_value=True):
+      self.assertTrue(Fusion.canExecuteInPlace(sitk.AbsImageFilter(), [img], arr))
+      # an output of another pixel type
+      self.assertFalse(Fusion.canExecuteInPlace(sitk.BinaryThresholdImageFilter(), [img], arr))
+      cast = sitk.CastImageFilter()
+      cast.SetOutputPixelType(sitk.sitkFloat32)
+      self.assertFalse(Fusion.canExecuteInPlace(cast, [img], arr))
+      # the output is the image, not the mask
+      self.assertTrue(Fusion.canExecuteInPlace(sitk.MaskImageFilter(), [img, maskImage], arr))
+      self.assertFalse(Fusion.canExecuteInPlace(sitk.MaskImageFilter(), [img, maskImage], mask))
+      # a float mask is not fused
+      floatMask = sitk.Cast(maskImage, sitk.sitkFloat32)
+      self.assertFalse(Fusion.canExecuteInPlace(sitk.MaskImageFilter(), [img, floatMask], arr))
+      readOnly = arr.copy()
+      readOnly.flags.writeable = False
+      self.assertFalse(Fusion.canExecuteInPlace(sitk.AbsImageFilter(), [img], readOnly))
+
+    # the refused output is left unchanged
+    before = mask.copy()
+    self.assertIsNone(Fusion.executeInPlace(sitk.MaskImageFilter(), [img, maskImage], mask))
+    np.testing.assert_array_equal(mask, before)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,142 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import SimpleITK as sitk
+
+import SimpleFiltersTesting  # puts SimpleFiltersLib on the path
+from SimpleFiltersLib import MemoryBudget
+from SimpleFiltersLib.Pipeline import Pipeline
+from SimpleFiltersLib.Profiling import RunProfile
+
+
+class MemoryBudgetTest(unittest.TestCase):
+  """Tests of the estimate of the peak memory of the runs"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    # 4000 bytes
+    self.img = sitk.Image([10, 10, 10], sitk.sitkFloat32)
+
+  def tearDown(self):
+    shutil.rmtree(self.directory, ignore_errors=True)
+
+  def test_memoryBudget(self):
+    self.assertEqual(MemoryBudget.memoryBudget(1000), 1000)
+    available = MemoryBudget.availableMemory()
+    if available is None:
+      self.assertIsNone(MemoryBudget.memoryBudget())
+    else:
+      self.assertGreater(MemoryBudget.memoryBudget(0, 2**20), 2**20)
+
+  def test_estimatePeakMemory(self):
+    estimate = MemoryBudget.estimatePeakMemory([self.img], None, sitk.sitkFloat32)
+    self.assertEqual(dict(estimate.parts), {"output": 4000, "working": 8000})
+    self.assertEqual(estimate.total, 12000)
+    self.assertEqual((estimate.executeBytes, estimate.outputBytes), (8000, 4000))
+
+  def test_estimateReduced(self):
+    # a crop of half the voxels, pasted back into the full volume
+    estimate = MemoryBudget.estimatePeakMemory([self.img], None, sitk.sitkFloat32, workingFactor=0.5,
+                                               copiedBytes=1000, processedPixels=500, outputPixels=1000,
+                                               pushCopy=True)
+    self.assertEqual(dict(estimate.parts), {"pull": 1000, "crop": 2000, "output": 2000, "working": 2000,
+                                            "full size output": 4000, "push": 4000})
+
+  def test_estimateCast(self):
+    img = sitk.Image([10, 10, 10], sitk.sitkInt16)
+    estimate = MemoryBudget.estimatePeakMemory([img], [sitk.sitkFloat64], sitk.sitkFloat64, workingFactor=0.0)
+    self.assertEqual(dict(estimate.parts), {"cast": 8000, "output": 8000})
+
+    # without the pixel types of the filter, the retry casts to float
+    estimate = MemoryBudget.estimatePeakMemory([img], None, sitk.sitkFloat32, workingFactor=0.0, floatRetry=True)
+    self.assertEqual(dict(estimate.parts), {"float retry cast": 4000, "output": 4000})
+
+  def test_estimateVector(self):
+    img = sitk.Image([10, 10, 10], sitk.sitkVectorFloat32, 3)
+    estimate = MemoryBudget.estimatePeakMemory([img], None, sitk.sitkVectorFloat32, workingFactor=0.0)
+    self.assertEqual(estimate.outputBytes, 12000)
+
+  def test_checkBudget(self):
+    estimate = MemoryBudget.estimatePeakMemory([self.img], None, sitk.sitkFloat32)
+    MemoryBudget.checkBudget("Median", estimate, 12000)
+    MemoryBudget.checkBudget("Median", estimate, None)
+    with self.assertRaises(MemoryBudget.MemoryBudgetError) as cm:
+      MemoryBudget.checkBudget("Median", estimate, 10000, ["run it tiled"])
+    message = str(cm.exception)
+    self.assertIn("Median", message)
+    self.assertIn("run it tiled or raise the memory budget", message)
+    # it is a ValueError for the callers which do not know the budget
+    self.assertIsInstance(cm.exception, ValueError)
+
+  def test_imageInfo(self):
+    info = MemoryBudget.ImageInfo(1000, sitk.sitkInt16)
+    self.assertEqual(MemoryBudget.imageSizeInBytes(info), 2000)
+    estimate = MemoryBudget.estimatePeakMemory([info], None, sitk.sitkInt16, workingFactor=0.0)
+    self.assertEqual(estimate.total, 2000)
+
+  def test_estimatePipelinePeakMemory(self):
+    pipeline = Pipeline()
+    pipeline.addStep(sitk.MedianImageFilter())
+    pipeline.addStep(sitk.AbsImageFilter())
+    pipeline.addStep(sitk.AddImageFilter(), [("step", 1), ("input", 0)])
+    peak = MemoryBudget.estimatePipelinePeakMemory(pipeline, [self.img])
+    # the output of the first step is freed once the second one ran
+    self.assertEqual(dict(peak.parts), {"earlier outputs": 4000, "step 3 output": 4000, "step 3 working": 12000})
+    self.assertEqual(peak.executeBytes, 0)
+
+    # the output of a shown step stays in its node
+    pipeline.steps[0].display = True
+    peak = MemoryBudget.estimatePipelinePeakMemory(pipeline, [self.img], copiedBytes=100)
+    self.assertEqual(peak.parts["earlier outputs"], 8000)
+    self.assertEqual(peak.parts["pull"], 100)
+
+    factors = {"AbsImageFilter": 10.0}
+    peak = MemoryBudget.estimatePipelinePeakMemory(pipeline, [self.img],
+                                                   lambda name: factors.get(name, MemoryBudget.DEFAULT_WORKING_FACTOR))
+    self.assertEqual(peak.parts["step 2 working"], 80000)
+
+  def test_measuredWorkingFactor(self):
+    estimate = MemoryBudget.estimatePeakMemory([self.img], None, sitk.sitkFloat32)
+    profile = RunProfile("Median")
+    profile.addStage("pull", 0.0, 1.0)
+    self.assertIsNone(MemoryBudget.measuredWorkingFactor(profile, estimate))
+    profile.addStage("execute", 1.0, 2.0, startMemory=10000, sampledPeak=30000)
+    self.assertEqual(MemoryBudget.measuredWorkingFactor(profile, estimate), (30000-10000-4000)/8000)
+    # the last execution is the retry on float inputs
+    profile.addStage("execute", 2.0, 3.0, startMemory=10000, sampledPeak=12000)
+    self.assertEqual(MemoryBudget.measuredWorkingFactor(profile, estimate), 0.0)
+    self.assertIsNone(MemoryBudget.measuredWorkingFactor(profile, MemoryBudget.MemoryEstimate()))
+
+  def test_memoryModel(self):
+    fileName = os.path.join(self.directory, "memory", "model.json")
+    model = MemoryBudget.MemoryModel(fileName)
+    self.assertEqual(model.workingFactor("MedianImageFilter"), MemoryBudget.DEFAULT_WORKING_FACTOR)
+    for factor in [3.0] + [0.5]*MemoryBudget.MAX_SAMPLES:
+      model.record("MedianImageFilter", factor)
+    # the largest of the last factors
+    self.assertEqual(model.workingFactor("MedianImageFilter"), 0.5)
+    model.record("MedianImageFilter", 2.0)
+    model.save()
+    self.assertEqual(MemoryBudget.MemoryModel(fileName).workingFactor("MedianImageFilter"), 2.0)
+
+    estimate = MemoryBudget.estimatePeakMemory([self.img], None, sitk.sitkFloat32)
+    profile = RunProfile("Mean")
+    self.assertFalse(model.recordRun("MeanImageFilter", estimate, profile))
+    profile.addStage("execute", 0.0, 1.0, startMemory=0, sampledPeak=4000+8000*4)
+    self.assertTrue(model.recordRun("MeanImageFilter", estimate, profile))
+    self.assertEqual(model.workingFactor("MeanImageFilter"), 4.0)
+
+    model.clear()
+    self.assertEqual(MemoryBudget.MemoryModel(fileName).samples, {})
+
+  def test_memoryModelInvalid(self):
+    fileName = os.path.join(self.directory, "model.json")
+    with open(fileName, "w") as fp:
+      fp.write("[1, 2]")
+    self.assertEqual(MemoryBudget.MemoryModel(fileName).samples, {})
+
+
+if __name__ == '__main__':
+  unittest.main()
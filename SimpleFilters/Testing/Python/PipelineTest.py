@@ -0,0 +1,178 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+
+from SimpleFiltersTesting import filterDescription
+from SimpleFiltersLib.Pipeline import Pipeline, PipelineStep, PIPELINE_VERSION
+
+
+class PipelineTest(unittest.TestCase):
+  """Tests of the in-memory pipelines of filters"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory, ignore_errors=True)
+
+  @staticmethod
+  def image(seed=1, pixelID=sitk.sitkFloat32):
+    img = sitk.AdditiveGaussianNoise(sitk.Image([20, 16, 12], sitk.sitkFloat32), 20.0, 50.0, seed)
+    img.SetSpacing([0.5, 1.0, 1.5])
+    return sitk.Cast(img, pixelID)
+
+  def assertSameImage(self, result, expected):
+    self.assertEqual(result.GetPixelID(), expected.GetPixelID())
+    self.assertEqual(result.GetSize(), expected.GetSize())
+    self.assertEqual(result.GetSpacing(), expected.GetSpacing())
+    np.testing.assert_array_equal(sitk.GetArrayFromImage(result), sitk.GetArrayFromImage(expected))
+
+  def test_addStep(self):
+    pipeline = Pipeline()
+    first = pipeline.addStep(sitk.MedianImageFilter())
+    self.assertEqual(first.inputs, [("input", 0)])
+    second = pipeline.addStep(sitk.AbsImageFilter())
+    self.assertEqual(second.inputs, [("step", 0)])
+    pipeline.addStep(sitk.AddImageFilter(), [("step", 1), ("input", 1)])
+    self.assertEqual(pipeline.numberOfInputs(), 2)
+    with self.assertRaises(ValueError):
+      pipeline.addStep(sitk.AbsImageFilter(), [("step", 3)])
+    with self.assertRaises(ValueError):
+      pipeline.addStep(sitk.AbsImageFilter(), [("volume", 0)])
+
+  def test_removeStep(self):
+    pipeline = Pipeline()
+    pipeline.addStep(sitk.MedianImageFilter())
+    pipeline.addStep(sitk.AbsImageFilter())
+    pipeline.addStep(sitk.AddImageFilter(), [("step", 1), ("step", 0)])
+    pipeline.removeStep(1)
+    # the step using the removed output uses its input instead
+    self.assertEqual(pipeline.steps[1].inputs, [("step", 0), ("step", 0)])
+    pipeline.removeStep(0)
+    self.assertEqual(pipeline.steps[0].inputs, [("input", 0), ("input", 0)])
+
+  def test_lastUses(self):
+    pipeline = Pipeline()
+    pipeline.addStep(sitk.MedianImageFilter())
+    pipeline.addStep(sitk.AbsImageFilter())
+    pipeline.addStep(sitk.AddImageFilter(), [("step", 1), ("step", 0)])
+    self.assertEqual(pipeline.lastUses(), {0: 2, 1: 2})
+
+  def test_fusedRuns(self):
+    pipeline = Pipeline()
+    pipeline.addStep(sitk.MedianImageFilter())
+    pipeline.addStep(sitk.AbsImageFilter())
+    pipeline.addStep(sitk.SqrtImageFilter())
+    pipeline.addStep(sitk.MeanImageFilter())
+    pipeline.addStep(sitk.AbsImageFilter())
+    pipeline.addStep(sitk.SquareImageFilter(), display=True)
+    pipeline.addStep(sitk.SqrtImageFilter())
+    self.assertEqual(pipeline.fusedRuns(), [(1, 2), (4, 5)])
+
+    # an output used after the run is not fused away
+    pipeline.addStep(sitk.AddImageFilter(), [("step", 6), ("step", 4)])
+    self.assertEqual(pipeline.fusedRuns(), [(1, 2), (6, 7)])
+
+  def test_execute(self):
+    img, other = self.image(1), self.image(2)
+    median = sitk.MedianImageFilter()
+    median.SetRadius(1)
+    shiftScale = sitk.ShiftScaleImageFilter()
+    shiftScale.SetShift(-50.0)
+    shiftScale.SetScale(2.0)
+
+    pipeline = Pipeline()
+    pipeline.addStep(median)
+    pipeline.addStep(shiftScale)
+    pipeline.addStep(sitk.AbsImageFilter(), display=True)
+    pipeline.addStep(sitk.AddImageFilter(), [("step", 2), ("input", 1)])
+    pipeline.addStep(sitk.SqrtImageFilter())
+
+    displayed, ran = [], []
+    result = pipeline.execute([img, other], outputCallback=lambda index, output: displayed.append((index, output)),
+                              stepCallback=lambda first, last: ran.append((first, last)))
+
+    shown = sitk.Abs(shiftScale.Execute(median.Execute(img)))
+    self.assertSameImage(result, sitk.Sqrt(sitk.Add(shown, other)))
+    self.assertEqual([index for index, output in displayed], [2])
+    self.assertSameImage(displayed[0][1], shown)
+    self.assertEqual(ran[0], (0, 0))
+    self.assertEqual(ran[-1][1], 4)
+
+  def test_executeCast(self):
+    # the inputs of a step are cast as chosen by its json description
+    img = self.image(pixelID=sitk.sitkInt16)
+    derivative = sitk.DerivativeImageFilter()
+    pipeline = Pipeline()
+    pipeline.addStep(derivative, description=filterDescription("DerivativeImageFilter"))
+    result = pipeline.execute([img])
+    self.assertSameImage(result, derivative.Execute(sitk.Cast(img, sitk.sitkFloat32)))
+
+  def test_executeAbort(self):
+    pipeline = Pipeline()
+    pipeline.addStep(sitk.AbsImageFilter())
+    self.assertIsNone(pipeline.execute([self.image()], abortCallback=lambda: True))
+    with self.assertRaises(ValueError):
+      Pipeline().execute([self.image()])
+
+  def test_clone(self):
+    pipeline = Pipeline()
+    median = sitk.MedianImageFilter()
+    median.SetRadius(2)
+    pipeline.addStep(median, display=True, output="smoothed")
+    clone = pipeline.clone()
+    median.SetRadius(3)
+    self.assertEqual(clone.steps[0].filter.GetRadius(), (2, 2, 2))
+    self.assertEqual(clone.steps[0].output, "smoothed")
+    self.assertTrue(clone.steps[0].display)
+
+  def test_saveLoad(self):
+    pipeline = Pipeline()
+    pipeline.inputNames = ["volume", "mask"]
+    gaussian = sitk.DiscreteGaussianImageFilter()
+    gaussian.SetVariance([1.0, 2.0, 3.0])
+    gaussian.SetNumberOfThreads(2)
+    pipeline.addStep(gaussian, display=True, output="smoothed", description=filterDescription("DiscreteGaussianImageFilter"))
+    pipeline.addStep(sitk.MaskImageFilter(), [("step", 0), ("input", 1)], output="masked", outputLabelMap=True)
+
+    fileName = os.path.join(self.directory, "pipeline.json")
+    pipeline.save(fileName)
+    with open(fileName) as fp:
+      data = json.load(fp)
+    self.assertEqual(data["version"], PIPELINE_VERSION)
+    # the number of threads depends on the machine, it is not saved
+    self.assertNotIn("NumberOfThreads", data["steps"][0]["parameters"])
+
+    loaded = Pipeline.load(fileName, filterDescription)
+    self.assertEqual(loaded.inputNames, ["volume", "mask"])
+    self.assertEqual(len(loaded.steps), 2)
+    self.assertEqual(loaded.steps[0].filter.GetVariance(), (1.0, 2.0, 3.0))
+    self.assertEqual(loaded.steps[0].description["name"], "DiscreteGaussianImageFilter")
+    self.assertEqual(loaded.steps[1].inputs, [("step", 0), ("input", 1)])
+    self.assertEqual((loaded.steps[1].output, loaded.steps[1].outputLabelMap), ("masked", True))
+
+  def test_fromDictConversion(self):
+    # the json values are converted to the types of the members
+    data = {"filter": "DiscreteGaussianImageFilter",
+            "parameters": {"MaximumKernelWidth": 16.0, "Variance": [1, 2, 3], "UseImageSpacing": 0}}
+    step = PipelineStep.fromDict(data, filterDescription)
+    self.assertEqual(step.filter.GetMaximumKernelWidth(), 16)
+    self.assertEqual(step.filter.GetVariance(), (1.0, 2.0, 3.0))
+    self.assertFalse(step.filter.GetUseImageSpacing())
+
+  def test_fromDictErrors(self):
+    with self.assertRaises(ValueError):
+      PipelineStep.fromDict({"filter": "NoSuchImageFilter"})
+    with self.assertRaises(ValueError):
+      PipelineStep.fromDict({"filter": "MedianImageFilter", "parameters": {"NoSuchParameter": 1}})
+    with self.assertRaises(ValueError):
+      Pipeline.fromDict({"version": PIPELINE_VERSION+1, "steps": []})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+
+import SimpleITK as sitk
+
+import SimpleFiltersTesting  # puts SimpleFiltersLib on the path
+from SimpleFiltersLib import PixelTypes
+
+
+class PixelTypesTest(unittest.TestCase):
+  """Tests of the pixel types the inputs of a filter are cast to"""
+
+  def test_pixelIDs(self):
+    self.assertEqual(PixelTypes.pixelIDs("RealPixelIDTypeList"), {sitk.sitkFloat32, sitk.sitkFloat64})
+    self.assertEqual(PixelTypes.pixelIDs("typelist::Append<RealPixelIDTypeList, ComplexPixelIDTypeList>::Type"),
+                     {sitk.sitkFloat32, sitk.sitkFloat64, sitk.sitkComplexFloat32, sitk.sitkComplexFloat64})
+    self.assertEqual(PixelTypes.pixelIDs("typelist::MakeTypeList<BasicPixelID<uint8_t>, BasicPixelID<float> >::Type"),
+                     {sitk.sitkUInt8, sitk.sitkFloat32})
+    self.assertIsNone(PixelTypes.pixelIDs("UnknownPixelIDTypeList"))
+    self.assertIsNone(PixelTypes.pixelIDs(None))
+
+  def test_canRepresent(self):
+    self.assertTrue(PixelTypes.canRepresent(sitk.sitkUInt8, sitk.sitkInt16))
+    self.assertTrue(PixelTypes.canRepresent(sitk.sitkInt16, sitk.sitkFloat32))
+    self.assertTrue(PixelTypes.canRepresent(sitk.sitkFloat32, sitk.sitkFloat64))
+    self.assertFalse(PixelTypes.canRepresent(sitk.sitkInt8, sitk.sitkUInt16))
+    self.assertFalse(PixelTypes.canRepresent(sitk.sitkInt32, sitk.sitkFloat32))
+    self.assertFalse(PixelTypes.canRepresent(sitk.sitkFloat32, sitk.sitkInt64))
+
+  def test_narrowestPixelID(self):
+    supported = set(PixelTypes.TYPE_LISTS["SignedPixelIDTypeList"])
+    self.assertEqual(PixelTypes.narrowestPixelID(supported, [sitk.sitkUInt8]), sitk.sitkInt16)
+    self.assertEqual(PixelTypes.narrowestPixelID(supported, [sitk.sitkInt8, sitk.sitkUInt16]), sitk.sitkInt32)
+    # no integer type holds uint64, the widest real type is chosen
+    self.assertEqual(PixelTypes.narrowestPixelID(supported, [sitk.sitkUInt64]), sitk.sitkFloat64)
+    self.assertIsNone(PixelTypes.narrowestPixelID(supported, [sitk.sitkComplexFloat32]))
+
+  def test_castPixelIDs(self):
+    description = {"pixel_types": "RealPixelIDTypeList",
+                   "inputs": [{"name": "Image1"}, {"name": "Image2"}]}
+    self.assertTrue(PixelTypes.pixelTypesKnown(description))
+    self.assertEqual(PixelTypes.castPixelIDs(description, [sitk.sitkUInt8, sitk.sitkFloat32]),
+                     [sitk.sitkFloat32, None])
+    # no input needs a cast
+    self.assertIsNone(PixelTypes.castPixelIDs(description, [sitk.sitkFloat32, sitk.sitkFloat32]))
+
+  def test_castPixelIDsMask(self):
+    description = {"pixel_types": "RealPixelIDTypeList",
+                   "inputs": [{"name": "Image"}, {"name": "MaskImage"}]}
+    self.assertEqual(PixelTypes.castPixelIDs(description, [sitk.sitkInt16, sitk.sitkUInt8]),
+                     [sitk.sitkFloat32, None])
+
+  def test_castPixelIDsUnknown(self):
+    description = {"pixel_types": "UnknownPixelIDTypeList"}
+    self.assertFalse(PixelTypes.pixelTypesKnown(description))
+    self.assertFalse(PixelTypes.pixelTypesKnown(None))
+    self.assertIsNone(PixelTypes.castPixelIDs(description, [sitk.sitkUInt8]))
+
+  def test_castInputs(self):
+    description = {"pixel_types": "RealPixelIDTypeList", "inputs": [{"name": "Image"}]}
+    img = sitk.Image([4, 4, 4], sitk.sitkInt16)
+    castImage, = PixelTypes.castInputs(description, [img])
+    self.assertEqual(castImage.GetPixelID(), sitk.sitkFloat32)
+    self.assertEqual(castImage.GetSize(), img.GetSize())
+
+  def test_componentSize(self):
+    self.assertEqual(PixelTypes.componentSize(sitk.sitkUInt8), 1)
+    self.assertEqual(PixelTypes.componentSize(sitk.sitkVectorFloat64), 8)
+    self.assertEqual(PixelTypes.componentSize(sitk.sitkComplexFloat32), 8)
+    self.assertIsNone(PixelTypes.componentSize(sitk.sitkLabelUInt8))
+
+  def test_outputPixelID(self):
+    self.assertEqual(PixelTypes.outputPixelID({"output_pixel_type": "uint8_t"}, [sitk.sitkFloat32]), sitk.sitkUInt8)
+    self.assertEqual(PixelTypes.outputPixelID({}, [sitk.sitkInt16]), sitk.sitkInt16)
+    self.assertEqual(PixelTypes.outputPixelID({"output_pixel_type": "typename itk::NumericTraits<T>::RealType"},
+                                              [sitk.sitkVectorUInt8]), sitk.sitkVectorFloat64)
+    sitkFilter = sitk.CastImageFilter()
+    sitkFilter.SetOutputPixelType(sitk.sitkFloat64)
+    self.assertEqual(PixelTypes.outputPixelID(None, [sitk.sitkUInt8], sitkFilter), sitk.sitkFloat64)
+
+
+if __name__ == '__main__':
+  unittest.main()
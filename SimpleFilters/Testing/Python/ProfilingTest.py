@@ -0,0 +1,102 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+import SimpleFiltersTesting  # puts SimpleFiltersLib on the path
+from SimpleFiltersLib.Profiling import Profiler, RunProfile
+
+
+class ProfilingTest(unittest.TestCase):
+  """Tests of the profiles of the stages of the runs"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory, ignore_errors=True)
+
+  def test_nestedStages(self):
+    profile = RunProfile("Median")
+    copied = []
+    with profile.stage("run"):
+      with profile.stage("pull", lambda: sum(copied)):
+        copied.append(100)
+      with profile.stage("execute", sampleMemory=True):
+        pass
+    # a stage is recorded when it ends, the inner ones first
+    self.assertEqual([s.name for s in profile.stages], ["pull", "execute", "run"])
+    pull, execute, run = profile.stages
+    self.assertEqual(pull.nbytes, 100)
+    self.assertLessEqual(run.start, pull.start)
+    self.assertGreaterEqual(run.start+run.duration, execute.start+execute.duration)
+    self.assertEqual(run.thread, threading.current_thread().name)
+    self.assertIsNone(pull.sampledPeak)
+    if execute.startMemory is not None:
+      self.assertGreaterEqual(execute.sampledPeak, execute.startMemory)
+
+  def test_stageError(self):
+    profile = RunProfile("Median")
+    with self.assertRaises(RuntimeError):
+      with profile.stage("execute"):
+        raise RuntimeError("failed")
+    self.assertEqual([s.name for s in profile.stages], ["execute"])
+
+  def test_totals(self):
+    profile = RunProfile("Median")
+    self.assertEqual(profile.duration(), 0.0)
+    start = profile.startTime
+    profile.addStage("pull", start, start+1.0, 100)
+    profile.addStage("execute", start+1.0, start+3.0)
+    profile.addStage("pull", start+3.0, start+3.5, 50)
+    profile.addStage("push", start+3.5, start+4.0)
+    totals = profile.totals()
+    self.assertEqual(list(totals), ["pull", "execute", "push"])
+    self.assertAlmostEqual(totals["pull"][0], 1.5)
+    self.assertEqual(totals["pull"][1], 150)
+    self.assertIsNone(totals["execute"][1])
+    self.assertAlmostEqual(profile.duration(), 4.0)
+
+    summary = profile.summary().splitlines()
+    self.assertEqual(summary[0], "Median: 4.000s")
+    self.assertEqual(summary[1], "  pull: 1500.0 ms, 0.0 MB copied")
+    self.assertEqual(summary[2], "  execute: 2000.0 ms")
+
+  def test_writeTrace(self):
+    profiler = Profiler(maxRuns=2)
+    for name in ("Mean", "Median", "Abs"):
+      profile = RunProfile(name)
+      profile.addStage("execute", profile.startTime, profile.startTime+0.5, 10, startMemory=1, sampledPeak=2)
+      profiler.add(profile)
+    fname = os.path.join(self.directory, "trace.json")
+    profiler.writeTrace(fname)
+    with open(fname) as fp:
+      trace = json.load(fp)
+
+    self.assertEqual(trace["displayTimeUnit"], "ms")
+    events = trace["traceEvents"]
+    # the oldest run is dropped, each run has an event and one per stage
+    self.assertEqual([e["name"] for e in events], ["Median", "execute", "Abs", "execute"])
+    for e in events:
+      self.assertEqual(e["ph"], "X")
+      self.assertEqual(e["pid"], os.getpid())
+      for key in ("ts", "dur", "tid", "cat"):
+        self.assertIn(key, e)
+    run, stage = events[:2]
+    self.assertEqual(run["cat"], "run")
+    self.assertAlmostEqual(run["dur"], 0.5e6)
+    self.assertEqual(stage["cat"], "stage")
+    self.assertAlmostEqual(stage["dur"], 0.5e6)
+    self.assertEqual(stage["args"]["filter"], "Median")
+    self.assertEqual((stage["args"]["nbytes"], stage["args"]["startMemory"], stage["args"]["sampledPeak"]), (10, 1, 2))
+
+    profiler.clear()
+    profiler.writeTrace(fname)
+    with open(fname) as fp:
+      self.assertEqual(json.load(fp)["traceEvents"], [])
+
+
+if __name__ == '__main__':
+  unittest.main()
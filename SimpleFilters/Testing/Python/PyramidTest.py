@@ -0,0 +1,98 @@
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+
+import SimpleFiltersTesting  # puts SimpleFiltersLib on the path
+from SimpleFiltersLib import Pyramid
+
+
+class PyramidTest(unittest.TestCase):
+  """Tests of the draft resolution"""
+
+  @staticmethod
+  def image(size=(64, 48, 20)):
+    img = sitk.AdditiveGaussianNoise(sitk.Image(size, sitk.sitkFloat32), 10.0, 50.0, 5)
+    img.SetSpacing([0.5, 0.5, 2.0])
+    img.SetOrigin([1.0, 2.0, 3.0])
+    return img
+
+  def test_shrinkFactors(self):
+    self.assertEqual(Pyramid.shrinkFactors([64, 48, 20], 0), [1, 1, 1])
+    self.assertEqual(Pyramid.shrinkFactors([64, 48, 20], 1), [2, 2, 2])
+    # an axis is not shrunk below MINIMUM_SIZE voxels
+    self.assertEqual(Pyramid.shrinkFactors([64, 48, 20], 3), [8, 4, 2])
+
+  def test_shrinkUpsample(self):
+    img = self.image()
+    shrunk = Pyramid.shrinkImage(img, [2, 2, 2])
+    self.assertEqual(shrunk.GetSize(), (32, 24, 10))
+    self.assertEqual(shrunk.GetSpacing(), (1.0, 1.0, 4.0))
+    # the bins are averaged
+    self.assertAlmostEqual(shrunk[0, 0, 0], float(np.mean(sitk.GetArrayFromImage(img)[0:2, 0:2, 0:2])), places=3)
+    self.assertIs(Pyramid.shrinkImage(img, [1, 1, 1]), img)
+
+    upsampled = Pyramid.upsampleImage(shrunk, img)
+    self.assertEqual(upsampled.GetSize(), img.GetSize())
+    self.assertEqual(upsampled.GetOrigin(), img.GetOrigin())
+    self.assertEqual(upsampled.GetPixelID(), img.GetPixelID())
+
+  def test_shrinkLabel(self):
+    labels = sitk.Image([16, 16, 16], sitk.sitkUInt8)
+    labels[1, 1, 1] = 3
+    shrunk = Pyramid.shrinkImage(labels, [2, 2, 2], isLabel=True)
+    # the labels are sampled, not averaged
+    self.assertEqual(set(sitk.GetArrayViewFromImage(shrunk).ravel()) - {0, 3}, set())
+    upsampled = Pyramid.upsampleImage(shrunk, labels, isLabel=True)
+    self.assertEqual(set(sitk.GetArrayViewFromImage(upsampled).ravel()) - {0, 3}, set())
+
+  def test_scaleParameters(self):
+    median = sitk.MedianImageFilter()
+    median.SetRadius([4, 3, 1])
+    Pyramid.scaleParameters(median, None, [2, 2, 2])
+    self.assertEqual(median.GetRadius(), (2, 2, 1))
+
+    gaussian = sitk.DiscreteGaussianImageFilter()
+    gaussian.SetVariance([4.0, 4.0, 4.0])
+    Pyramid.scaleParameters(gaussian, None, [2, 2, 2])
+    # in physical units
+    self.assertEqual(gaussian.GetVariance(), (4.0, 4.0, 4.0))
+    gaussian.SetUseImageSpacing(False)
+    Pyramid.scaleParameters(gaussian, None, [2, 2, 2])
+    self.assertEqual(gaussian.GetVariance(), (1.0, 1.0, 1.0))
+
+  def test_scaleSeeds(self):
+    description = {"template_code_filename": "FastMarchingImageFilter", "members": []}
+    fastMarching = sitk.FastMarchingImageFilter()
+    fastMarching.SetTrialPoints([[10, 7, 4, 3]])
+    Pyramid.scaleParameters(fastMarching, description, [2, 2, 2])
+    self.assertEqual([list(p) for p in fastMarching.GetTrialPoints()], [[5, 3, 2, 3]])
+
+  def test_pyramidCache(self):
+    img = self.image()
+    cache = Pyramid.PyramidCache()
+    self.assertIs(cache.get("img", img, 0), img)
+    level1 = cache.get("img", img, 1)
+    self.assertEqual(level1.GetSize(), (32, 24, 10))
+    self.assertIs(cache.get("img", img, 1), level1)
+    level2 = cache.get("img", img, 2)
+    self.assertEqual(level2.GetSize(), (16, 12, 10))
+    self.assertEqual(cache.memoryUsed(), (32*24*10+16*12*10)*4)
+
+    # the geometry is part of the key
+    moved = sitk.Image(img)
+    moved.SetOrigin([0.0, 0.0, 0.0])
+    self.assertIsNot(cache.get("img", moved, 1), level1)
+
+  def test_pyramidCacheEvict(self):
+    img = self.image()
+    cache = Pyramid.PyramidCache(maxMemory=32*24*10*4)
+    cache.get("a", img, 1)
+    cache.get("b", img, 1)
+    self.assertEqual(cache.memoryUsed(), 32*24*10*4)
+    cache.clear()
+    self.assertEqual(cache.memoryUsed(), 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,104 @@
+import unittest
+
+import SimpleITK as sitk
+
+import SimpleFiltersTesting  # puts SimpleFiltersLib on the path
+from SimpleFiltersLib import Regions
+
+
+class RegionsTest(unittest.TestCase):
+  """Tests of the execution of a filter on a region of its inputs"""
+
+  @staticmethod
+  def image(size=(20, 18, 16)):
+    img = sitk.AdditiveGaussianNoise(sitk.Image(size, sitk.sitkFloat32), 10.0, 0.0, 7)
+    img.SetSpacing([0.5, 1.0, 2.0])
+    img.SetOrigin([10.0, -5.0, 3.0])
+    return img
+
+  def test_filterMargin(self):
+    spacing = [0.5, 1.0, 2.0]
+    median = sitk.MedianImageFilter()
+    median.SetRadius([1, 2, 3])
+    self.assertEqual(Regions.filterMargin(median, spacing), [1, 2, 3])
+
+    gaussian = sitk.DiscreteGaussianImageFilter()
+    gaussian.SetVariance([1.0, 1.0, 1.0])
+    self.assertEqual(Regions.filterMargin(gaussian, spacing), [6, 3, 2])
+    gaussian.SetUseImageSpacing(False)
+    self.assertEqual(Regions.filterMargin(gaussian, spacing), [3, 3, 3])
+
+    self.assertEqual(Regions.filterMargin(sitk.AbsImageFilter(), spacing), [0, 0, 0])
+
+  def test_isMarginExact(self):
+    self.assertTrue(Regions.isMarginExact(sitk.MedianImageFilter()))
+    self.assertFalse(Regions.isMarginExact(sitk.SmoothingRecursiveGaussianImageFilter()))
+
+  def test_regions(self):
+    imageSize = [20, 18, 16]
+    self.assertEqual(Regions.clampRegion([-2, 3, 10], [5, 4, 10], imageSize), ([0, 3, 10], [3, 4, 6]))
+    self.assertIsNone(Regions.clampRegion([20, 0, 0], [2, 2, 2], imageSize))
+    self.assertEqual(Regions.padRegion([1, 5, 5], [4, 4, 4], [2, 2, 2], imageSize), ([0, 3, 3], [7, 8, 8]))
+    self.assertEqual(Regions.sliceRegion(imageSize, 2, 7), ([0, 0, 7], [20, 18, 1]))
+    self.assertIsNone(Regions.sliceRegion(imageSize, 2, 16))
+
+  def test_cropImage(self):
+    img = self.image()
+    region = ([3, 4, 5], [6, 7, 8])
+    cropped = Regions.cropImage(img, region)
+    self.assertEqual(list(cropped.GetSize()), region[1])
+    self.assertEqual(cropped.GetOrigin(), img.TransformIndexToPhysicalPoint(region[0]))
+    self.assertEqual(cropped[0, 0, 0], img[3, 4, 5])
+
+  def test_exactMargin(self):
+    # the output of a filter with an exact margin on a padded region is
+    # the one of the whole volume
+    img = self.image()
+    median = sitk.MedianImageFilter()
+    median.SetRadius(2)
+    region = ([5, 4, 3], [8, 8, 8])
+    processedRegion = Regions.padRegion(region[0], region[1], Regions.filterMargin(median, img.GetSpacing()),
+                                        img.GetSize())
+    result = Regions.trimImage(median.Execute(Regions.cropImage(img, processedRegion)), processedRegion, region)
+    expected = Regions.cropImage(median.Execute(img), region)
+    self.assertEqual(result.GetOrigin(), expected.GetOrigin())
+    self.assertEqual(sitk.GetArrayFromImage(result).tolist(), sitk.GetArrayFromImage(expected).tolist())
+
+  def test_pasteImage(self):
+    img = self.image()
+    region = ([3, 4, 5], [6, 7, 8])
+    full = Regions.pasteImage(Regions.cropImage(img, region), region, img)
+    self.assertEqual(full.GetSize(), img.GetSize())
+    self.assertEqual(full.GetOrigin(), img.GetOrigin())
+    self.assertEqual(full[3, 4, 5], img[3, 4, 5])
+    self.assertEqual(full[0, 0, 0], 0.0)
+
+  def test_indexParameterNames(self):
+    description = {"template_code_filename": "RegionGrowingImageFilter",
+                   "members": [{"name": "Seed", "dim_vec": 1, "itk_type": "typename FilterType::IndexType"},
+                               {"name": "Radius", "dim_vec": 1, "itk_type": "typename FilterType::RadiusType"}]}
+    self.assertEqual(Regions.indexParameterNames(description), ["SeedList", "Seed"])
+    self.assertEqual(Regions.indexParameterNames(None), [])
+
+  def test_shiftIndexParameters(self):
+    region = ([5, 5, 5], [10, 10, 10])
+    regionGrowing = sitk.ConnectedThresholdImageFilter()
+    regionGrowing.SetSeedList([[6, 7, 8], [1, 1, 1]])
+    Regions.shiftIndexParameters(regionGrowing, ["SeedList"], region)
+    # the seed outside of the region is dropped
+    self.assertEqual([list(s) for s in regionGrowing.GetSeedList()], [[1, 2, 3]])
+
+    regionGrowing.SetSeedList([[1, 1, 1]])
+    with self.assertRaises(ValueError):
+      Regions.shiftIndexParameters(regionGrowing, ["SeedList"], region)
+
+  def test_shiftTrialPoints(self):
+    # the value of the trial points is kept
+    fastMarching = sitk.FastMarchingImageFilter()
+    fastMarching.SetTrialPoints([[6, 7, 8, 2]])
+    Regions.shiftIndexParameters(fastMarching, ["TrialPoints"], ([5, 5, 5], [10, 10, 10]))
+    self.assertEqual([list(p) for p in fastMarching.GetTrialPoints()], [[1, 2, 3, 2]])
+
+
+if __name__ == '__main__':
+  unittest.main()
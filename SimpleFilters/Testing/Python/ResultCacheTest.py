@@ -0,0 +1,150 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import SimpleITK as sitk
+import vtk
+
+import SimpleFiltersTesting  # puts SimpleFiltersLib on the path
+from SimpleFiltersLib.ResultCache import ResultCache, imageSizeInBytes
+
+
+class ResultCacheTest(unittest.TestCase):
+  """Tests of the cache of filter results"""
+
+  def setUp(self):
+    self.spillDirectory = tempfile.mkdtemp()
+    # image data of the volume nodes by ID, as in the scene
+    self.nodes = {}
+
+  def tearDown(self):
+    shutil.rmtree(self.spillDirectory, ignore_errors=True)
+
+  @staticmethod
+  def image(value, size=(16, 16, 16)):
+    img = sitk.Image(size, sitk.sitkFloat32)
+    img += value
+    return img
+
+  def sharedArray(self, nodeID="vtkMRMLScalarVolumeNode1"):
+    """Return a vtk array used as the scalars of the image data of a
+    volume node, and the node ID"""
+    vtkArray = vtk.vtkFloatArray()
+    imageData = vtk.vtkImageData()
+    imageData.GetPointData().SetScalars(vtkArray)
+    self.nodes[nodeID] = imageData
+    return vtkArray, nodeID
+
+  def nodeScalars(self, nodeID):
+    imageData = self.nodes.get(nodeID)
+    return imageData.GetPointData().GetScalars() if imageData is not None else None
+
+  def test_makeKey(self):
+    key = ResultCache.makeKey("MedianImageFilter", {"Radius": [1, 1, 1]}, ["input1"])
+    self.assertEqual(key, ResultCache.makeKey("MedianImageFilter", {"Radius": [1, 1, 1]}, ["input1"]))
+    self.assertNotEqual(key, ResultCache.makeKey("MedianImageFilter", {"Radius": [2, 1, 1]}, ["input1"]))
+    self.assertNotEqual(key, ResultCache.makeKey("MedianImageFilter", {"Radius": [1, 1, 1]}, ["input2"]))
+
+  def test_getPut(self):
+    cache = ResultCache()
+    img = self.image(1)
+    self.assertIsNone(cache.get("a"))
+    cache.put("a", img)
+    self.assertIs(cache.get("a"), img)
+    self.assertEqual((cache.hits, cache.misses), (1, 1))
+    self.assertEqual(cache.memoryUsed(), imageSizeInBytes(img))
+
+  def test_evict(self):
+    nbytes = imageSizeInBytes(self.image(0))
+    cache = ResultCache(maxMemory=2*nbytes)
+    cache.put("a", self.image(1))
+    cache.put("b", self.image(2))
+    # a is the most recently used, b is evicted
+    cache.get("a")
+    cache.put("c", self.image(3))
+    self.assertIsNone(cache.get("b"))
+    self.assertIsNotNone(cache.get("a"))
+    self.assertIsNotNone(cache.get("c"))
+    self.assertLessEqual(cache.memoryUsed(), 2*nbytes)
+
+  def test_disabled(self):
+    cache = ResultCache(maxMemory=0, nodeScalars=self.nodeScalars)
+    vtkArray, nodeID = self.sharedArray()
+    cache.put("a", self.image(1), vtkArray, nodeID)
+    cache.put("b", self.image(2))
+    self.assertIsNone(cache.get("a"))
+    self.assertIsNone(cache.get("b"))
+
+  def test_spill(self):
+    nbytes = imageSizeInBytes(self.image(0))
+    cache = ResultCache(maxMemory=nbytes, spillDirectory=self.spillDirectory, maxSpill=4*nbytes)
+    cache.put("a", self.image(1))
+    cache.put("b", self.image(2))
+    cache.flush()
+    self.assertEqual(cache.spillUsed(), nbytes)
+    self.assertEqual(len(os.listdir(self.spillDirectory)), 1)
+
+    img = cache.get("a")
+    self.assertEqual(img.GetPixel(0, 0, 0), 1.0)
+    # the file is removed once read, b is spilled in turn
+    cache.flush()
+    self.assertEqual(len(os.listdir(self.spillDirectory)), 1)
+    self.assertEqual(cache.get("b").GetPixel(0, 0, 0), 2.0)
+
+    cache.flush()
+    cache.clear()
+    self.assertEqual(os.listdir(self.spillDirectory), [])
+
+  def test_sharedEntries(self):
+    nbytes = imageSizeInBytes(self.image(0))
+    cache = ResultCache(maxMemory=nbytes, nodeScalars=self.nodeScalars)
+    vtkArray, nodeID = self.sharedArray()
+    cache.put("shared", self.image(1), vtkArray, nodeID)
+    self.assertTrue(cache.isShared(vtkArray))
+    # the voxels are held by the node, they are not counted
+    self.assertEqual(cache.memoryUsed(), 0)
+    self.assertEqual(cache.sharedMemoryUsed(), nbytes)
+    cache.put("a", self.image(2))
+    self.assertIsNotNone(cache.get("shared"))
+    self.assertIsNotNone(cache.get("a"))
+
+    cache.discardShared(vtkArray)
+    self.assertFalse(cache.isShared(vtkArray))
+    self.assertIsNone(cache.get("shared"))
+
+  def test_sharedUntilReplaced(self):
+    nbytes = imageSizeInBytes(self.image(0))
+    cache = ResultCache(maxMemory=2*nbytes, nodeScalars=self.nodeScalars)
+    vtkArray, nodeID = self.sharedArray()
+    # another holder of the array, as the vtk pipeline
+    holder = vtk.vtkImageData()
+    holder.GetPointData().SetScalars(vtkArray)
+    cache.put("shared", self.image(1), vtkArray, nodeID)
+    self.assertEqual(cache.sharedMemoryUsed(), nbytes)
+
+    # the node uses a new array, the other references do not keep the
+    # entry shared, it is counted and evicted as any other
+    self.nodes[nodeID] = vtk.vtkImageData()
+    self.assertGreater(vtkArray.GetReferenceCount(), 1)
+    self.assertEqual(cache.sharedMemoryUsed(), 0)
+    self.assertEqual(cache.memoryUsed(), nbytes)
+    cache.put("a", self.image(2))
+    cache.put("b", self.image(3))
+    self.assertIsNone(cache.get("shared"))
+
+    # without nodeScalars no entry is shared
+    cache = ResultCache(maxMemory=2*nbytes)
+    cache.put("shared", self.image(1), vtkArray, nodeID)
+    self.assertEqual(cache.sharedMemoryUsed(), 0)
+
+  def test_guard(self):
+    cache = ResultCache(nodeScalars=self.nodeScalars)
+    vtkArray, nodeID = self.sharedArray()
+    cache.put("a", self.image(1), vtkArray, nodeID)
+    vtkArray.Modified()
+    self.assertIsNone(cache.get("a"))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+import SimpleFiltersTesting  # puts SimpleFiltersLib on the path
+from SimpleFiltersLib import SearchIndex
+
+
+class SearchIndexTest(unittest.TestCase):
+  """Tests of the ranked search of the filters"""
+
+  def setUp(self):
+    self.index = SearchIndex.SearchIndex([2.0, 1.0])
+    self.names = ["Median", "Discrete Gaussian", "Smoothing Recursive Gaussian", "Log10", "Binary Threshold"]
+    descriptions = ["Applies a median filter to an image.",
+                    "Blurs an image by separable convolution with discrete gaussian kernels.",
+                    "Computes the smoothing of an image by convolution with the Gaussian kernels.",
+                    "Computes the log10 of each pixel.",
+                    "Binarize an input image by thresholding."]
+    for name, description in zip(self.names, descriptions):
+      self.index.add([name, description])
+
+  def found(self, query):
+    return [self.names[document] for document, score in self.index.search(query)]
+
+  def test_words(self):
+    self.assertEqual(SearchIndex.words("Log10ImageFilter"), ["log", "10", "image", "filter"])
+    self.assertEqual(SearchIndex.words("RGBToLuminance"), ["rgb", "to", "luminance"])
+    self.assertEqual(SearchIndex.words(None), [])
+
+  def test_trigrams(self):
+    self.assertEqual(SearchIndex.trigrams("ab"), {"$ab", "ab$"})
+    self.assertEqual(SearchIndex.trigrams("a"), {"$a$"})
+
+  def test_emptyQuery(self):
+    self.assertEqual(self.found(""), self.names)
+    self.assertEqual(self.found("   "), self.names)
+
+  def test_ranking(self):
+    # the names weigh more than the descriptions
+    found = self.found("gaussian")
+    self.assertEqual(set(found[:2]), {"Discrete Gaussian", "Smoothing Recursive Gaussian"})
+    self.assertEqual(self.found("median"), ["Median"])
+
+  def test_allTerms(self):
+    self.assertEqual(self.found("gaussian recursive"), ["Smoothing Recursive Gaussian"])
+    self.assertEqual(self.found("median threshold"), [])
+
+  def test_fuzzy(self):
+    self.assertIn("Smoothing Recursive Gaussian", self.found("gausian"))
+    self.assertEqual(self.found("thresh")[0], "Binary Threshold")
+
+  def test_substring(self):
+    # across the words of a name
+    self.assertEqual(self.found("discretegauss")[0], "Discrete Gaussian")
+    self.assertEqual(self.found("log10"), ["Log10"])
+
+
+if __name__ == '__main__':
+  unittest.main()
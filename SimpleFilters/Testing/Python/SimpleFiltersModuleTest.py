@@ -43,8 +43,115 @@ class SimpleFiltersTest(unittest.TestCase):
 
     # Run through all the loaded filters and get the widget to generate the GUI
     for filterIdx in range(testWidget.filterSelector.count):
-      someJSON=slicer.modules.SimpleFiltersWidget.jsonFilters[filterIdx]
+      # the items of the sorted selector hold the index of their stub
+      someStub=slicer.modules.SimpleFiltersWidget.filterStubs[testWidget.filterSelector.itemData(filterIdx)]
       testWidget.filterSelector.setCurrentIndex(filterIdx)
-      self.delayDisplay("Testing filter \"{}\" ({} of {}).".format(someJSON["name"], filterIdx, testWidget.filterSelector.count),msec=100 )
+      self.delayDisplay("Testing filter \"{}\" ({} of {}).".format(someStub.name, filterIdx, testWidget.filterSelector.count),msec=100 )
 
     return True
+
+  def test_SchedulerOrder(self):
+    """A queued job does not start before an older queued job writing
+    the same node"""
+    from SimpleFilters import SimpleFiltersJob, SimpleFiltersJobScheduler
+
+    class Job:
+      def __init__(self, inputNodeIDs, outputNodeID, status=SimpleFiltersJob.QUEUED):
+        self.name = outputNodeID
+        self.filter = None
+        self.tiled = False
+        self.inputNodeIDs = inputNodeIDs
+        self.outputNodeID = outputNodeID
+        self.status = status
+
+      def outputNodeIDs(self):
+        return [self.outputNodeID]
+
+      def start(self, numberOfThreads):
+        self.status = SimpleFiltersJob.RUNNING
+
+    scheduler = SimpleFiltersJobScheduler(maxConcurrentJobs=3)
+    # the running job writes the input of the first queued job
+    running = Job(["volume1"], "volume2", SimpleFiltersJob.RUNNING)
+    older = Job(["volume2"], "volume3")
+    newer = Job(["volume1"], "volume3")
+    other = Job(["volume1"], "volume4")
+    scheduler.jobs = [running, older, newer, other]
+    scheduler.startPendingJobs()
+
+    self.assertEqual(older.status, SimpleFiltersJob.QUEUED)
+    self.assertEqual(newer.status, SimpleFiltersJob.QUEUED)
+    self.assertEqual(other.status, SimpleFiltersJob.RUNNING)
+
+    running.status = SimpleFiltersJob.COMPLETED
+    scheduler.startPendingJobs()
+    self.assertEqual(older.status, SimpleFiltersJob.RUNNING)
+    self.assertEqual(newer.status, SimpleFiltersJob.QUEUED)
+
+  def test_InPlace(self):
+    """A pointwise filter whose output is its first input writes over the
+    voxels of the node, after the cached results sharing them are
+    discarded"""
+    import time
+    import numpy as np
+    import SimpleITK as sitk
+    from SimpleFilters import SimpleFiltersLogic
+    from SimpleFiltersLib import Regions
+    from SimpleFiltersLib.ResultCache import ResultCache
+    from SimpleFiltersLib.VolumeBridge import VolumeBridge
+    from SimpleFiltersTesting import filterDescription
+
+    if not Regions.canViewArrays():
+      self.skipTest("SimpleITK cannot wrap numpy arrays")
+
+    class Logic(SimpleFiltersLogic):
+      """Records whether the voxels of the node were still shared with a
+      cached result when the worker started writing them"""
+      def thread_inplace(self, sitkFilter, *inputImages):
+        inPlaceRuns.append(self.resultCache.isShared(scalars))
+        return SimpleFiltersLogic.thread_inplace(self, sitkFilter, *inputImages)
+
+    def volume(name, arr, className="vtkMRMLScalarVolumeNode"):
+      volumeNode = slicer.mrmlScene.AddNewNodeByClass(className, name)
+      slicer.util.updateVolumeFromArray(volumeNode, arr)
+      return volumeNode
+
+    def run(sitkFilter, outputNode, *inputs):
+      del inPlaceRuns[:]
+      logic.run(sitkFilter, outputNode, False, *inputs, filterDescription=filterDescription(sitkFilter.GetName()))
+      while logic.thread.is_alive() or logic.main_queue_running:
+        slicer.app.processEvents()
+        time.sleep(0.01)
+
+    inPlaceRuns = []
+    logic = Logic()
+    logic.showOutput = False
+    logic.showErrors = False
+    logic.resultCache = ResultCache(nodeScalars=VolumeBridge.nodeScalars)
+
+    arr = np.random.RandomState(0).randint(-100, 100, (4, 5, 6)).astype(np.int16)
+    node = volume("input", arr)
+    scalars = node.GetImageData().GetPointData().GetScalars()
+    logic.resultCache.put("earlier", sitk.GetImageFromArray(arr), scalars, node.GetID())
+
+    # the output is the one of Execute, written over the buffer of the node
+    run(sitk.AbsImageFilter(), node, node)
+    self.assertEqual(inPlaceRuns, [False])
+    self.assertIs(node.GetImageData().GetPointData().GetScalars(), scalars)
+    np.testing.assert_array_equal(slicer.util.arrayFromVolume(node), np.abs(arr))
+    self.assertIsNone(logic.resultCache.get("earlier"))
+
+    # an output of another pixel type is not written in place
+    threshold = sitk.BinaryThresholdImageFilter()
+    threshold.SetLowerThreshold(50)
+    expected = sitk.GetArrayFromImage(threshold.Execute(sitk.GetImageFromArray(np.abs(arr))))
+    run(threshold, node, node)
+    self.assertEqual(inPlaceRuns, [])
+    np.testing.assert_array_equal(slicer.util.arrayFromVolume(node), expected)
+
+    # nor is a mask, which is not the first input
+    image = volume("image", arr)
+    mask = volume("mask", (arr > 0).astype(np.uint8), "vtkMRMLLabelMapVolumeNode")
+    run(sitk.MaskImageFilter(), mask, image, mask)
+    self.assertEqual(inPlaceRuns, [])
+    np.testing.assert_array_equal(slicer.util.arrayFromVolume(mask), np.where(arr > 0, arr, 0))
@@ -0,0 +1,25 @@
+import json
+import os
+import sys
+
+#
+# Setup shared by the tests of SimpleFiltersLib
+#
+# The tests import SimpleFiltersLib from the module directory, so they
+# run from the source tree with any Python where SimpleITK is installed,
+# as well as in Slicer. Import this module before SimpleFiltersLib.
+#
+
+MODULE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# json descriptions of the filters
+JSON_DIR = os.path.join(MODULE_DIR, "Resources", "json")
+
+if MODULE_DIR not in sys.path:
+  sys.path.insert(0, MODULE_DIR)
+
+
+def filterDescription(name):
+  """Return the json description of a filter class name"""
+  with open(os.path.join(JSON_DIR, name+".json")) as fp:
+    return json.load(fp)
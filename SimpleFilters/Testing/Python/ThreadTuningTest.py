@@ -0,0 +1,81 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import SimpleFiltersTesting  # puts SimpleFiltersLib on the path
+from SimpleFiltersLib import ThreadTuning
+
+
+class ThreadTuningTest(unittest.TestCase):
+  """Tests of the tuning of the number of threads of the filters"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory, ignore_errors=True)
+
+  def test_sizeBucket(self):
+    self.assertEqual(ThreadTuning.sizeBucket(256**3), ThreadTuning.sizeBucket(2*256**3))
+    self.assertNotEqual(ThreadTuning.sizeBucket(64**3), ThreadTuning.sizeBucket(256**3))
+    self.assertEqual(ThreadTuning.sizeBucket(0), 0)
+
+  def test_candidateThreadCounts(self):
+    self.assertEqual(ThreadTuning.candidateThreadCounts(12), [1, 2, 4, 8, 12])
+    self.assertEqual(ThreadTuning.candidateThreadCounts(8), [1, 2, 4, 8])
+    self.assertEqual(ThreadTuning.candidateThreadCounts(1), [1])
+    self.assertEqual(ThreadTuning.candidateThreadCounts(0), [1])
+
+  def test_choose(self):
+    tuner = ThreadTuning.ThreadTuner()
+    numberOfPixels = 100**3
+    # the candidates are tried from the largest down
+    tried = []
+    for seconds in (1.0, 0.8, 1.2, 2.0):
+      n = tuner.choose("MedianImageFilter", numberOfPixels, 8)
+      tried.append(n)
+      tuner.record("MedianImageFilter", numberOfPixels, n, seconds)
+    self.assertEqual(tried, [8, 4, 2, 1])
+    # then the fastest one
+    self.assertEqual(tuner.choose("MedianImageFilter", numberOfPixels, 8), 4)
+    # other filters and sizes are tuned apart
+    self.assertEqual(tuner.choose("MeanImageFilter", numberOfPixels, 8), 8)
+    self.assertEqual(tuner.choose("MedianImageFilter", 10**3, 8), 8)
+
+  def test_median(self):
+    tuner = ThreadTuning.ThreadTuner()
+    for seconds in [1.0, 1.0, 10.0]:
+      tuner.record("MedianImageFilter", 1000, 2, seconds)
+    self.assertEqual(tuner.throughputs("MedianImageFilter", 1000), {2: 1000.0})
+    for seconds in [1.0]*ThreadTuning.MAX_SAMPLES:
+      tuner.record("MedianImageFilter", 1000, 2, seconds)
+    self.assertEqual(len(tuner.samples["MedianImageFilter"][str(ThreadTuning.sizeBucket(1000))]["2"]),
+                     ThreadTuning.MAX_SAMPLES)
+
+  def test_record(self):
+    tuner = ThreadTuning.ThreadTuner()
+    tuner.record("MedianImageFilter", 1000, 2, 0.0)
+    tuner.record("MedianImageFilter", 1000, 0, 1.0)
+    self.assertEqual(tuner.samples, {})
+
+  def test_saveLoad(self):
+    fileName = os.path.join(self.directory, "tuning", "threads.json")
+    tuner = ThreadTuning.ThreadTuner(fileName)
+    tuner.record("MedianImageFilter", 1000, 4, 0.5)
+    tuner.save()
+    self.assertEqual(ThreadTuning.ThreadTuner(fileName).throughputs("MedianImageFilter", 1000), {4: 2000.0})
+    tuner.clear()
+    with open(fileName) as fp:
+      self.assertEqual(json.load(fp), {})
+
+  def test_loadInvalid(self):
+    fileName = os.path.join(self.directory, "threads.json")
+    with open(fileName, "w") as fp:
+      fp.write("not json")
+    self.assertEqual(ThreadTuning.ThreadTuner(fileName).samples, {})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,131 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+
+import SimpleFiltersTesting  # puts SimpleFiltersLib on the path
+from SimpleFiltersLib import Regions
+from SimpleFiltersLib import Tiling
+
+
+class TilingTest(unittest.TestCase):
+  """Tests of the execution of a filter block by block"""
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.directory, ignore_errors=True)
+
+  @staticmethod
+  def image(size=(30, 25, 20), pixelID=sitk.sitkFloat32):
+    img = sitk.Cast(sitk.AdditiveGaussianNoise(sitk.Image(size, sitk.sitkFloat32), 20.0, 100.0, 3), pixelID)
+    img.SetSpacing([0.8, 1.0, 1.5])
+    img.SetOrigin([-4.0, 2.0, 7.0])
+    img.SetDirection([0.0, 1.0, 0.0, -1.0, 0.0, 0.0, 0.0, 0.0, 1.0])
+    return img
+
+  def assertSameImage(self, result, expected):
+    self.assertEqual(result.GetSize(), expected.GetSize())
+    self.assertEqual(result.GetPixelID(), expected.GetPixelID())
+    np.testing.assert_allclose(result.GetOrigin(), expected.GetOrigin())
+    np.testing.assert_allclose(result.GetSpacing(), expected.GetSpacing())
+    np.testing.assert_allclose(result.GetDirection(), expected.GetDirection())
+    np.testing.assert_array_equal(sitk.GetArrayViewFromImage(result), sitk.GetArrayViewFromImage(expected))
+
+  def test_tilingMargin(self):
+    median = sitk.MedianImageFilter()
+    median.SetRadius(2)
+    self.assertEqual(Tiling.tilingMargin(median, [1.0]*3), [2, 2, 2])
+    self.assertEqual(Tiling.tilingMargin(sitk.AddImageFilter(), [1.0]*3), [0, 0, 0])
+    opening = sitk.GrayscaleMorphologicalOpeningImageFilter()
+    opening.SetKernelRadius(1)
+    self.assertEqual(Tiling.tilingMargin(opening, [1.0]*3), [2, 2, 2])
+    with self.assertRaises(Tiling.TilingError):
+      Tiling.tilingMargin(sitk.GradientAnisotropicDiffusionImageFilter(), [1.0]*3)
+    with self.assertRaises(Tiling.TilingError):
+      Tiling.tilingMargin(sitk.LaplacianSharpeningImageFilter(), [1.0]*3)
+
+  def test_blockRegions(self):
+    blocks = Tiling.blockRegions(([2, 0, 1], [10, 5, 3]), (4, 5, 2))
+    self.assertEqual(len(blocks), 3*1*2)
+    self.assertEqual(blocks[0], ([2, 0, 1], [4, 5, 2]))
+    self.assertEqual(blocks[-1], ([10, 0, 3], [2, 5, 1]))
+    self.assertEqual(sum(np.prod(size) for index, size in blocks), 10*5*3)
+
+  def test_executeTiled(self):
+    img = self.image()
+    median = sitk.MedianImageFilter()
+    median.SetRadius(2)
+    result = Tiling.executeTiled(median, [img], blockSize=(8, 8, 8), numberOfWorkers=3)
+    self.assertSameImage(result.image, median.Execute(img))
+
+  def test_executeTiledBinary(self):
+    img = self.image()
+    other = self.image(pixelID=sitk.sitkFloat32) * 0.5
+    result = Tiling.executeTiled(sitk.SubtractImageFilter(), [img, other], blockSize=(7, 9, 11))
+    self.assertSameImage(result.image, sitk.Subtract(img, other))
+
+  def test_executeTiledRegion(self):
+    img = self.image()
+    mean = sitk.MeanImageFilter()
+    mean.SetRadius([1, 2, 1])
+    region = ([3, 4, 5], [20, 15, 10])
+    result = Tiling.executeTiled(mean, [img], region=region, blockSize=(8, 8, 8))
+    self.assertSameImage(result.image, Regions.cropImage(mean.Execute(img), region))
+
+    result = Tiling.executeTiled(mean, [img], region=region, fullSizeOutput=True, blockSize=(8, 8, 8))
+    expected = Regions.pasteImage(Regions.cropImage(mean.Execute(img), region), region, img)
+    self.assertSameImage(result.image, expected)
+
+  def test_executeTiledCast(self):
+    img = self.image(pixelID=sitk.sitkInt16)
+    gaussian = sitk.DiscreteGaussianImageFilter()
+    gaussian.SetVariance(1.0)
+    result = Tiling.executeTiled(gaussian, [img], blockSize=(16, 16, 16), castPixelIDs=[sitk.sitkFloat32])
+    self.assertSameImage(result.image, gaussian.Execute(sitk.Cast(img, sitk.sitkFloat32)))
+
+  def test_executeTiledRecursiveGaussian(self):
+    # the infinite impulse response is close to the whole volume one
+    img = self.image()
+    gaussian = sitk.SmoothingRecursiveGaussianImageFilter()
+    gaussian.SetSigma(1.0)
+    result = Tiling.executeTiled(gaussian, [img], blockSize=(10, 10, 10))
+    np.testing.assert_allclose(sitk.GetArrayViewFromImage(result.image),
+                               sitk.GetArrayFromImage(gaussian.Execute(img)), rtol=1e-4, atol=1e-3)
+
+  def test_executeTiledFile(self):
+    img = self.image()
+    fileName = os.path.join(self.directory, "input.mha")
+    sitk.WriteImage(img, fileName)
+    median = sitk.MedianImageFilter()
+    median.SetRadius(1)
+    result = Tiling.executeTiled(median, [Tiling.FileSource(fileName)], blockSize=(8, 8, 8),
+                                 outputDirectory=self.directory)
+    self.assertIsInstance(result.buffer, np.memmap)
+    self.assertSameImage(result.image, median.Execute(img))
+
+  def test_progressAbort(self):
+    img = self.image()
+    progress = []
+    result = Tiling.executeTiled(sitk.AbsImageFilter(), [img], blockSize=(10, 10, 10),
+                                 progressCallback=progress.append)
+    self.assertIsNotNone(result)
+    self.assertEqual(progress[-1], 1.0)
+    self.assertEqual(progress, sorted(progress))
+
+    result = Tiling.executeTiled(sitk.AbsImageFilter(), [img], blockSize=(10, 10, 10),
+                                 abortCallback=lambda: True)
+    self.assertIsNone(result)
+
+  def test_sizeChange(self):
+    shrink = sitk.ShrinkImageFilter()
+    with self.assertRaises(Tiling.TilingError):
+      Tiling.executeTiled(shrink, [self.image()])
+
+
+if __name__ == '__main__':
+  unittest.main()
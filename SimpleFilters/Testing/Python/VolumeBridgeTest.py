@@ -0,0 +1,161 @@
+import gc
+import unittest
+
+import numpy as np
+import SimpleITK as sitk
+import vtk
+
+import SimpleFiltersTesting  # puts SimpleFiltersLib on the path
+from SimpleFiltersLib.ResultCache import ResultCache
+from SimpleFiltersLib.VolumeBridge import VolumeBridge
+
+
+class VolumeNode:
+  """The methods of vtkMRMLScalarVolumeNode used by VolumeBridge.push,
+  so the buffers can be checked without Slicer"""
+
+  def __init__(self, nodeID="vtkMRMLScalarVolumeNode1"):
+    self.nodeID = nodeID
+    self.imageData = None
+    self.origin = (0.0, 0.0, 0.0)
+    self.spacing = (1.0, 1.0, 1.0)
+    self.directions = vtk.vtkMatrix4x4()
+    self.modified = 0
+
+  def GetID(self):
+    return self.nodeID
+
+  def GetImageData(self):
+    return self.imageData
+
+  def SetAndObserveImageData(self, imageData):
+    self.imageData = imageData
+    self.Modified()
+
+  def GetDisplayNode(self):
+    return self
+
+  def StartModify(self):
+    return 0
+
+  def EndModify(self, wasModifying):
+    pass
+
+  def Modified(self):
+    self.modified += 1
+
+  def SetOrigin(self, *origin):
+    self.origin = origin
+
+  def SetSpacing(self, spacing):
+    self.spacing = tuple(spacing)
+
+  def SetIJKToRASDirectionMatrix(self, directions):
+    self.directions.DeepCopy(directions)
+
+
+class VolumeBridgeTest(unittest.TestCase):
+  """Tests of the exchange of voxel buffers with the volume nodes"""
+
+  def setUp(self):
+    self.node = VolumeNode()
+
+  @staticmethod
+  def image(value, size=(12, 10, 8)):
+    img = sitk.AdditiveGaussianNoise(sitk.Image(size, sitk.sitkFloat32), 10.0, value, int(value)+1)
+    img.SetSpacing([0.5, 1.0, 2.0])
+    return img
+
+  def nodeScalars(self, nodeID):
+    return self.node.GetImageData().GetPointData().GetScalars() if nodeID == self.node.GetID() else None
+
+  def assertNodeVoxels(self, expected):
+    np.testing.assert_array_equal(VolumeBridge.arrayFromNode(self.node), sitk.GetArrayFromImage(expected))
+
+  def test_pushAdopts(self):
+    bridge = VolumeBridge()
+    img = self.image(1)
+    expected = sitk.Image(img)
+    expected.MakeUnique()
+    vtkArray = bridge.push(img, self.node)
+    self.assertIs(self.node.GetImageData().GetPointData().GetScalars(), vtkArray)
+    self.assertTrue(VolumeBridge.isAdopted(vtkArray))
+    self.assertEqual(bridge.copiedBytes, 0)
+    self.assertEqual(self.node.spacing, (0.5, 1.0, 2.0))
+
+    # the image lives as long as the array, not as its Python wrapper
+    key = vtkArray.__this__
+    del img, vtkArray
+    gc.collect()
+    self.assertIn(key, VolumeBridge._adoptedImages)
+    self.assertNodeVoxels(expected)
+
+    self.node.SetAndObserveImageData(None)
+    gc.collect()
+    self.assertNotIn(key, VolumeBridge._adoptedImages)
+
+  def test_copyIntoNode(self):
+    bridge = VolumeBridge()
+    # the scalars of a volume loaded in the scene
+    imageData = vtk.vtkImageData()
+    imageData.SetDimensions(12, 10, 8)
+    imageData.AllocateScalars(vtk.VTK_FLOAT, 1)
+    self.node.SetAndObserveImageData(imageData)
+    scalars = imageData.GetPointData().GetScalars()
+    mtime = scalars.GetMTime()
+
+    img = self.image(1)
+    self.assertIsNone(bridge.push(img, self.node, share=False))
+    self.assertIs(self.node.GetImageData().GetPointData().GetScalars(), scalars)
+    self.assertGreater(scalars.GetMTime(), mtime)
+    self.assertEqual(bridge.copiedBytes, 12*10*8*4)
+    self.assertNodeVoxels(img)
+
+    # another size is not copied into the array
+    other = self.image(2, size=(6, 5, 4))
+    bridge.push(other, self.node, share=False)
+    self.assertIsNot(self.node.GetImageData().GetPointData().GetScalars(), scalars)
+    self.assertNodeVoxels(other)
+
+  def test_sharedBufferNotWritten(self):
+    bridge = VolumeBridge()
+    cache = ResultCache(nodeScalars=self.nodeScalars)
+    cached = self.image(1)
+    expected = sitk.GetArrayFromImage(cached)
+    vtkArray = bridge.push(cached, self.node)
+    cache.put("result", cached, vtkArray, self.node.GetID())
+
+    # the cached image shares the buffer of the node, a result copied to
+    # the node gets an array of its own
+    img = self.image(2)
+    bridge.push(img, self.node, share=False, isShared=cache.isShared)
+    self.assertIsNot(self.node.GetImageData().GetPointData().GetScalars(), vtkArray)
+    self.assertNodeVoxels(img)
+    np.testing.assert_array_equal(sitk.GetArrayViewFromImage(cache.get("result")), expected)
+
+  def test_reuseAdoptedBuffer(self):
+    bridge = VolumeBridge()
+    cache = ResultCache(nodeScalars=self.nodeScalars)
+    vtkArray = bridge.push(self.image(1), self.node)
+
+    # without isShared an adopted array is never written over
+    bridge.push(self.image(2), self.node, share=False)
+    self.assertIsNot(self.node.GetImageData().GetPointData().GetScalars(), vtkArray)
+
+    # no cached image shares the buffer, it is written over
+    vtkArray = self.node.GetImageData().GetPointData().GetScalars()
+    self.assertTrue(VolumeBridge.isAdopted(vtkArray))
+    img = self.image(3)
+    bridge.push(img, self.node, share=False, isShared=cache.isShared)
+    self.assertIs(self.node.GetImageData().GetPointData().GetScalars(), vtkArray)
+    self.assertNodeVoxels(img)
+
+  def test_noReuse(self):
+    bridge = VolumeBridge(reuseBuffers=False)
+    vtkArray = bridge.push(self.image(1), self.node)
+    bridge.push(self.image(2), self.node, share=False, isShared=lambda array: False)
+    self.assertIsNot(self.node.GetImageData().GetPointData().GetScalars(), vtkArray)
+
+
+if __name__ == '__main__':
+  unittest.main()